@@ -19,5 +19,8 @@ if len(sys.argv) > 1 and sys.argv[1] == "update":
             )
     else:
         tests.generate_all()
+elif len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+    from tests import benchmark
+    sys.exit(1 if benchmark.main(sys.argv[2:]) else 0)
 else:
     tests.run()
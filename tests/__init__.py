@@ -36,7 +36,7 @@ class YamlConfig():
         self._config = {}
         if os.path.exists(filename):
             with codecs.open(filename, encoding="utf-8") as f:
-                self._config = yaml.load(f)
+                self._config = yaml.safe_load(f)
 
     def get(self, section, option):
         """ Get config value for given section and option key. """
@@ -0,0 +1,327 @@
+"""
+Python-Markdown Benchmarks
+==========================
+
+Time the construction of the parser, the conversion of every document of
+the test corpora and each stage of the pipeline, plus a few large synthetic
+documents. Results are written as ``name:time:memory`` lines (seconds and
+bytes), the format of the ``benchmark.dat`` files stored with each corpus,
+and compared to the stored results to report regressions:
+
+    python run-tests.py benchmark           # compare to the stored results
+    python run-tests.py benchmark update    # store the new results
+    python run-tests.py benchmark skips     # inline patterns and block processors skipped
+
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+import codecs
+import gc
+import glob
+import os
+import subprocess
+import sys
+import timeit
+import zmarkdown
+from zmarkdown.extensions import urlize
+from . import get_config, test_dir
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    # Python 2: memory is not measured
+    tracemalloc = None
+
+REPEAT = 5
+# A result is a regression when it is slower than the stored one by both
+TOLERANCE = 0.25  # this ratio
+MIN_DELTA = 0.0005  # and this time in seconds
+OUTPUT_DIR = os.path.join(os.path.dirname(test_dir), 'tmp', 'benchmark')
+
+CORPORA = [
+    # name, directory, pattern of the documents
+    ('basic', 'basic', '*'),
+    ('misc', 'misc', '*'),
+    ('zds', 'zds', 'rediger_sur_zds_part*'),
+]
+
+# Caches shared by the instances, whose statistics are printed
+CACHES = [
+    ('regex cache', zmarkdown.util.regex_cache),
+    ('url cache', zmarkdown.inlinepatterns.url_cache),
+    ('urlize cache', urlize.url_cache),
+]
+
+
+def read_results(filename):
+    """ Read a benchmark file into a dict of ``name: (time, memory)``. """
+    results = {}
+    if os.path.exists(filename):
+        with codecs.open(filename, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    name, time, memory = line.rsplit(':', 2)
+                    results[name] = (float(time), float(memory))
+    return results
+
+
+def write_results(filename, results):
+    """ Write a list of ``(name, time, memory)`` to a benchmark file. """
+    directory = os.path.dirname(filename)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with codecs.open(filename, 'w', encoding='utf-8') as f:
+        for name, time, memory in results:
+            f.write('%s:%f:%f\n' % (name, time, memory))
+
+
+def compare(results, stored, tolerance=TOLERANCE, min_delta=MIN_DELTA):
+    """ Return the ``(name, stored time, time)`` of the regressions. """
+    regressions = []
+    for name, time, memory in results:
+        if name in stored:
+            old = stored[name][0]
+            if time > old * (1 + tolerance) and time - old > min_delta:
+                regressions.append((name, old, time))
+    return regressions
+
+
+def best_time(func, repeat=REPEAT):
+    """ Return the best wall time of `repeat` calls of `func`. """
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def peak_memory(func):
+    """ Return the peak of memory allocated during a call of `func`. """
+    if tracemalloc is None:  # pragma: no cover
+        return 0.0
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        return float(tracemalloc.get_traced_memory()[1])
+    finally:
+        tracemalloc.stop()
+
+
+def stage_times(md, source, repeat=REPEAT):
+    """ Return the best time of each stage of the conversion of `source`. """
+    best = {}
+    for _ in range(repeat):
+        md.reset()
+        data = source
+        for stage in md.stages:
+            start = timeit.default_timer()
+            data = getattr(md, stage)(data)
+            elapsed = timeit.default_timer() - start
+            best[stage] = min(best.get(stage, elapsed), elapsed)
+    return best
+
+
+def bench_documents(documents, construction_args, repeat=REPEAT):
+    """
+    Benchmark a list of ``(name, source, args)`` documents.
+
+    Return the list of results: the construction of a ZMarkdown instance
+    with `construction_args`, the conversion of every document, and the
+    total time of each stage over all the documents.
+    """
+    results = [('construction',
+                best_time(lambda: zmarkdown.ZMarkdown(**construction_args), repeat),
+                peak_memory(lambda: zmarkdown.ZMarkdown(**construction_args)))]
+    stages = {}
+    for name, source, args in documents:
+        md = zmarkdown.ZMarkdown(**args)
+        results.append((name,
+                        best_time(lambda: md.convert(source), repeat),
+                        peak_memory(lambda: md.convert(source))))
+        for stage, time in stage_times(md, source, repeat).items():
+            stages[stage] = stages.get(stage, 0) + time
+    for stage in zmarkdown.ZMarkdown.stages:
+        results.append(('stage-%s' % stage, stages.get(stage, 0), 0.0))
+    return results
+
+
+# Code run in a new process: time of `statement`, and peak of memory
+# allocated by it when traced
+IMPORT_SCRIPT = """
+import sys, timeit
+if %(trace)s:
+    import tracemalloc
+    tracemalloc.start()
+start = timeit.default_timer()
+%(statement)s
+elapsed = timeit.default_timer() - start
+memory = tracemalloc.get_traced_memory()[1] if %(trace)s else 0
+print('%%f %%d' %% (elapsed, memory))
+"""
+INLINE_CONVERSION = ('from zmarkdown.extensions.zds import ZdsExtension;'
+                     'zmarkdown.ZMarkdown(extensions=[ZdsExtension(inline=True)]).convert("*text*")')
+COLD_STARTS = [
+    ('import-zmarkdown', 'import zmarkdown'),
+    ('import-zds', 'import zmarkdown.extensions.zds'),
+    ('first-inline-conversion', 'import zmarkdown;' + INLINE_CONVERSION),
+    ('first-conversion', 'import zmarkdown;'
+                         'from zmarkdown.extensions.zds import ZdsExtension;'
+                         'zmarkdown.ZMarkdown(extensions=[ZdsExtension()]).convert("```python\\nx = 1\\n```")'),
+]
+
+
+def cold_start(statement, repeat=REPEAT):
+    """
+    Run `statement` in new processes.
+
+    Return the best time of `repeat` runs, and the peak of memory allocated
+    by the statement in another run, where memory is traced.
+    """
+    # Import the tested package, not an installed one
+    path = [os.path.dirname(test_dir)] + [p for p in os.environ.get('PYTHONPATH', '').split(os.pathsep) if p]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path))
+
+    def run(trace):
+        script = IMPORT_SCRIPT % {'statement': statement, 'trace': trace}
+        elapsed, memory = subprocess.check_output([sys.executable, '-c', script], env=env).split()
+        return float(elapsed), float(memory)
+
+    times = [run(False)[0] for _ in range(repeat)]
+    # Tracing slows the run down, its time is not kept
+    return min(times), run(True)[1] if tracemalloc is not None else 0.0
+
+
+def bench_imports(repeat=REPEAT):
+    """ Benchmark the cold start of a process. """
+    return [(name,) + cold_start(statement, repeat) for name, statement in COLD_STARTS]
+
+
+def skip_counts(documents, categories=('inlinepattern', 'inlinepattern.skip')):
+    """
+    Return the ``(name, tried, skipped, ...)`` call counts in each of the
+    stats `categories` over the conversion of `documents`, the most tried
+    first.
+    """
+    counts = {}
+    for _, source, args in documents:
+        md = zmarkdown.ZMarkdown(profile=True, **args)
+        md.convert(source)
+        for index, category in enumerate(categories):
+            for name, entry in md.stats.category(category).items():
+                counts.setdefault(name, [0] * len(categories))[index] += entry.calls
+    return sorted(((name,) + tuple(calls) for name, calls in counts.items()), key=lambda count: -count[1])
+
+
+def print_skips():
+    """
+    Print the inline patterns and block processors skipped over each corpus,
+    with the number of block processors tested for each block.
+    """
+    for name, directory, pattern in CORPORA:
+        documents, _ = corpus_documents(os.path.join(test_dir, directory), pattern)
+        for kind, categories in (('patterns', ('inlinepattern', 'inlinepattern.skip')),
+                                 ('block processors', ('blockprocessor.test', 'blockprocessor.skip',
+                                                       'blockprocessor.run'))):
+            counts = skip_counts(documents, categories)
+            tried = sum(count[1] for count in counts)
+            skipped = sum(count[2] for count in counts)
+            print('%s: %d %s tried, %d skipped (%.0f%%)' %
+                  (name, tried, kind, skipped, 100.0 * skipped / (tried + skipped) if tried + skipped else 0))
+            if len(categories) > 2:
+                # Each block is claimed by the run of a processor
+                blocks = sum(count[3] for count in counts)
+                print('    %.1f tests per block, %.1f without skips' %
+                      (float(tried) / blocks if blocks else 0, float(tried + skipped) / blocks if blocks else 0))
+            for count in counts:
+                print('    %-32s %8d %8d' % count[:3])
+
+
+def corpus_documents(directory, pattern):
+    """ Return the ``(name, source, args)`` of the documents of a corpus. """
+    config = get_config(directory)
+    documents = []
+    for path in sorted(glob.glob(os.path.join(directory, pattern))):
+        root, ext = os.path.splitext(path)
+        # Sections are named after the files without their extension
+        section = config.get_section(root)
+        if ext != config.get(section, 'input_ext') or config.get(section, 'skip'):
+            continue
+        with codecs.open(path, encoding='utf-8') as f:
+            documents.append((os.path.basename(root), f.read(), config.get_args(root)))
+    return documents, config.get_args(config.DEFAULT_SECTION)
+
+
+def synthetic_documents():
+    """ Return large generated documents, in the format of `corpus_documents`. """
+    zds_documents, zds_args = corpus_documents(os.path.join(test_dir, 'zds'), 'rediger_sur_zds_part*')
+    paragraph = ('Some *emphasis*, **strong text**, `code`, a [link](http://example.com "title"), '
+                 'an <http://example.com/auto/link> and some & special < characters.\n'
+                 'A second line with _underscores_ and an ![image](/img.png).')
+    # Hundreds of inline elements in each paragraph
+    dense_paragraph = ' '.join("l'item %d &amp; \\*%d\\* :) -- %d..." % (i, i, i) for i in range(300))
+    # Forum posts full of smileys
+    emoticons = sorted(zds_args['extension_configs']['zmarkdown.extensions.zds']['emoticons'])
+    forum_post = ' '.join('Message %d %s' % (i, emoticons[i % len(emoticons)]) for i in range(100))
+    # Quoted posts repeating the same links
+    link_post = '\n'.join('> [Tutoriel %d](https://zestedesavoir.com/tutoriels/%d/) sur zestedesavoir.com' % (i, i)
+                          for i in range(20))
+    # A thousand links and emphasis spans in a single paragraph
+    wide_paragraph = ' '.join('[link %d](http://example.com/%d) and *emphasis %d*' % (i, i, i) for i in range(1000))
+    # Block-level html every five paragraphs, inline html in the others
+    raw_html_paragraph = ('<div class="block">%d</div>\n\n' + '\n\n'.join(
+        ['Some <span>inline</span> <b>html</b> &amp; <!-- comment -->'] * 4))
+    # Ten thousand short blocks of every kind
+    block_kinds = ['Paragraph %d', '# Title %d', '> Quote %d', '* Item %d', '    Code %d', '1. Item %d']
+    documents = [
+        ('large-zds-document', '\n\n'.join(source for _, source, _ in zds_documents) * 5, zds_args),
+        ('long-paragraphs', '\n\n'.join([paragraph] * 2000), {}),
+        ('nested-lists', '\n'.join('%s* item %d with *emphasis*' % ('    ' * (i % 4), i)
+                                   for i in range(3000)), {}),
+        ('many-references', '\n\n'.join(['See [reference %d][ref%d].' % (i, i) for i in range(1000)] +
+                                        ['[ref%d]: http://example.com/%d' % (i, i) for i in range(1000)]), {}),
+        ('dense-paragraphs', '\n\n'.join([dense_paragraph] * 5), zds_args),
+        ('smileys', '\n\n'.join([forum_post] * 50), zds_args),
+        ('glossary', '\n\n'.join([' '.join('ABBR%d' % i for i in range(0, 200, 7))] * 500 +
+                                 ['*[ABBR%d]: Abbreviation %d' % (i, i) for i in range(200)]),
+         {'extensions': ['zmarkdown.extensions.abbr']}),
+        ('repeated-links', '\n\n'.join([link_post] * 100), zds_args),
+        ('wide-paragraph', wide_paragraph, {}),
+        ('raw-html', '\n\n'.join([raw_html_paragraph % i for i in range(600)]), {}),
+        ('large-table', '\n'.join(['| A | B | C |', '|---|---|---|'] +
+                                  ['| *a%d* | `b%d` | c%d |' % (i, i, i) for i in range(3000)]), zds_args),
+        ('many-blocks', '\n\n'.join(block_kinds[i % len(block_kinds)] % i for i in range(10000)), {}),
+    ]
+    return documents, {}
+
+
+def benchmarks():
+    """ Return the ``(name, stored results file, benchmark function)`` of the benchmarks. """
+    for name, directory, pattern in CORPORA:
+        directory = os.path.join(test_dir, directory)
+        yield (name, os.path.join(directory, 'benchmark.dat'),
+               lambda directory=directory, pattern=pattern: bench_documents(*corpus_documents(directory, pattern)))
+    yield 'synthetic', os.path.join(test_dir, 'benchmark.dat'), lambda: bench_documents(*synthetic_documents())
+    yield 'import', os.path.join(test_dir, 'import.dat'), bench_imports
+
+
+def main(args):
+    """ Run the benchmarks and return the number of regressions. """
+    if 'skips' in args:
+        print_skips()
+        return 0
+    update = 'update' in args
+    regressions = 0
+    for name, stored_file, run in benchmarks():
+        results = run()
+        if update:
+            write_results(stored_file, results)
+            print('Stored %d results in %s' % (len(results), stored_file))
+            continue
+        write_results(os.path.join(OUTPUT_DIR, '%s.dat' % name), results)
+        found = compare(results, read_results(stored_file))
+        total = sum(time for _, time, _ in results)
+        print('%s: %d results, %.3fs, %d regressions' % (name, len(results), total, len(found)))
+        for entry, old, new in found:
+            print('    %s: %.6fs -> %.6fs (%+.0f%%)' % (entry, old, new, (new / old - 1) * 100 if old else 100))
+        regressions += len(found)
+    for name, cache in CACHES:
+        stats = cache.stats()
+        print('%s: %d misses, %d hits (%.1f%%)' % (name, stats['misses'], stats['hits'], 100 * stats['hit_rate']))
+    return regressions
@@ -9,6 +9,7 @@ Tests of the various APIs with the python markdown lib.
 
 from __future__ import unicode_literals
 import unittest
+import re
 import sys
 import types
 import zmarkdown
@@ -50,6 +51,484 @@ class TestMarkdownBasics(unittest.TestCase):
         zmarkdown.ZMarkdown(extensions=['zmarkdown.extensions.footnotes:FootnoteExtension'])
 
 
+class TestZMarkdownTemplate(unittest.TestCase):
+    """ Tests of the ZMarkdownTemplate class. """
+
+    def setUp(self):
+        from zmarkdown.extensions.footnotes import FootnoteExtension
+        self.template = zmarkdown.ZMarkdownTemplate(extensions=[FootnoteExtension()])
+
+    def testConvert(self):
+        """ Test ZMarkdownTemplate.convert. """
+        self.assertEqual(self.template.convert('foo'), '<p>foo</p>')
+
+    def testRendererIsShared(self):
+        """ Test that every document is converted by the same renderer. """
+        self.assertTrue(self.template.renderer() is self.template.renderer())
+
+    def testConcurrentBuild(self):
+        """ Test that threads converting their first document share a single build. """
+        import threading
+        builds = []
+        build = self.template.build
+
+        def counted_build():
+            builds.append(None)
+            return build()
+        self.template.build = counted_build
+        threads = [threading.Thread(target=self.template.convert, args=('foo',)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(builds), 1)
+
+    def testNoStateLeak(self):
+        """ Test that a document does not see the state of the previous one. """
+        self.template.convert('[foo]: http://example.com')
+        self.assertEqual(self.template.convert('[foo]'), '<p>[foo]</p>')
+
+    def testEscapedCharsNotShared(self):
+        """ Test that extensions do not alter other instances escaped chars. """
+        from zmarkdown.extensions.subsuperscript import SubSuperscriptExtension
+        zmarkdown.ZMarkdown(extensions=[SubSuperscriptExtension()])
+        self.assertNotIn('~', zmarkdown.ZMarkdown().ESCAPED_CHARS)
+
+
+class TestConvertBatch(unittest.TestCase):
+    """ Tests of the batch conversion API. """
+
+    def setUp(self):
+        self.sources = ['# Title %d\n\nfoo[^1]\n\n[^1]: note %d' % (i, i) for i in range(20)]
+        self.extensions = ['zmarkdown.extensions.footnotes', 'zmarkdown.extensions.title_anchor:TitleAnchorExtension']
+        self.expected = [zmarkdown.ZMarkdown(extensions=self.extensions).convert(source)
+                         for source in self.sources]
+
+    def testProcessPool(self):
+        """ Test converting documents with several worker processes. """
+        results = zmarkdown.convert_batch(self.sources, workers=2, extensions=self.extensions)
+        self.assertEqual([html for html, _ in results], self.expected)
+        self.assertEqual([metadata['toc'][0].title for _, metadata in results],
+                         ['Title %d' % i for i in range(20)])
+
+    def testSingleProcess(self):
+        """ Test converting documents in the current process. """
+        template = zmarkdown.ZMarkdownTemplate(extensions=self.extensions)
+        results = template.convert_many(self.sources, workers=1)
+        self.assertEqual([html for html, _ in results], self.expected)
+
+
+class TestRenderContext(unittest.TestCase):
+    """ Tests of the per-document render context. """
+
+    def setUp(self):
+        self.md = self.build()
+
+    def build(self):
+        from zmarkdown.extensions.abbr import AbbrExtension
+        from zmarkdown.extensions.footnotes import FootnoteExtension
+        return zmarkdown.ZMarkdown(extensions=[AbbrExtension(), FootnoteExtension()])
+
+    def testAbbreviationsDoNotLeak(self):
+        """ Test that abbreviations are only defined for their document. """
+        self.assertIn('<abbr', self.md.convert('HTML\n\n*[HTML]: Hyper Text Markup Language'))
+        self.assertNotIn('abbr', self.md.inlinePatterns)
+        html = self.md.convert('HTML and XML\n\n*[XML]: Extensible Markup Language')
+        self.assertNotIn('Hyper Text Markup Language', html)
+        self.assertEqual(html, '<p>HTML and <abbr title="Extensible Markup Language">XML</abbr></p>')
+        self.assertEqual(self.md.convert('HTML'), '<p>HTML</p>')
+
+    def testFootnotesDoNotLeak(self):
+        """ Test that footnotes are only defined for their document. """
+        self.assertIn('class="footnote"', self.md.convert('Text[^1]\n\n[^1]: Note'))
+        self.assertEqual(self.md.convert('Text[^1]'), '<p>Text[^1]</p>')
+
+    def testConcurrentConversions(self):
+        """ Test that one instance converts documents from several threads. """
+        import threading
+
+        sources = ['%s[^1] %s HTML [link][%s]\n\n'
+                   '[^1]: Note %s\n\n'
+                   '*[HTML]: Markup %s\n\n'
+                   '[%s]: http://example.com/%s' % ((i,) * 7) for i in range(8)]
+        expected = [self.build().convert(src) for src in sources]
+        results = {}
+
+        def convert(i):
+            results[i] = [self.md.convert(sources[i]) for _ in range(20)]
+
+        threads = [threading.Thread(target=convert, args=(i,)) for i in range(len(sources))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for i, html in enumerate(expected):
+            self.assertEqual(results[i], [html] * 20)
+
+
+class TestRenderCache(unittest.TestCase):
+    """ Tests of the render cache. """
+
+    extensions = ['zmarkdown.extensions.footnotes',
+                  'zmarkdown.extensions.title_anchor:TitleAnchorExtension']
+    source = '# Title\n\nSome text[^1].\n\n[^1]: A note.'
+
+    def testMemoryCache(self):
+        """ Test that a document is only rendered once. """
+        backend = zmarkdown.cache.MemoryCache()
+        md = zmarkdown.ZMarkdown(extensions=self.extensions, cache=backend)
+        first = md.convert(self.source)
+        toc = md.metadata['toc']
+        self.assertEqual(md.convert(self.source), first)
+        self.assertEqual(md.metadata['toc'], toc)
+        self.assertEqual(backend.stats()['hits'], 1)
+        self.assertEqual(backend.stats()['misses'], 1)
+        self.assertEqual(first, zmarkdown.ZMarkdown(extensions=self.extensions).convert(self.source))
+
+    def testCachedMetadataNotShared(self):
+        """ Test that the metadata of a cached document can be altered. """
+        md = zmarkdown.ZMarkdown(extensions=self.extensions, cache=zmarkdown.cache.MemoryCache())
+        md.convert(self.source)
+        md.metadata['toc'].append('garbage')
+        md.convert(self.source)
+        self.assertNotIn('garbage', md.metadata['toc'])
+
+    def testConfigurationInKey(self):
+        """ Test that instances with another configuration do not share entries. """
+        backend = zmarkdown.cache.MemoryCache()
+        zmarkdown.ZMarkdown(cache=backend).convert('*a*')
+        zmarkdown.ZMarkdown(cache=backend, inline=True).convert('*a*')
+        zmarkdown.ZMarkdown(cache=backend).convert('*a*')
+        self.assertEqual(backend.stats()['misses'], 2)
+        self.assertEqual(backend.stats()['hits'], 1)
+
+    def testFingerprintCallables(self):
+        """ Test the fingerprint of a configuration holding callables. """
+        from zmarkdown.extensions.ping import PingExtension
+
+        def fingerprint(ping_url):
+            return zmarkdown.cache.fingerprint(zmarkdown.ZMarkdown(extensions=[PingExtension(ping_url=ping_url)]))
+
+        def member_url(name, prefix='/membres/', suffix=None):
+            return prefix + name
+        self.assertEqual(fingerprint(member_url), fingerprint(member_url))
+        self.assertNotEqual(fingerprint(member_url), fingerprint(lambda name: '/membres/' + name))
+        self.assertNotEqual(fingerprint(len), fingerprint(member_url))
+
+    def testCallablesInKey(self):
+        """ Test that lambdas and closures given as configs are told apart. """
+        from zmarkdown.extensions.ping import PingExtension
+
+        def member_url(prefix):
+            return lambda name: prefix + name
+
+        backend = zmarkdown.cache.MemoryCache()
+        outputs = []
+        for ping_url in (lambda name: '/a/' + name, lambda name: '/b/' + name,
+                         member_url('/c/'), member_url('/d/')):
+            md = zmarkdown.ZMarkdown(extensions=[PingExtension(ping_url=ping_url)], cache=backend)
+            outputs.append(md.convert('@Clem'))
+        self.assertEqual(len(set(outputs)), 4)
+        self.assertEqual(backend.stats()['hits'], 0)
+
+    def testUncacheableConfiguration(self):
+        """ Test that a configuration which can not be fingerprinted disables the cache. """
+        from zmarkdown.extensions.ping import PingExtension
+
+        class Members(object):
+            def __init__(self, prefix):
+                self.prefix = prefix
+
+            def url(self, name):
+                return self.prefix + name
+
+        backend = zmarkdown.cache.MemoryCache()
+        for prefix in ('/a/', '/b/'):
+            md = zmarkdown.ZMarkdown(extensions=[PingExtension(ping_url=Members(prefix).url)], cache=backend)
+            self.assertIn(prefix + 'Clem', md.convert('@Clem'))
+        self.assertEqual(backend.stats()['entries'], 0)
+
+    def testEviction(self):
+        """ Test that the memory cache is bounded by the size of the html. """
+        backend = zmarkdown.cache.MemoryCache(max_size=30)
+        md = zmarkdown.ZMarkdown(cache=backend)
+        for text in ('first', 'second', 'third'):
+            md.convert(text)
+        self.assertEqual(backend.stats()['entries'], 2)
+        self.assertTrue(backend.stats()['size'] <= 30)
+
+    def testSqliteCache(self):
+        """ Test the sqlite cache backend. """
+        import os
+        import tempfile
+        fd, path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        try:
+            md = zmarkdown.ZMarkdown(extensions=self.extensions, cache=zmarkdown.cache.SqliteCache(path))
+            html = md.convert(self.source)
+            md = zmarkdown.ZMarkdown(extensions=self.extensions, cache=zmarkdown.cache.SqliteCache(path))
+            key = zmarkdown.cache.cache_key(md, self.source)
+            self.assertEqual(md.cache.get(key)[0], html)
+            self.assertEqual(md.convert(self.source), html)
+            self.assertEqual(md.metadata['toc'][0].title, 'Title')
+        finally:
+            os.remove(path)
+
+
+class TestIncrementalRenderer(unittest.TestCase):
+    """ Tests of the incremental renderer. """
+
+    source = '\n\n'.join(['# Title', 'Some *text* and a [link][ref].', '- a\n- b', '* c',
+                          '```\ncode\n\nmore code\n```', 'Last paragraph.', '[ref]: http://example.com'])
+
+    def setUp(self):
+        from zmarkdown.incremental import IncrementalRenderer
+        self.md = zmarkdown.ZMarkdown(extensions=['zmarkdown.extensions.fenced_code',
+                                                  'zmarkdown.extensions.title_anchor:TitleAnchorExtension'])
+        self.renderer = IncrementalRenderer(self.md)
+
+    def full(self, source):
+        md = zmarkdown.ZMarkdown(extensions=['zmarkdown.extensions.fenced_code',
+                                             'zmarkdown.extensions.title_anchor:TitleAnchorExtension'])
+        return md.convert(source), md.metadata
+
+    def testSegments(self):
+        """ Test that blocks which may interact are kept together. """
+        from zmarkdown.incremental import split_segments
+        segments, definitions = split_segments(self.source)
+        self.assertEqual(len(segments), 4)
+        self.assertEqual(segments[1], 'Some *text* and a [link][ref].\n\n- a\n- b\n\n* c\n')
+        self.assertEqual(segments[2], '```\ncode\n\nmore code\n```\n')
+        self.assertEqual(definitions, '[ref]: http://example.com')
+
+    def testSameOutput(self):
+        """ Test that the output matches a full conversion. """
+        html = self.renderer.convert(self.source)
+        self.assertEqual((html, self.md.metadata), self.full(self.source))
+        self.assertEqual(self.renderer.rendered, 4)
+
+    def testReuse(self):
+        """ Test that only the edited block is rendered again. """
+        self.renderer.convert(self.source)
+        source = self.source.replace('Last paragraph.', 'Last *edited* paragraph.')
+        html = self.renderer.convert(source)
+        self.assertEqual((html, self.md.metadata), self.full(source))
+        self.assertEqual(self.renderer.rendered, 1)
+        self.assertEqual(self.renderer.reused, 3)
+
+    def testDefinitionsChange(self):
+        """ Test that changing a definition renders every block again. """
+        self.renderer.convert(self.source)
+        source = self.source.replace('http://example.com', 'http://example.org')
+        self.assertEqual(self.renderer.convert(source), self.full(source)[0])
+        self.assertEqual(self.renderer.rendered, 4)
+
+    def testFallback(self):
+        """ Test that global constructs are converted as a whole. """
+        for source in ['# Title\n\n# Title', 'Text[^1]\n\n[^1]: note', '```\nunclosed\n\ncode']:
+            self.assertEqual(self.renderer.convert(source), self.full(source)[0])
+            self.assertEqual(self.renderer.rendered, 1)
+            self.assertEqual(self.renderer.reused, 0)
+
+
+class TestConvertFile(unittest.TestCase):
+    """ Tests of the streaming conversion. """
+
+    source = '\n\n'.join(['# Title', 'Some *text* and a [link][ref].', '```\ncode\n\nmore code\n```',
+                          '# Title', 'Last paragraph with an ABBR.', '[ref]: http://example.com',
+                          '*[ABBR]: Abbreviation'])
+
+    def setUp(self):
+        self.extensions = ['zmarkdown.extensions.fenced_code', 'zmarkdown.extensions.abbr',
+                           'zmarkdown.extensions.title_anchor:TitleAnchorExtension']
+        self.md = zmarkdown.ZMarkdown(extensions=self.extensions)
+        md = zmarkdown.ZMarkdown(extensions=self.extensions)
+        self.html = md.convert(self.source)
+        self.metadata = md.metadata
+
+    def testIterConvert(self):
+        """ Test that fragments are yielded block by block. """
+        fragments = list(self.md.iter_convert(self.source.split('\n')))
+        self.assertEqual(len(fragments), 5)
+        self.assertEqual('\n'.join(fragments), self.html)
+        self.assertEqual(self.md.metadata, self.metadata)
+
+    def testFileObjects(self):
+        """ Test conversion from a binary file to a text file. """
+        import io
+        output = io.StringIO()
+        self.md.convert_file(io.BytesIO(self.source.encode('utf-8')), output)
+        self.assertEqual(output.getvalue(), self.html)
+
+    def testFileNames(self):
+        """ Test conversion between files given by name. """
+        import io
+        import os
+        import shutil
+        import tempfile
+        directory = tempfile.mkdtemp()
+        try:
+            infile = os.path.join(directory, 'in.md')
+            outfile = os.path.join(directory, 'out.html')
+            with io.open(infile, 'w', encoding='utf-8') as f:
+                f.write(self.source)
+            self.md.convert_file(infile, outfile)
+            with io.open(outfile, encoding='utf-8') as f:
+                self.assertEqual(f.read(), self.html)
+        finally:
+            shutil.rmtree(directory)
+
+    def testFallback(self):
+        """ Test that documents with footnotes are converted as a whole. """
+        md = zmarkdown.ZMarkdown(extensions=['zmarkdown.extensions.footnotes'])
+        source = 'Text[^1]\n\nMore text\n\n[^1]: A note.'
+        self.assertEqual(list(md.iter_convert(iter(source.split('\n')))), [md.convert(source)])
+
+    def testMaxSize(self):
+        """ Test that a long file is converted as plain text. """
+        import io
+        md = zmarkdown.ZMarkdown(max_size=20)
+        source = '*a longer* <text>\n\n& more'
+        for infile in (io.StringIO(source), iter(source.split('\n'))):
+            self.assertEqual(list(md.iter_convert(infile)), [md.convert(source)])
+            self.assertIn('size', md.metadata['budget_exceeded'])
+        self.assertEqual(list(md.iter_convert(io.StringIO('*short*'))), ['<p><em>short</em></p>'])
+
+
+class TestProfile(unittest.TestCase):
+    """ Tests of the profiling of conversions. """
+
+    def testDisabled(self):
+        """ Test that nothing is recorded by default. """
+        md = zmarkdown.ZMarkdown()
+        md.convert('*text*')
+        self.assertIsNone(md.stats)
+
+    def testStats(self):
+        """ Test that stages and processors are recorded. """
+        md = zmarkdown.ZMarkdown(profile=True)
+        md.convert('# Title\n\nSome *text*\n\n> quote')
+        stats = md.stats.as_dict()
+        self.assertEqual(list(stats['stage']), list(md.stages))
+        self.assertEqual(stats['blockprocessor.test']['hashheader']['hits'], 1)
+        self.assertEqual(stats['blockprocessor.run']['quote']['calls'], 1)
+        self.assertEqual(stats['inlinepattern']['emphasis']['hits'], 1)
+        self.assertIn('inline', stats['treeprocessor'])
+        self.assertIn('raw_html', stats['postprocessor'])
+        self.assertIn('normalize_whitespace', stats['preprocessor'])
+        self.assertIn('emphasis', md.stats.report())
+
+    def testNewStatsPerDocument(self):
+        """ Test that each conversion gets its own stats. """
+        md = zmarkdown.ZMarkdown(profile=True)
+        md.convert('*text*')
+        first = md.stats
+        md.convert('*text*')
+        self.assertIsNot(md.stats, first)
+        self.assertEqual(md.stats.entry('stage', 'parse').calls, 1)
+
+    def testCallback(self):
+        """ Test that a callable profile option receives the stats. """
+        received = []
+        md = zmarkdown.ZMarkdown(profile=received.append)
+        md.convert('*text*')
+        self.assertEqual(received, [md.stats])
+
+
+class TestBudget(unittest.TestCase):
+    """ Tests of the resource limits of conversions. """
+
+    def testNoLimits(self):
+        """ Test that no budget is used by default. """
+        md = zmarkdown.ZMarkdown()
+        self.assertEqual(md.convert('> > *text*'),
+                         '<blockquote>\n<blockquote>\n<p><em>text</em></p>\n</blockquote>\n</blockquote>')
+        self.assertIsNone(md.context.budget)
+        self.assertNotIn('budget_exceeded', md.metadata)
+
+    def testMaxSize(self):
+        """ Test that a long source is converted as plain text. """
+        md = zmarkdown.ZMarkdown(max_size=20)
+        self.assertEqual(md.convert('*short*'), '<p><em>short</em></p>')
+        self.assertEqual(md.convert('*a longer* <text>\n\n& more'),
+                         '<p>*a longer* &lt;text&gt;</p>\n<p>&amp; more</p>')
+        self.assertIn('size', md.metadata['budget_exceeded'])
+
+    def testMaxDepth(self):
+        """ Test that deeply nested blocks are converted as plain text. """
+        md = zmarkdown.ZMarkdown(max_depth=4)
+        self.assertEqual(md.convert('> > *text*'),
+                         '<blockquote>\n<blockquote>\n<p><em>text</em></p>\n</blockquote>\n</blockquote>')
+        self.assertEqual(md.convert('> > > > > *text*'), '<p>&gt; &gt; &gt; &gt; &gt; *text*</p>')
+        self.assertIn('depth', md.metadata['budget_exceeded'])
+        # The limit applies to each document
+        self.assertEqual(md.convert('> *text*'), '<blockquote>\n<p><em>text</em></p>\n</blockquote>')
+
+    def testTimeouts(self):
+        """ Test that conversions over time are converted as plain text. """
+        md = zmarkdown.ZMarkdown(timeout=0)
+        self.assertEqual(md.convert('*text*'), '<p>*text*</p>')
+        self.assertIn('timeout', md.metadata['budget_exceeded'])
+        md = zmarkdown.ZMarkdown(pattern_timeout=0)
+        self.assertEqual(md.convert('*text*'), '<p>*text*</p>')
+        self.assertIn('inline pattern', md.metadata['budget_exceeded'])
+        self.assertEqual(zmarkdown.ZMarkdown(timeout=10, pattern_timeout=10).convert('*text*'),
+                         '<p><em>text</em></p>')
+
+    def testNotCached(self):
+        """ Test that degraded outputs are not cached. """
+        from zmarkdown.cache import MemoryCache
+        md = zmarkdown.ZMarkdown(cache=MemoryCache(), max_depth=1)
+        md.convert('> *text*')
+        self.assertEqual(md.cache.stats()['entries'], 0)
+        md.convert('*text*')
+        self.assertEqual(md.cache.stats()['entries'], 1)
+
+    def testIterConvert(self):
+        """ Test that only the segments over the budget are degraded by iter_convert. """
+        md = zmarkdown.ZMarkdown(max_depth=2)
+        self.assertEqual(list(md.iter_convert(['> > > *quote*', '', 'Some *text*'])),
+                         ['<p>&gt; &gt; &gt; *quote*</p>', '<p>Some <em>text</em></p>'])
+        self.assertIn('depth', md.metadata['budget_exceeded'])
+
+
+class TestBenchmark(unittest.TestCase):
+    """ Tests of the benchmark helpers. """
+
+    def testResultsFile(self):
+        """ Test writing and reading benchmark results. """
+        import os
+        import shutil
+        import tempfile
+        from . import benchmark
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'sub', 'benchmark.dat')
+            benchmark.write_results(filename, [('construction', 0.5, 1024.0), ('some-file', 0.25, 0.0)])
+            self.assertEqual(benchmark.read_results(filename),
+                             {'construction': (0.5, 1024.0), 'some-file': (0.25, 0.0)})
+        finally:
+            shutil.rmtree(directory)
+
+    def testCompare(self):
+        """ Test that only significant slowdowns are reported. """
+        from . import benchmark
+        stored = {'slower': (0.01, 0.0), 'noise': (0.0001, 0.0), 'faster': (0.01, 0.0)}
+        results = [('slower', 0.02, 0.0), ('noise', 0.0003, 0.0), ('faster', 0.005, 0.0), ('new', 1.0, 0.0)]
+        self.assertEqual(benchmark.compare(results, stored), [('slower', 0.01, 0.02)])
+
+    def testStages(self):
+        """ Test that running the stages in turn gives the converted text. """
+        from . import benchmark
+        md = zmarkdown.ZMarkdown()
+        self.assertEqual(sorted(benchmark.stage_times(md, '*text*', repeat=1)), sorted(md.stages))
+        md.reset()
+        data = '*text*'
+        for stage in md.stages:
+            data = getattr(md, stage)(data)
+        self.assertEqual(data, '<p><em>text</em></p>')
+
+
 class TestBlockParser(unittest.TestCase):
     """ Tests of the BlockParser class. """
 
@@ -78,6 +557,224 @@ class TestBlockParser(unittest.TestCase):
             "<div><h1>foo</h1><p>bar</p><pre><code>baz\n</code></pre></div>"
         )
 
+    def testDefinitionLines(self):
+        """ Test the lines kept by the definition scanner. """
+        block = 'text [a][b]\n[b]: /url\n  [^1]: note\n*[HTML] : markup\n[c]\n    [d]: /code'
+        self.assertEqual(
+            self.parser.definitions.lines(block),
+            ['[b]: /url', '  [^1]: note', '*[HTML] : markup']
+        )
+        md = zmarkdown.ZMarkdown(extensions=['zmarkdown.extensions.abbr', 'zmarkdown.extensions.footnotes'])
+        self.assertEqual(
+            md.convert('[HTML][b] text[^1]\n[b]: /url\n[^1]: note\n*[HTML]: markup'),
+            md.convert('[HTML][b] text[^1]\n\n[b]: /url\n\n[^1]: note\n\n*[HTML]: markup')
+        )
+
+
+class TestBlockDispatch(unittest.TestCase):
+    """ Tests of the dispatch of blocks on their leading characters. """
+
+    def processorsTested(self, md, text):
+        md.convert(text)
+        return list(md.stats.category('blockprocessor.test'))
+
+    def testSkipped(self):
+        """ Test that processors are only tested on the blocks they can claim. """
+        md = zmarkdown.ZMarkdown(profile=True)
+        # Documents end with an empty block, which any processor can claim;
+        # ordered lists may start with any digit
+        self.assertEqual(self.processorsTested(md, 'Some text'), ['olist', 'paragraph', 'reference', 'empty'])
+        self.assertEqual(md.stats.entry('blockprocessor.skip', 'quote').calls, 1)
+        self.assertEqual(self.processorsTested(md, 'Some text\n> quote'),
+                         ['olist', 'quote', 'paragraph', 'empty', 'reference'])
+        self.assertEqual(self.processorsTested(md, '# Title'), ['hashheader', 'reference', 'empty'])
+
+    def testEmptyBlock(self):
+        """ Test that empty blocks are tested on every processor. """
+        class EmptyProcessor(zmarkdown.blockprocessors.BlockProcessor):
+            starts = '*'
+            line_starts = '*'
+
+            def test(self, parent, block):
+                return not block
+
+            def run(self, parent, blocks):
+                zmarkdown.util.etree.SubElement(parent, 'hr')
+                blocks.pop(0)
+
+        md = zmarkdown.ZMarkdown()
+        md.parser.blockprocessors.add('star', EmptyProcessor(md.parser), '_begin')
+        root = zmarkdown.util.etree.Element('div')
+        md.parser.parseBlocks(root, [''])
+        self.assertEqual([element.tag for element in root], ['hr'])
+
+    def testUnicodeDigits(self):
+        """ Test that ordered lists numbered with the digits of any script are dispatched. """
+        source = '\u0663. item\n\u0664. two'
+        # Whether the expression matches them depends on the Python version
+        if zmarkdown.blockprocessors.OListProcessor.RE.match(source):
+            expected = '<ol>\n<li>item</li>\n<li>two</li>\n</ol>'
+        else:
+            expected = '<p>\u0663. item\n\u0664. two</p>'
+        self.assertEqual(zmarkdown.ZMarkdown().convert(source), expected)
+
+    def testChangedProcessors(self):
+        """ Test that the dispatch follows the changes of the processors. """
+        class StarProcessor(zmarkdown.blockprocessors.BlockProcessor):
+            starts = '*'
+
+            def test(self, parent, block):
+                return bool(block)
+
+            def run(self, parent, blocks):
+                zmarkdown.util.etree.SubElement(parent, 'hr')
+                blocks.pop(0)
+
+        md = zmarkdown.ZMarkdown()
+        self.assertEqual(md.convert('*a*\n\nb'), '<p><em>a</em></p>\n<p>b</p>')
+        md.parser.blockprocessors.add('star', StarProcessor(md.parser), '_begin')
+        self.assertEqual(md.convert('*a*\n\nb'), '<hr>\n<p>b</p>')
+
+    def testChangedBlock(self):
+        """ Test that a block changed by a failed run is dispatched again. """
+        class LegendProcessor(zmarkdown.blockprocessors.BlockProcessor):
+            starts = 'L'
+
+            def test(self, parent, block):
+                return True
+
+            def run(self, parent, blocks):
+                blocks[0] = blocks[0][len('Legend: '):]
+                return False
+
+        md = zmarkdown.ZMarkdown()
+        md.parser.blockprocessors.add('legend', LegendProcessor(md.parser), '_begin')
+        self.assertEqual(md.convert('Legend: # Title'), '<h1>Title</h1>')
+
+
+class TestBlockQueue(unittest.TestCase):
+    """ Tests of the BlockQueue class. """
+
+    def setUp(self):
+        self.blocks = ['a', 'b', 'c']
+        self.queue = zmarkdown.blockparser.BlockQueue(self.blocks)
+
+    def assertSameBlocks(self):
+        self.assertEqual(list(self.queue), self.blocks)
+        self.assertEqual(len(self.queue), len(self.blocks))
+
+    def testFront(self):
+        """ Test taking and pushing back blocks at the front. """
+        self.assertEqual(self.queue.pop(0), 'a')
+        self.queue.insert(0, 'rest')
+        self.assertEqual(self.queue[0], 'rest')
+        self.queue[0] = 'changed'
+        self.assertEqual(list(self.queue), ['changed', 'b', 'c'])
+
+    def testListMethods(self):
+        """ Test that the queue behaves like the list of its blocks. """
+        for method, args in [('pop', ()), ('pop', (1,)), ('pop', (-2,)), ('insert', (1, 'x')),
+                             ('insert', (-1, 'x')), ('insert', (10, 'x')), ('append', ('x',)),
+                             ('extend', (['x', 'y'],))]:
+            self.setUp()
+            self.assertEqual(getattr(self.queue, method)(*args), getattr(self.blocks, method)(*args))
+            self.assertSameBlocks()
+        self.setUp()
+        self.assertEqual(self.queue[-1], 'c')
+        self.assertEqual(self.queue[1:], ['b', 'c'])
+        del self.queue[1]
+        del self.blocks[1]
+        self.assertSameBlocks()
+        del self.queue[:]
+        self.assertFalse(self.queue)
+        self.assertRaises(IndexError, self.queue.pop, 0)
+
+    def testLines(self):
+        """ Test the tracking of the source lines of the blocks. """
+        queue = zmarkdown.blockparser.TrackedBlockQueue(['a\nb', 'c\n[id]: url\nd'], 3)
+        self.assertEqual((queue.line, queue.sourceLine(0, 1), queue.sourceLine(-1, 2)), (3, 4, 8))
+        queue.insert(0, queue.pop(0)[2:])
+        self.assertEqual(queue.line, 4)
+        queue.pop(0)
+        queue.pop(0)
+        queue.insert(0, 'c\nd')
+        self.assertEqual((queue.line, queue.lines, queue.sourceLine(0, 1)), (6, (6, 8), 8))
+        queue.pop(0)
+        self.assertEqual((queue.line, queue.lines), (9, None))
+        self.assertIsNone(zmarkdown.blockparser.BlockQueue(['a']).line)
+
+    def testParseBlocks(self):
+        """ Test that parseBlocks accepts lists and queues. """
+        parser = zmarkdown.ZMarkdown().parser
+        for blocks in [['# a', 'b'], zmarkdown.blockparser.BlockQueue(['# a', 'b'])]:
+            root = zmarkdown.util.etree.Element('div')
+            parser.parseBlocks(root, blocks)
+            self.assertEqual(zmarkdown.serializers.to_html_string(root), '<div><h1>a</h1><p>b</p></div>')
+
+
+class TestTrackedBlockQueue(TestBlockQueue):
+    """ Tests of the TrackedBlockQueue class. """
+
+    def setUp(self):
+        self.blocks = ['a', 'b', 'c']
+        self.queue = zmarkdown.blockparser.TrackedBlockQueue(self.blocks)
+
+
+class TestSourceLines(unittest.TestCase):
+    """ Tests of the source lines recorded for the block elements. """
+
+    def lines(self, md, source):
+        root = md.parse(md.preprocess(source))
+        return [(element.tag, md.context.blockLines.get(element)) for element in root.iter()]
+
+    def testBlockLines(self):
+        """ Test the lines of headers, paragraphs, quotes, lists and rules. """
+        md = zmarkdown.ZMarkdown(source_lines=True)
+        source = ('# Title\n\nSome\ntext\n\n> a\n>\n> b\n\n* one\n* two\n\n    more\n\n'
+                  '[ref]: http://example.com\n\n---\n')
+        self.assertEqual(self.lines(md, source), [
+            ('div', (1, 17)), ('h1', (1, 1)), ('p', (3, 4)), ('blockquote', (6, 8)), ('p', (6, 6)),
+            ('p', (8, 8)), ('ul', (10, 13)), ('li', (10, 10)), ('li', (11, 13)), ('p', (11, 11)),
+            ('p', (13, 13)), ('hr', (17, 17))])
+
+    def testRemovedLines(self):
+        """ Test the lines of the blocks following removed definitions. """
+        md = zmarkdown.ZMarkdown(source_lines=True)
+        source = 'Text\n[ref]: http://example.com\n# Title\nMore'
+        self.assertEqual(self.lines(md, source)[1:], [('p', (1, 1)), ('h1', (3, 3)), ('p', (4, 4))])
+        source = '* one\n[ref]: http://example.com\n* two\n\n> quote\n[ref]: http://example.com\n> more'
+        self.assertEqual(self.lines(md, source)[1:], [
+            ('ul', (1, 3)), ('li', (1, 1)), ('li', (3, 3)), ('blockquote', (5, 7)), ('p', (5, 7))])
+
+    def testDataLine(self):
+        """ Test the output of the lines as data-line attributes. """
+        md = zmarkdown.ZMarkdown(source_lines=True)
+        self.assertEqual(md.convert('# Title\n\n> a\n>\n> b\n\nText'),
+                         '<h1 data-line="1-1">Title</h1>\n'
+                         '<blockquote data-line="3-5">\n<p data-line="3-3">a</p>\n<p data-line="5-5">b</p>\n'
+                         '</blockquote>\n<p data-line="7-7">Text</p>')
+
+    def testSegments(self):
+        """ Test that the lines of the segments converted apart count from the start of the document. """
+        import io
+        from zmarkdown.incremental import IncrementalRenderer
+        md = zmarkdown.ZMarkdown(source_lines=True)
+        source = '# Title\n\nText\n\n\n* one\n* two\n\nEnd'
+        html = md.convert(source)
+        self.assertIn('<p data-line="9-9">End</p>', html)
+        self.assertEqual('\n'.join(md.iter_convert(io.StringIO(source))), html)
+        renderer = IncrementalRenderer(md)
+        self.assertEqual(renderer.convert(source), html)
+        # Moved segments are taken from the cache
+        self.assertEqual(renderer.convert('Intro\n\n' + source), md.convert('Intro\n\n' + source))
+        self.assertEqual(renderer.reused, 3)
+
+    def testNotRecorded(self):
+        """ Test that the lines are not recorded by default. """
+        md = zmarkdown.ZMarkdown()
+        md.convert('# Title\n\nText')
+        self.assertIsNone(md.context.blockLines)
+
 
 class TestBlockParserState(unittest.TestCase):
     """ Tests of the State class for BlockParser. """
@@ -117,6 +814,111 @@ class TestBlockParserState(unittest.TestCase):
         self.assertEqual(self.state, ['state1'])
 
 
+class TestInlineTriggers(unittest.TestCase):
+    """ Tests of the dispatch of inline patterns on their trigger characters. """
+
+    def tried(self, md, text):
+        md.convert(text)
+        return list(md.stats.category('inlinepattern'))
+
+    def testUntriggeredPatternsSkipped(self):
+        """ Test that patterns are only tried on text with their triggers. """
+        md = zmarkdown.ZMarkdown(profile=True)
+        self.assertEqual(self.tried(md, 'Some text'), [])
+        self.assertEqual(self.tried(md, 'Some *text*'),
+                         ['not_strong', 'em_strong', 'strong_em', 'strong', 'emphasis'])
+        self.assertEqual(self.tried(md, 'A [link](http://example.com)'),
+                         ['reference', 'link', 'short_reference'])
+
+    def testPatternsWithoutTriggers(self):
+        """ Test that patterns without triggers are always tried. """
+        md = zmarkdown.ZMarkdown(profile=True)
+        md.inlinePatterns.add('word', zmarkdown.inlinepatterns.SimpleTagPattern(r'()(word)', 'b'), '_end')
+        self.assertEqual(self.tried(md, 'Some text'), ['word'])
+        self.assertEqual(md.convert('A word'), '<p>A <b>word</b></p>')
+
+    def testTriggersInPlaceholders(self):
+        """ Test that the characters of placeholders trigger the following patterns. """
+        md = zmarkdown.ZMarkdown(profile=True)
+        md.inlinePatterns.add('digit', zmarkdown.inlinepatterns.SimpleTextPattern(r'(0)', triggers='0'), '_end')
+        self.assertNotIn('digit', self.tried(md, 'text'))
+        # The placeholder of the emphasis contains a 0, unlike the text
+        self.assertIn('digit', self.tried(md, '*text*'))
+
+    def testRequiredSubstrings(self):
+        """ Test that patterns are only tried on text with their required substrings. """
+        md = zmarkdown.ZMarkdown(profile=True)
+        self.assertNotIn('link', self.tried(md, '[text] (not a link)'))
+        self.assertIn('link', md.stats.category('inlinepattern.skip'))
+        md.convert('[a link](http://example.com)')
+        self.assertEqual(md.stats.entry('inlinepattern', 'link').hits, 1)
+
+
+class TestResumablePatterns(unittest.TestCase):
+    """ Tests of the single pass application of resumable inline patterns. """
+
+    class CountingPattern(zmarkdown.inlinepatterns.Pattern):
+        """ Wrap the words starting with a 'w' but 'wrong' in <b>, counting the matches. """
+
+        def __init__(self, resumable):
+            zmarkdown.inlinepatterns.Pattern.__init__(self, r'\b(w\w*)', resumable=resumable)
+            self.calls = 0
+
+        def handleMatch(self, m):
+            self.calls += 1
+            if m.group(2) == 'wrong':
+                return None
+            el = zmarkdown.util.etree.Element('b')
+            el.text = m.group(2)
+            return el
+
+    def convert(self, text, resumable):
+        md = zmarkdown.ZMarkdown()
+        pattern = self.CountingPattern(resumable)
+        md.inlinePatterns.add('words', pattern, '_end')
+        return md.convert(text), pattern.calls
+
+    def testSinglePass(self):
+        """ Test that each match of a resumable pattern is handled once. """
+        text = 'wrong way, wrong words: we win'
+        output, calls = self.convert(text, False)
+        self.assertEqual(self.convert(text, True), (output, 6))
+        self.assertGreater(calls, 6)
+        self.assertEqual(output, '<p>wrong <b>way</b>, wrong <b>words</b>: <b>we</b> <b>win</b></p>')
+
+    def testSameResult(self):
+        """ Test that a single pass gives the text rescanning gives. """
+        for text in ('w', 'wrong', 'a wrongwrong w', 'wrong\nwa\n', '* we\n* win\n\n', '`we` &amp; *win*'):
+            self.assertEqual(self.convert(text, True)[0], self.convert(text, False)[0])
+
+
+class TestInlineTree(unittest.TestCase):
+    """ Tests of the insertion of the inline elements in the tree. """
+
+    class WidePattern(zmarkdown.inlinepatterns.Pattern):
+        """ Return a span whose children have tails with inline markup. """
+
+        def handleMatch(self, m):
+            span = zmarkdown.util.etree.Element('span')
+            for i in range(3):
+                child = zmarkdown.util.etree.SubElement(span, 'i')
+                child.text = '**%d**' % i
+                child.tail = ' *%d* and `%d` ' % (i, i)
+            return span
+
+    def testChildrenOrder(self):
+        """ Test that the elements of the tails follow their node. """
+        md = zmarkdown.ZMarkdown()
+        md.inlinePatterns.add('wide', self.WidePattern(r'(%%)'), '_end')
+        self.assertEqual(
+            md.convert('x %% y *z*\n\n*a* `b` *c*'),
+            '<p>x <span><i><strong>0</strong></i> <em>0</em> and <code>0</code> '
+            '<i><strong>1</strong></i> <em>1</em> and <code>1</code> '
+            '<i><strong>2</strong></i> <em>2</em> and <code>2</code> </span> y <em>z</em></p>\n'
+            '<p><em>a</em> <code>b</code> <em>c</em></p>'
+        )
+
+
 class TestHtmlStash(unittest.TestCase):
     """ Test Markdown's HtmlStash. """
 
@@ -173,6 +975,69 @@ class TestHtmlStash(unittest.TestCase):
 
         return StoreUnsafeHtml()
 
+    def testRestoreInOnePass(self):
+        """ Test the restoration of the stash by the raw html postprocessor. """
+        md = zmarkdown.ZMarkdown()
+        stash = md.htmlStash
+        block = stash.store('<div>%s</div>' % stash.get_placeholder(2), safe=True)
+        inline = stash.store('<b>%s</b>' % stash.get_placeholder(0), safe=True)
+        nested = stash.store('<i>x</i>', safe=True)
+        unsafe = stash.store('<hr>')
+        text = '<p>%s</p>\n<p>%s %s</p>\n<p>%s</p>%s' % (block, inline, nested, inline, unsafe)
+        self.assertEqual(
+            md.postprocessors['raw_html'].run(text),
+            '<div><i>x</i></div>\n\n<p><b>%s</b> <i>x</i></p>\n<p><b>%s</b></p>&lt;hr&gt;' % (block, block)
+        )
+
+
+class TestRegexCache(unittest.TestCase):
+    """ Tests of the regular expressions shared by the instances. """
+
+    def testCompileOnce(self):
+        """ Test that an expression is compiled once for each set of flags. """
+        regex = zmarkdown.util.compile_regex(r'cached (\w+)')
+        self.assertIs(zmarkdown.util.compile_regex(r'cached (\w+)'), regex)
+        self.assertIsNot(zmarkdown.util.compile_regex(r'cached (\w+)', re.UNICODE), regex)
+        self.assertEqual(regex.match('cached regex').group(1), 'regex')
+
+    def testSharedByInstances(self):
+        """ Test that a new instance reuses the compiled expressions. """
+        extensions = ['zmarkdown.extensions.fenced_code', 'zmarkdown.extensions.abbr']
+        zmarkdown.ZMarkdown(extensions=extensions).convert('```python\nx = 1\n```\n\n*[ZDS]: Zeste')
+        stats = zmarkdown.util.regex_cache.stats()
+        zmarkdown.ZMarkdown(extensions=extensions).convert('```python\nx = 1\n```\n\n*[ZDS]: Zeste')
+        new_stats = zmarkdown.util.regex_cache.stats()
+        self.assertEqual(new_stats['misses'], stats['misses'])
+        self.assertGreater(new_stats['hits'], stats['hits'])
+
+    def testDocumentExpressionsNotCached(self):
+        """ Test that the abbreviations of each document do not fill the cache. """
+        md = zmarkdown.ZMarkdown(extensions=['zmarkdown.extensions.abbr'])
+        md.convert('ABBR0\n\n*[ABBR0]: Abbreviation')
+        stats = zmarkdown.util.regex_cache.stats()
+        for i in range(1, 10):
+            self.assertIn('<abbr', md.convert('ABBR%d\n\n*[ABBR%d]: Abbreviation' % (i, i)))
+        self.assertEqual(zmarkdown.util.regex_cache.stats()['misses'], stats['misses'])
+
+
+class TestUrlCache(unittest.TestCase):
+    """ Tests of the sanitized urls shared by the instances. """
+
+    def testSanitizeOnce(self):
+        """ Test that the urls of links, images and references are sanitized once. """
+        text = '[a](javascript:alert%28%29) [b](http://x.fr/) ![c](http://x.fr/)\n\n[d][r]\n\n[r]: http://x.fr/'
+        output = zmarkdown.ZMarkdown().convert(text)
+        self.assertEqual(
+            output,
+            '<p><a href="">a</a> <a href="http://x.fr/">b</a> <img alt="c" src="http://x.fr/"></p>\n'
+            '<p><a href="http://x.fr/">d</a></p>'
+        )
+        stats = zmarkdown.inlinepatterns.url_cache.stats()
+        self.assertEqual(zmarkdown.ZMarkdown().convert(text), output)
+        new_stats = zmarkdown.inlinepatterns.url_cache.stats()
+        self.assertEqual(new_stats['misses'], stats['misses'])
+        self.assertEqual(new_stats['hits'], stats['hits'] + 4)
+
 
 class TestOrderedDict(unittest.TestCase):
     """ Test OrderedDict storage class. """
@@ -85,6 +85,20 @@ class TestAbbr(unittest.TestCase):
             'and <em><abbr title="Abreviation">ABBR</abbr></em></p>'
         )
 
+    def testSingleMatcher(self):
+        """ Test that all the abbreviations are matched by a single pattern. """
+        md = zmarkdown.ZMarkdown(extensions=['zmarkdown.extensions.abbr'], profile=True)
+        text = 'HTML 5, HTML and x^2 are defined twice\n\n' + \
+               '*[HTML]: Markup\n*[HTML 5]: Markup 5\n*[x^2]: Square\n' + \
+               '*[]: Empty\n*[x^2]: Square again'
+        self.assertEqual(
+            md.convert(text),
+            '<p><abbr title="Markup 5">HTML 5</abbr>, <abbr title="Markup">HTML</abbr> '
+            'and <abbr title="Square again">x^2</abbr> are defined twice</p>'
+        )
+        self.assertEqual([name for name in md.stats.category('inlinepattern') if name.startswith('abbr')],
+                         ['abbr'])
+
 
 class TestCodeHilite(unittest.TestCase):
     """ Test codehilite extension. """
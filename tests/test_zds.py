@@ -27,6 +27,21 @@ class TestZDSExtensionClass(unittest.TestCase):
                 md.convert('> ![Image](http://test.com/image.png)'),
                 '<p>&gt;&#x202F;![Image](http://test.com/image.png)\n</p>')
 
+    def test_inline_mode_imports(self):
+        # The extensions unused in inline mode and Pygments are not loaded
+        import subprocess
+        import sys
+        script = ('import sys, zmarkdown\n'
+                  'from zmarkdown.extensions.zds import ZdsExtension\n'
+                  'zmarkdown.ZMarkdown(extensions=[ZdsExtension(inline=True)]).convert("`code`")\n'
+                  'print(" ".join(sorted(sys.modules)))')
+        modules = subprocess.check_output([sys.executable, '-c', script]).decode('ascii').split()
+        self.assertIn('zmarkdown.extensions.urlize', modules)
+        self.assertNotIn('zmarkdown.extensions.codehilite', modules)
+        self.assertNotIn('zmarkdown.extensions.footnotes', modules)
+        self.assertNotIn('zmarkdown.extensions.comments', modules)
+        self.assertNotIn('pygments', modules)
+
     def test_img_in_block(self):
 
         zds_ext = ZdsExtension(emoticons={":D": "image.png"})
@@ -39,6 +54,34 @@ class TestZDSExtensionClass(unittest.TestCase):
                 '<figcaption>Image utilisateur</figcaption>\n'
                 '</figure>\n</div>')
 
+    def test_shared_emoticons(self):
+        # Instances with the same emoticons share their compiled pattern
+        emoticons = {":D": "happy.png", ":": "colon.png", ":DD": "very_happy.png"}
+        first = zmarkdown.ZMarkdown(extensions=[ZdsExtension(emoticons=emoticons)])
+        second = zmarkdown.ZMarkdown(extensions=[ZdsExtension(emoticons=dict(emoticons))])
+        other = zmarkdown.ZMarkdown(extensions=[ZdsExtension(emoticons={":D": "image.png"})])
+        self.assertIs(first.inlinePatterns['emoticons'], second.inlinePatterns['emoticons'])
+        self.assertIsNot(first.inlinePatterns['emoticons'], other.inlinePatterns['emoticons'])
+        self.assertEqual(
+                second.convert(':DD : :D'),
+                '<p><img alt=":DD" src="very_happy.png"> <img alt=":" src="colon.png"> '
+                '<img alt=":D" src="happy.png"></p>')
+
+    def test_shared_urls(self):
+        # Urls repeated in posts are normalized once
+        from zmarkdown.extensions.urlize import url_cache
+        md = zmarkdown.ZMarkdown(extensions=[ZdsExtension()])
+        text = 'Voir zestedesavoir.com et <http://a.fr/b> ou foo@bar.fr'
+        output = md.convert(text)
+        self.assertEqual(
+            output,
+            '<p>Voir <a href="http://zestedesavoir.com">zestedesavoir.com</a> et '
+            '<a href="http://a.fr/b">http://a.fr/b</a> ou <a href="mailto:foo@bar.fr">foo@bar.fr</a></p>')
+        stats = url_cache.stats()
+        self.assertEqual(md.convert(text), output)
+        self.assertEqual(url_cache.stats()['misses'], stats['misses'])
+        self.assertEqual(url_cache.stats()['hits'], stats['hits'] + 3)
+
     def test_ping_function(self):
         def ping_url(user=None):
             if user == 'Clem':
@@ -131,6 +174,29 @@ class TestZDSExtensionClass(unittest.TestCase):
                            "b = 'zds'\n"
                            "```\n"))
 
+    def test_typography_single_pass(self):
+        md = zmarkdown.ZMarkdown(extensions=[FrenchTypographyExtension()])
+        self.assertEqual(
+                md.convert("L'essai « oui » ; fin..."),
+                '<p>L&rsquo;essai &laquo;&nbsp;oui&nbsp;&raquo;&#x202F;; fin&hellip;</p>')
+        # Replacements are written in the text, not stashed
+        self.assertEqual(md.htmlStash.html_counter, 0)
+        # The first rules have the priority over the next ones they overlap
+        self.assertEqual(
+                md.convert('Vide « » ; : ! <<< a'),
+                '<p>Vide «&nbsp;&raquo;&#x202F;; :&#x202F;! &lt;&laquo;&nbsp;a</p>')
+
+    def test_source_lines(self):
+        import re
+        md = zmarkdown.ZMarkdown(source_lines=True, extensions=[ZdsExtension(marker_key='m')])
+        html = md.convert('Text[^1]\n\n[[i]]\n| Info\n\n->\nRight\n->\n\n'
+                          'a|b\n-|-\n1|2\nTable: t\n\n[^1]: Note\n    more')
+        self.assertEqual(re.findall(r'<(\w+)[^>]* data-line="(\d+-\d+)"', html), [
+            ('p', '1-1'), ('div', '3-4'), ('p', '4-4'), ('div', '6-8'), ('p', '7-7'), ('figure', '10-13'),
+            ('div', '10-12'), ('table', '10-12'), ('thead', '10-10'), ('tr', '10-10'), ('th', '10-10'),
+            ('th', '10-10'), ('tbody', '12-12'), ('tr', '12-12'), ('td', '12-12'), ('td', '12-12'),
+            ('li', '15-16'), ('p', '15-16')])
+
 
 class TestPing(unittest.TestCase):
     """ Test ping extension. """
@@ -601,3 +667,8 @@ class TestTitleAnchor(unittest.TestCase):
         self.assertEqual("Title 2b", toc[10].title)
         self.assertEqual("zds-title-2b", toc[10].anchor)
         self.assertEqual(2, toc[10].level)
+
+    def test_typography_in_titles(self):
+        md = zmarkdown.ZMarkdown(extensions=[FrenchTypographyExtension(), TitleAnchorExtension()])
+        self.assertEqual(md.convert("# L'essai"), '<h1 id="lessai">L&rsquo;essai</h1>')
+        self.assertEqual("L’essai", md.metadata["toc"][0].title)
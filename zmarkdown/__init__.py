@@ -7,7 +7,10 @@ Python ZMarkdown
 from __future__ import absolute_import
 from __future__ import unicode_literals
 from .__version__ import version, version_info  # noqa
+import copy
+import io
 import logging
+import threading
 import warnings
 import importlib
 from . import util
@@ -18,8 +21,9 @@ from .inlinepatterns import build_inlinepatterns
 from .postprocessors import build_postprocessors
 from .extensions import Extension
 from .serializers import to_html_string
+from . import cache
 
-__all__ = ['ZMarkdown', 'zmarkdown']
+__all__ = ['ZMarkdown', 'ZMarkdownTemplate', 'zmarkdown', 'convert_batch']
 
 logger = logging.getLogger('ZMARKDOWN')
 
@@ -29,9 +33,19 @@ class ZMarkdown(object):
 
     doc_tag = "div"  # Element used to wrap document - later removed
 
+    # Methods run in turn by `convert`, each on the output of the previous one
+    stages = ('preprocess', 'parse', 'process_tree', 'serialize', 'postprocess')
+
     option_defaults = {
         'tab_length': 4,
         'inline': False,
+        'cache': None,
+        'profile': False,
+        'max_size': None,
+        'max_depth': None,
+        'pattern_timeout': None,
+        'timeout': None,
+        'source_lines': False,
     }
 
     ESCAPED_CHARS = ['\\', '`', '*', '_', '{', '}', '[', ']',
@@ -49,22 +63,41 @@ class ZMarkdown(object):
            as-is.
         * extension_configs: Configuration settings for extensions.
         * tab_length: Length of tabs in the source. Default: 4
+        * cache: A render cache backend (see `zmarkdown.cache`). Default: None
+        * profile: Record the time spent in each stage and processor (see
+          `util.RenderStats`) into `stats`. If a callable, it is also called
+          with the stats after each conversion. Default: False
+        * max_size: Maximum length of the source text. Default: None
+        * max_depth: Maximum nesting depth of blocks (quotes, lists...).
+          Default: None
+        * pattern_timeout: Maximum time of an inline pattern match, in
+          seconds. Default: None
+        * timeout: Maximum time of a conversion, in seconds. Default: None
+        * source_lines: Record the first and last source lines of the block
+          elements (see `BlockParser.locate`), and output them as a
+          ``data-line="first-last"`` attribute. Default: False
+
+        A document exceeding one of these limits is converted to escaped
+        plain text (see `convert`).
         """
 
-        self.metadata = {}
+        # Per-document state lives in a render context bound to each thread.
+        self._local = threading.local()
 
         # Loop through kwargs and assign defaults
         for option, default in self.option_defaults.items():
             setattr(self, option, kwargs.get(option, default))
 
+        # Extensions extend the escapable chars: never alter the class list.
+        self.ESCAPED_CHARS = list(self.ESCAPED_CHARS)
+
         self.registeredExtensions = []
+        self.loadedExtensions = []
         self.docType = ""
         self.stripTopLevelTags = True
 
         self.build_parser()
 
-        self.references = {}
-        self.htmlStash = util.HtmlStash()
         self.registerExtensions(extensions=kwargs.get('extensions', []),
                                 configs=kwargs.get('extension_configs', {}))
         self.serializer = to_html_string
@@ -96,6 +129,7 @@ class ZMarkdown(object):
                 ext = self.build_extension(ext, configs.get(ext, {}))
             if isinstance(ext, Extension):
                 ext.extendZMarkdown(self, globals())
+                self.loadedExtensions.append(ext)
                 logger.debug('Successfully loaded extension "%s.%s".',
                              ext.__class__.__module__, ext.__class__.__name__)
             elif ext is not None:
@@ -205,11 +239,16 @@ class ZMarkdown(object):
 
     def reset(self):
         """
-        Resets all state variables so that we can start with a new text.
+        Start a new render context for the current thread, so that we can
+        start with a new text.
         """
-        self.htmlStash.reset()
-        self.references.clear()
-        self.metadata = {}
+        self._local.context = util.RenderContext()
+        if self.profile:
+            self._local.context.stats = util.RenderStats()
+        if self.source_lines:
+            self._local.context.blockLines = {}
+        if self.timeout is not None or self.max_depth is not None or self.pattern_timeout is not None:
+            self._local.context.budget = util.Budget(self.timeout, self.max_depth, self.pattern_timeout)
 
         for extension in self.registeredExtensions:
             if hasattr(extension, 'reset'):
@@ -217,6 +256,43 @@ class ZMarkdown(object):
 
         return self
 
+    @property
+    def context(self):
+        """ The render context of the document converted by the current thread. """
+        try:
+            return self._local.context
+        except AttributeError:
+            return self.reset()._local.context
+
+    @property
+    def stats(self):
+        """ RenderStats of the last conversion, None if profiling is disabled. """
+        return self.context.stats
+
+    @property
+    def htmlStash(self):
+        return self.context.htmlStash
+
+    @property
+    def references(self):
+        return self.context.references
+
+    @property
+    def metadata(self):
+        return self.context.metadata
+
+    @metadata.setter
+    def metadata(self, value):
+        self.context.metadata = value
+
+    @property
+    def lines(self):
+        return self.context.lines
+
+    @lines.setter
+    def lines(self, value):
+        self.context.lines = value
+
     def convert(self, source):
         """
         Convert markdown to serialized XHTML or HTML.
@@ -237,8 +313,19 @@ class ZMarkdown(object):
            has been serialized into text.
         5. The output is written to a string.
 
+        Each call starts a new render context: the state of the document
+        (``metadata`` for instance) is available from the calling thread
+        until its next conversion.
+
+        A source longer than ``max_size``, or whose conversion exceeds the
+        ``max_depth``, ``pattern_timeout`` or ``timeout`` limits, is output
+        as escaped plain text paragraphs, and the reason is given by
+        ``metadata['budget_exceeded']``. These outputs are not cached.
+
         """
 
+        self.reset()
+
         # Fixup the source text
         if not source.strip():
             return ''  # a blank unicode string
@@ -250,21 +337,215 @@ class ZMarkdown(object):
             e.reason += '. -- Note: ZMarkdown only accepts unicode input!'
             raise
 
-        # Split into lines and run the line preprocessors.
-        self.lines = source.split("\n")
-        for prep in self.preprocessors.values():
-            self.lines = prep.run(self.lines)
+        if self.max_size is not None and len(source) > self.max_size:
+            output = self.degrade(source, util.BudgetExceeded('Maximum size of %d exceeded' % self.max_size))
+        else:
+            # No key when the configuration can not be fingerprinted
+            key = cache.cache_key(self, source) if self.cache is not None else None
+            if key is None:
+                output = self._convert_within_budget(source)
+            else:
+                cached = self.cache.get(key)
+                if self.stats is not None:
+                    self.stats.record('cache', 'hit' if cached is not None else 'miss')
+                if cached is not None:
+                    output, self.metadata = cached
+                else:
+                    output = self._convert_within_budget(source)
+                    if 'budget_exceeded' not in self.metadata:
+                        self.cache.set(key, (output, self.metadata))
+
+        if callable(self.profile):
+            self.profile(self.stats)
+        return output
+
+    def iter_convert(self, infile, encoding='utf-8'):
+        """
+        Convert markdown read from a file, yielding HTML block by block.
+
+        `infile` is a file-like object or an iterable of lines. The source is
+        split into top-level segments (see `zmarkdown.incremental`) which are
+        converted one after the other in the same render context: only one
+        segment is held in memory at once. Joined with newlines, the yielded
+        fragments give the output of `convert`, except for anchors made from
+        stashed text, which are numbered per segment.
+
+        Seekable files are read twice: first to collect the definitions, then
+        to convert the segments. Documents which can not be split safely
+        (footnotes, ambiguous fences...) are converted as a whole, as are
+        documents longer than ``max_size``, which are thus output as plain
+        text.
+
+        """
+        # Imported here as it loads the comments extension
+        from . import incremental
+
+        lines = infile
+        try:
+            position = infile.tell()
+        except (AttributeError, IOError, OSError):
+            # Not seekable: keep the lines for the second pass
+            lines = list(infile)
+
+        def read():
+            if lines is infile:
+                infile.seek(position)
+            return incremental.read_lines(lines, encoding, self.tab_length)
+
+        def read_within_size():
+            # Length of the lines joined with newlines, as given to `convert`
+            size = -1
+            for line in read():
+                size += len(line) + 1
+                if self.max_size is not None and size > self.max_size:
+                    raise util.BudgetExceeded('Maximum size of %d exceeded' % self.max_size)
+                yield line
+
+        self.reset()
+        spans = incremental.get_spans(self)
+        definitions = []
+        try:
+            if self.inline:
+                raise incremental.SegmentationError('Inline mode')
+            for segment in incremental.iter_segments(read_within_size(), definitions, spans):
+                if incremental.FOOTNOTE_RE.search(segment):
+                    raise incremental.SegmentationError('Footnotes')
+            # Definitions are parsed first, as they apply to the whole document
+            if definitions and self._convert('\n'.join(definitions)):
+                raise incremental.SegmentationError('Some lines only look like definitions')
+        except (incremental.SegmentationError, util.BudgetExceeded):
+            # `convert` degrades the documents over the budget
+            yield self.convert('\n'.join(read()))
+            return
+
+        # Source lines are counted from the start of the document
+        offset = 0
+        for segment in incremental.iter_segments(read(), [], spans):
+            # Stashed html is only needed until the segment is serialized
+            self.htmlStash.reset()
+            try:
+                output = self._convert(segment)
+            except util.BudgetExceeded as e:
+                # Previous segments are already output: only degrade this one
+                output = self.serialize(self._plain_text(segment))
+                self.metadata['budget_exceeded'] = util.text_type(e)
+            if output:
+                yield incremental.shift_lines(output, offset) if self.source_lines else output
+            offset += segment.count('\n') + 1
+
+    def convert_file(self, infile, outfile, encoding='utf-8'):
+        """
+        Convert markdown from `infile` and write HTML to `outfile`.
+
+        Both arguments are file names or file-like objects. The HTML is
+        written as the document is converted (see `iter_convert`).
 
-        # Parse the high-level elements.
-        root = self.parser.parseDocument(self.lines).getroot()
+        """
+        if isinstance(infile, util.string_type):
+            with io.open(infile, encoding=encoding) as f:
+                return self.convert_file(f, outfile, encoding)
+        if isinstance(outfile, util.string_type):
+            with io.open(outfile, 'w', encoding=encoding) as f:
+                return self.convert_file(infile, f, encoding)
+
+        def write(text):
+            try:
+                outfile.write(text)
+            except TypeError:
+                # Binary file
+                outfile.write(text.encode(encoding))
+
+        separator = ''
+        for output in self.iter_convert(infile, encoding):
+            write(separator + output)
+            separator = '\n'
+        return self
 
-        # Run the tree-processors
-        for treeprocessor in self.treeprocessors.values():
-            newRoot = treeprocessor.run(root)
+    def _convert_within_budget(self, source):
+        """ Run the pipeline, degrading to plain text if the budget is exceeded. """
+        try:
+            return self._convert(source)
+        except util.BudgetExceeded as e:
+            return self.degrade(source, e)
+
+    def _plain_text(self, source):
+        """ Return a tree of the paragraphs of `source` as plain text. """
+        root = util.etree.Element(self.doc_tag)
+        for block in source.split('\n\n'):
+            if block.strip():
+                p = util.etree.SubElement(root, 'p')
+                p.text = util.AtomicString(block.strip('\n'))
+                p.tail = '\n'
+        return root
+
+    def degrade(self, source, error):
+        """
+        Return `source` as escaped plain text paragraphs after `error`.
+
+        The metadata of the partial conversion are dropped: extensions set
+        their default values back, and ``metadata['budget_exceeded']`` gives
+        the reason of the degradation.
+
+        """
+        logger.warning('Document converted as plain text: %s', error)
+        self.metadata = {}
+        for extension in self.registeredExtensions:
+            if hasattr(extension, 'reset'):
+                extension.reset()
+        self.metadata['budget_exceeded'] = util.text_type(error)
+        if self.stats is not None:
+            self.stats.record('budget', 'exceeded')
+        return self.serialize(self._plain_text(source))
+
+    def _convert(self, source):
+        """ Run the whole pipeline on the (unicode) source text. """
+        data = source
+        stats = self.stats
+        budget = self.context.budget
+        for stage in self.stages:
+            if budget is not None:
+                budget.check()
+            if stats is None:
+                data = getattr(self, stage)(data)
+            else:
+                start = util.timer()
+                data = getattr(self, stage)(data)
+                stats.record('stage', stage, util.timer() - start)
+        return data
+
+    def preprocess(self, source):
+        """ Split the source into lines and run the line preprocessors. """
+        self.lines = source.split("\n")
+        stats = self.stats
+        for name, prep in self.preprocessors.items():
+            if stats is None:
+                self.lines = prep.run(self.lines)
+            else:
+                start = util.timer()
+                self.lines = prep.run(self.lines)
+                stats.record('preprocessor', name, util.timer() - start)
+        return self.lines
+
+    def parse(self, lines):
+        """ Parse the high-level elements and return the root element. """
+        return self.parser.parseDocument(lines).getroot()
+
+    def process_tree(self, root):
+        """ Run the tree-processors and return the (possibly new) root. """
+        stats = self.stats
+        for name, treeprocessor in self.treeprocessors.items():
+            if stats is None:
+                newRoot = treeprocessor.run(root)
+            else:
+                start = util.timer()
+                newRoot = treeprocessor.run(root)
+                stats.record('treeprocessor', name, util.timer() - start)
             if newRoot is not None:
                 root = newRoot
+        return root
 
-        # Serialize _properly_.  Strip top-level tags.
+    def serialize(self, root):
+        """ Serialize the tree _properly_ and strip top-level tags. """
         output = self.serializer(root)
         if self.stripTopLevelTags:
             try:
@@ -279,12 +560,120 @@ class ZMarkdown(object):
                     # We have a serious problem
                     raise ValueError('ZMarkdown failed to strip top-level '
                                      'tags. Document=%r' % output.strip())
+        return output
+
+    def postprocess(self, output):
+        """ Run the text post-processors. """
+        stats = self.stats
+        for name, pp in self.postprocessors.items():
+            if stats is None:
+                output = pp.run(output)
+            else:
+                start = util.timer()
+                output = pp.run(output)
+                stats.record('postprocessor', name, util.timer() - start)
+        return output.strip()
 
-        # Run the text post-processors
-        for pp in self.postprocessors.values():
-            output = pp.run(output)
 
-        return output.strip()
+class ZMarkdownTemplate(object):
+    """
+    A reusable ZMarkdown configuration.
+
+    Building a ZMarkdown instance (block parser, inline patterns, every
+    extension and their regular expressions) costs much more than converting
+    a short document. A template builds the pipeline once per configuration
+    and hands it out as a renderer for every document: the state of each
+    conversion lives in a per-thread render context, so the same renderer can
+    be used by many threads at once.
+
+    Basic Usage:
+        >>> template = ZMarkdownTemplate(extensions=[ZdsExtension()])
+        >>> html = template.convert('Some *text*')
+        >>> md = template.renderer()
+        >>> html = md.convert('@[Clem]')
+        >>> pings = md.metadata['ping']
+
+    Keyword arguments are the ones accepted by the ZMarkdown class.
+
+    """
+
+    def __init__(self, **kwargs):
+        # Extension instances hold a reference to the ZMarkdown instance they
+        # extend: keep pristine copies and give a fresh copy to each build.
+        self.extensions = copy.deepcopy(kwargs.pop('extensions', []))
+        self.kwargs = kwargs
+        self._md = None
+        self._lock = threading.Lock()
+
+    def build(self):
+        """ Build a new ZMarkdown instance from the template configuration. """
+        return ZMarkdown(extensions=copy.deepcopy(self.extensions), **self.kwargs)
+
+    def renderer(self):
+        """ Return the renderer of the template, built on first use. """
+        if self._md is None:
+            # Threads converting their first document wait for a single build
+            with self._lock:
+                if self._md is None:
+                    self._md = self.build()
+        return self._md
+
+    def convert(self, source):
+        """ Convert markdown to HTML with the template renderer. """
+        return self.renderer().convert(source)
+
+    def render(self, source):
+        """ Convert markdown to HTML and return it with the document metadata. """
+        md = self.renderer()
+        html = md.convert(source)
+        return html, md.metadata
+
+    def convert_many(self, sources, workers=None, chunksize=8):
+        """
+        Convert a sequence of markdown documents with a pool of processes.
+
+        Each worker process builds the pipeline once and converts its share
+        of the documents. The template configuration (extensions and their
+        configs, like a ``ping_url`` function) must be picklable.
+
+        Keyword arguments:
+
+        * sources: An iterable of markdown documents.
+        * workers: Number of processes. Default: the number of CPUs. With 1,
+          documents are converted in the current process.
+        * chunksize: Number of documents sent to a worker at once.
+
+        Returns: A list of ``(html, metadata)`` tuples, in input order.
+
+        """
+        import multiprocessing
+
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if workers <= 1:
+            return [self.render(source) for source in sources]
+        pool = multiprocessing.Pool(workers, _init_batch_worker,
+                                    (self.extensions, self.kwargs))
+        try:
+            return pool.map(_render_batch_item, sources, chunksize)
+        finally:
+            pool.close()
+            pool.join()
+
+
+# Template of the current worker process of convert_many()
+_batch_template = None
+
+
+def _init_batch_worker(extensions, kwargs):
+    global _batch_template
+    _batch_template = ZMarkdownTemplate(extensions=extensions, **kwargs)
+    _batch_template.renderer()
+
+
+def _render_batch_item(source):
+    return _batch_template.render(source)
+
 
 # EXPORTED FUNCTIONS
 # =============================================================================
@@ -309,3 +698,21 @@ def zmarkdown(text, *args, **kwargs):
     """
     md = ZMarkdown(*args, **kwargs)
     return md.convert(text)
+
+
+def convert_batch(sources, workers=None, **kwargs):
+    """Convert many markdown documents with a pool of processes.
+
+    This is a shortcut for `ZMarkdownTemplate.convert_many`: each worker
+    process builds the pipeline once, then converts its share of documents.
+
+    Keyword arguments:
+
+    * sources: An iterable of markdown documents.
+    * workers: Number of processes. Default: the number of CPUs.
+    * Any arguments accepted by the Markdown class. They must be picklable.
+
+    Returns: A list of ``(html, metadata)`` tuples, in input order.
+
+    """
+    return ZMarkdownTemplate(**kwargs).convert_many(sources, workers=workers)
@@ -2,6 +2,7 @@ from __future__ import unicode_literals
 from __future__ import absolute_import
 from . import util
 from . import odict
+import re
 
 
 class State(list):
@@ -38,6 +39,344 @@ class State(list):
             return False
 
 
+def _line_at(lines, offset):
+    """
+    Return the source line `offset` lines after the first of `lines`: either
+    the source line of the first one, or the table of their source lines.
+    """
+    if isinstance(lines, int):
+        return lines + offset
+    if offset < len(lines):
+        return lines[offset]
+    return lines[-1] + offset - len(lines) + 1
+
+
+def _match_lines(lines, text_lines):
+    """
+    Return the indexes in `lines` of the `text_lines`, which are `lines` with
+    some of them removed or changed.
+    """
+    # A single run of removed lines is found exactly from both ends. The
+    # processors remove the first lines they find: the end is matched first
+    length = min(len(lines), len(text_lines))
+    tail = 0
+    while tail < length and lines[-1 - tail] == text_lines[-1 - tail]:
+        tail += 1
+    head = 0
+    while head < length - tail and lines[head] == text_lines[head]:
+        head += 1
+    indexes = list(range(head))
+    # The other lines are found in order
+    i = head
+    for text in text_lines[head:len(text_lines) - tail]:
+        try:
+            i = lines.index(text, i, len(lines) - tail)
+        except ValueError:
+            # Changed line
+            i = min(i, len(lines) - tail - 1)
+        indexes.append(i)
+        i += 1
+    indexes.extend(range(len(lines) - tail, len(lines)))
+    return indexes
+
+
+def _lines_entry(table):
+    """ Return the first of the source lines `table` if they follow each other, else the table. """
+    if table[-1] - table[0] == len(table) - 1:
+        return table[0]
+    return tuple(table)
+
+
+class BlockQueue(object):
+    """ The blocks left to parse, from the first to the last.
+
+    Block processors take the block at the front of the queue with
+    ``blocks.pop(0)`` and push back what they did not consume with
+    ``blocks.insert(0, rest)``. On a list, both move every other block, which
+    makes the parsing of documents with thousands of blocks quadratic. The
+    queue stores its blocks in reverse order so that both are done at the end
+    of a list, in constant time.
+
+    The queue has the methods of a list used by block processors, so those
+    written for lists of blocks work unchanged. It does not track the source
+    lines of its blocks (see `TrackedBlockQueue`).
+
+    """
+
+    # The source lines of the blocks are not known
+    line = None
+    lines = None
+
+    def __init__(self, blocks=()):
+        self._items = list(blocks)
+        self._items.reverse()
+
+    def sourceLine(self, index, offset=0):
+        """ Return the source line of the line `offset` of the block at `index`, None if not tracked. """
+        return None
+
+    def sourceLines(self, count=None):
+        """
+        Return the source lines of the lines of the blocks (the first `count`
+        ones if given) joined by blank lines, None if not tracked.
+        """
+        return None
+
+    def _position(self, index):
+        """ Return the position of the block at `index` in the reversed list. """
+        length = len(self._items)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError('block index out of range')
+        return length - 1 - index
+
+    def _replace(self, blocks):
+        """ Replace the blocks. """
+        self._items = list(blocks)
+        self._items.reverse()
+
+    def pop(self, index=-1):
+        """ Remove and return the block at `index` (the last one by default). """
+        if index == 0:
+            return self._items.pop()
+        return self._items.pop(self._position(index))
+
+    def insert(self, index, block):
+        """ Insert `block` before `index`. """
+        if index == 0:
+            self._items.append(block)
+            return
+        length = len(self._items)
+        if index < 0:
+            index = max(index + length, 0)
+        self._items.insert(length - min(index, length), block)
+
+    def append(self, block):
+        """ Add `block` after the last one. """
+        self._items.insert(0, block)
+
+    def extend(self, blocks):
+        """ Add `blocks` after the last one. """
+        self._items[:0] = reversed(list(blocks))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        if index == 0:
+            return self._items[-1]
+        return self._items[self._position(index)]
+
+    def __setitem__(self, index, block):
+        if isinstance(index, slice):
+            blocks = list(self)
+            blocks[index] = block
+            self._replace(blocks)
+        else:
+            self._items[self._position(index)] = block
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            blocks = list(self)
+            del blocks[index]
+            self._replace(blocks)
+        else:
+            del self._items[self._position(index)]
+
+    def __iter__(self):
+        return reversed(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __bool__(self):
+        return bool(self._items)
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, list(self))
+
+
+class TrackedBlockQueue(BlockQueue):
+    """ A queue of blocks tracking the source line of each block.
+
+    The queue is given the source ``line`` of its first block. Blocks are
+    separated by a blank line, and the rest of a block pushed back after it
+    was taken from the front starts on the line where that block was cut, so
+    the lines of the blocks left to parse are known without looking them up
+    in the source. When lines were removed from a block, as definitions are,
+    its rest is given the table of the source lines of its lines instead,
+    which may also be given for the first block.
+
+    The parser only uses it when the source lines are recorded, so that the
+    parsing of other documents does not pay for the tracking.
+
+    """
+
+    def __init__(self, blocks=(), line=1):
+        BlockQueue.__init__(self, blocks)
+        self._popped = None
+        self._lines = []
+        for block in reversed(self._items):
+            self._lines.append(line)
+            offset = block.count('\n') + 2
+            line = line + offset if isinstance(line, int) else line[offset:] or _line_at(line, offset)
+        self._lines.reverse()
+        self._end = _line_at(line, 0)
+
+    @property
+    def line(self):
+        """ The source line of the first block, or following the last one when empty. """
+        if self._lines:
+            line = self._lines[-1]
+            return line if isinstance(line, int) else line[0]
+        return self._end
+
+    @property
+    def lines(self):
+        """
+        The source line of the first block, or the table of the source lines
+        of its lines if they do not follow each other; None if empty.
+        """
+        if self._lines:
+            return self._lines[-1]
+        return None
+
+    def sourceLine(self, index, offset=0):
+        line = self._lines[self._position(index)]
+        return line + offset if isinstance(line, int) else _line_at(line, offset)
+
+    def sourceLines(self, count=None):
+        length = len(self._items)
+        table = []
+        for position in range(length - 1, -1 if count is None else max(length - count, 0) - 1, -1):
+            # The lines of the block and the blank line after it
+            line = self._lines[position]
+            table.extend(_line_at(line, offset) for offset in range(self._items[position].count('\n') + 2))
+        return table[:-1]
+
+    def _insertionLine(self, index, block):
+        """
+        Return the source line of `block` inserted before `index`, or the
+        table of the source lines of its lines if they do not follow each
+        other.
+        """
+        if index == 0:
+            if self._popped is None:
+                return self.line
+            popped, line = self._popped
+            if popped.endswith(block):
+                # The rest of the last block taken from the front
+                offset = popped.count('\n', 0, len(popped) - len(block))
+                return line + offset if isinstance(line, int) else line[offset:] or _line_at(line, offset)
+            # Lines were removed from the last block taken from the front:
+            # find the others
+            indexes = _match_lines(popped.split('\n'), block.split('\n'))
+            return _lines_entry([_line_at(line, i) for i in indexes])
+        previous = self._position(index - 1)
+        return self._lineAfter(previous) + 1
+
+    def _lineAfter(self, position):
+        """ Return the source line following the block at `position` of the reversed lists. """
+        return _line_at(self._lines[position], self._items[position].count('\n') + 1)
+
+    def pop(self, index=-1):
+        if index == 0:
+            block = self._items.pop()
+            line = self._lines.pop()
+        else:
+            position = self._position(index)
+            block = self._items.pop(position)
+            line = self._lines.pop(position)
+            if position < len(self._items):
+                return block
+        # The first block was taken
+        self._popped = (block, line)
+        if not self._items:
+            self._end = _line_at(line, block.count('\n') + 1)
+        return block
+
+    def insert(self, index, block):
+        length = len(self._items)
+        if index < 0:
+            index = max(index + length, 0)
+        index = min(index, length)
+        self._lines.insert(length - index, self._insertionLine(index, block))
+        self._items.insert(length - index, block)
+
+    def append(self, block):
+        self.extend([block])
+
+    def extend(self, blocks):
+        items = list(blocks)
+        lines = []
+        line = self._lineAfter(0) + 1 if self._items else self._end
+        for block in items:
+            lines.append(line)
+            line += block.count('\n') + 2
+        lines.reverse()
+        self._lines[:0] = lines
+        items.reverse()
+        self._items[:0] = items
+
+    def _replace(self, blocks):
+        """
+        Replace the blocks, finding the lines of the new blocks in order among
+        the lines of the previous ones.
+        """
+        blocks = list(blocks)
+        if not self._items or not blocks:
+            self._end = self.line
+            self._items = []
+            self._lines = []
+            self.extend(blocks)
+            return
+        lines = '\n\n'.join(self).split('\n')
+        table = self.sourceLines()
+        indexes = _match_lines(lines, '\n\n'.join(blocks).split('\n'))
+        self._lines = []
+        i = 0
+        for block in blocks:
+            count = block.count('\n') + 1
+            self._lines.append(_lines_entry([table[index] for index in indexes[i:i + count]]))
+            i += count + 1
+        self._lines.reverse()
+        self._items = blocks[::-1]
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            BlockQueue.__delitem__(self, index)
+        else:
+            position = self._position(index)
+            del self._items[position]
+            del self._lines[position]
+
+
+class DefinitionScanner(object):
+    """ Find the lines of a block which may hold a definition.
+
+    References (``[id]: url``), footnotes (``[^id]: text``) and
+    abbreviations (``*[ABBR]: title``) are defined on lines starting with a
+    bracketed label followed by a colon. Their processors are tested in turn
+    on the same blocks: each block is scanned once for all of them, and the
+    lines found are kept until another block is scanned.
+    """
+
+    RE = re.compile(r'^[ ]{0,3}\*?\[[^\]\n]*\][ ]?:.*', re.MULTILINE)
+
+    def __init__(self, parser):
+        self.parser = parser
+
+    def lines(self, block):
+        """ Return the lines of `block` which may hold a definition. """
+        state = self.parser.zmarkdown.context.get_state(self)
+        if state.get('block') is not block:
+            state['block'] = block
+            state['lines'] = self.RE.findall(block)
+        return state['lines']
+
+
 class BlockParser:
     """ Parse Markdown blocks into an ElementTree object.
 
@@ -47,8 +386,37 @@ class BlockParser:
 
     def __init__(self, zmarkdown):
         self.blockprocessors = odict.OrderedDict()
-        self.state = State()
         self.zmarkdown = zmarkdown
+        self._dispatch = None
+        self.definitions = DefinitionScanner(self)
+
+    @property
+    def state(self):
+        """ The parser state of the document being parsed. """
+        return self.zmarkdown.context.get_state(self, State)
+
+    @property
+    def line(self):
+        """ The source line of the block being parsed, None if not recorded. """
+        line = self.zmarkdown.context.blockLine
+        return line if line is None or isinstance(line, int) else line[0]
+
+    def lineAt(self, offset):
+        """ Return the source line `offset` lines into the block being parsed, None if not recorded. """
+        line = self.zmarkdown.context.blockLine
+        return line if line is None else _line_at(line, offset)
+
+    def linesAt(self, offset):
+        """
+        Return the source lines of the block being parsed from its line
+        `offset`, to parse them with `parseChunk` or `parseBlocks`: the source
+        line of that line, or the table of their source lines if some were
+        removed. None if not recorded.
+        """
+        line = self.zmarkdown.context.blockLine
+        if line is None or isinstance(line, int):
+            return line if line is None else line + offset
+        return line[offset:] or _line_at(line, offset)
 
     def parseDocument(self, lines):
         """ Parse a markdown document into an ElementTree.
@@ -61,11 +429,13 @@ class BlockParser:
 
         """
         # Create a ElementTree from the lines
-        self.root = util.etree.Element(self.zmarkdown.doc_tag)
-        self.parseChunk(self.root, '\n'.join(lines))
-        return util.etree.ElementTree(self.root)
+        root = util.etree.Element(self.zmarkdown.doc_tag)
+        # The lines of the blocks are only tracked if they are recorded
+        line = 1 if self.zmarkdown.context.blockLines is not None else None
+        self.parseChunk(root, '\n'.join(lines), line)
+        return util.etree.ElementTree(root)
 
-    def parseChunk(self, parent, text):
+    def parseChunk(self, parent, text, line=None):
         """ Parse a chunk of markdown text and attach to given etree node.
 
         While the ``text`` argument is generally assumed to contain multiple
@@ -76,28 +446,234 @@ class BlockParser:
         The ``parent`` etree Element passed in is altered in place.
         Nothing is returned.
 
+        ``line`` is the source line of the first line of ``text`` (see
+        `parseBlocks`).
+
         """
         if self.zmarkdown.inline:
             self.blockprocessors["paragraph"].run(parent, [text])
         else:
-            self.parseBlocks(parent, text.split('\n\n'))
+            self.parseBlocks(parent, text.split('\n\n'), line)
 
-    def parseBlocks(self, parent, blocks):
+    def parseBlocks(self, parent, blocks, line=None):
         """ Process blocks of markdown text and attach to given etree node.
 
-        Given a list of ``blocks``, each blockprocessor is stepped through
-        until there are no blocks left. While an extension could potentially
-        call this method directly, it's generally expected to be used
-        internally.
+        Given a list or a `BlockQueue` of ``blocks``, each blockprocessor is
+        stepped through until there are no blocks left. While an extension
+        could potentially call this method directly, it's generally expected
+        to be used internally.
 
         This is a public method as an extension may need to add/alter
         additional BlockProcessors which call this method to recursively
         parse a nested block.
 
+        A list is copied in a new queue. When the source lines are recorded,
+        its first block starts on the source ``line``, by default the line of
+        the block being parsed: a processor parsing a part of its block which
+        does not start on its first line gives the line of that part.
+
+        """
+        context = self.zmarkdown.context
+        if context.blockLines is None:
+            # The lines are not tracked
+            if not isinstance(blocks, BlockQueue):
+                blocks = BlockQueue(blocks)
+            budget = context.budget
+            if budget is not None:
+                # Nested blocks are parsed recursively
+                budget.enter()
+                try:
+                    self._parseBlocks(parent, blocks, context, budget)
+                finally:
+                    budget.leave()
+            else:
+                self._parseBlocks(parent, blocks, context)
+            return
+        if not isinstance(blocks, BlockQueue):
+            line = context.blockLine if line is None else line
+            blocks = BlockQueue(blocks) if line is None else TrackedBlockQueue(blocks, line)
+        if blocks.line is not None and blocks:
+            # The element spans the lines which are not blank
+            first = blocks[0]
+            first = _line_at(blocks.lines, first.count('\n', 0, len(first) - len(first.lstrip())))
+            last = blocks[-1]
+            self.locate(parent, first, blocks.sourceLine(-1, last.count('\n', 0, len(last.rstrip()))))
+        budget = context.budget
+        if budget is not None:
+            # Nested blocks are parsed recursively
+            budget.enter()
+        current = context.blockLine
+        try:
+            self._parseBlocks(parent, blocks, context, budget)
+        finally:
+            context.blockLine = current
+            if budget is not None:
+                budget.leave()
+
+    def locate(self, element, first, last):
+        """
+        Record that `element` spans the source lines `first` to `last`,
+        extending the lines already recorded for it. Trailing blank lines are
+        not counted.
+
+        The parser locates the elements added by block processors from the
+        lines of their blocks. Processors moving text to a new element locate
+        it themselves.
+        """
+        context = self.zmarkdown.context
+        if context.blockLines is None:
+            return
+        located = context.blockLines.get(element)
+        if located is not None:
+            first = located[0]
+        lines = context.lines
+        while last > first and last <= len(lines) and not lines[last - 1].strip():
+            last -= 1
+        if located is not None:
+            last = max(last, located[1])
+        context.blockLines[element] = (first, max(first, last))
+
+    def _locateRun(self, located, lines, parent, count, block, line, following, rest, continues=True):
+        """
+        Locate the elements a block processor added after the first `count`
+        children of `parent`, in `located` (the `blockLines` of the render
+        context, whose source `lines` are given). The `block` starts on the
+        source `line`, or has the table of source lines `line`, the next block
+        started on the line `following` (None if there was none) and what the
+        processor did not consume starts after `rest`. The last element is
+        only extended if the processor `continues` the elements.
+        """
+        # Blank lines around the text of the block are not counted
+        start = len(block) - len(block.lstrip())
+        last = _line_at(line, block.count('\n', 0, len(block.rstrip())))
+        line = _line_at(line, block.count('\n', 0, start))
+        if following is not None and rest >= following:
+            # The processor consumed the next blocks too
+            last = rest
+            while last > line and last <= len(lines) and not lines[last - 1].strip():
+                last -= 1
+        else:
+            last = min(last, rest)
+        first = line
+        for element in parent[count:]:
+            # Elements of the parts parsed recursively are already located
+            if element not in located:
+                located[element] = (first, max(first, last))
+            first = min(located[element][1] + 1, max(line, last))
+        if len(parent) == count:
+            # The block only continued the last element, or held definitions
+            # which were removed from the text
+            while last >= line and last <= len(lines) and DefinitionScanner.RE.match(lines[last - 1]):
+                last -= 1
+        if continues and len(parent) and last >= line:
+            # The last element may have been continued by the block
+            element = parent[-1]
+            span = located.get(element)
+            if span is None:
+                located[element] = (line, last)
+            elif span[1] < last:
+                located[element] = (span[0], last)
+
+    def _dispatchTable(self):
+        """
+        Return the block processors, with their priority, and the table of
+        the processors which can claim the blocks starting with a character.
+
+        The table is filled as new first characters are met, and emptied
+        when the block processors change.
+        """
+        processors = tuple(self.blockprocessors.items())
+        dispatch = self._dispatch
+        if dispatch is None or dispatch[0] != processors:
+            dispatch = self._dispatch = (processors, {})
+        return dispatch
+
+    def _candidates(self, dispatch, block, priority=-1):
+        """
+        Return the ``(priority, name, processor)`` of the block processors
+        after `priority` which can claim `block`, in priority order (see
+        `BlockProcessor.starts` and `BlockProcessor.line_starts`).
+
+        Empty blocks can be claimed by any processor.
+        """
+        processors, table = dispatch
+        if not block:
+            return [(index, name, processor) for index, (name, processor) in enumerate(processors)
+                    if index > priority]
+        first = block[0]
+        entries = table.get(first)
+        if entries is None:
+            entries = []
+            for index, (name, processor) in enumerate(processors):
+                starts = getattr(processor, 'starts', None)
+                if starts is None or first in starts:
+                    entries.append((index, name, processor, getattr(processor, 'line_starts', None)))
+            table[first] = entries
+        lines = None
+        candidates = []
+        for index, name, processor, line_starts in entries:
+            if index <= priority:
+                continue
+            if line_starts is not None:
+                if lines is None:
+                    lines = set(line[:1] for line in block.split('\n'))
+                if lines.isdisjoint(line_starts):
+                    continue
+            candidates.append((index, name, processor))
+        return candidates
+
+    def _parseBlocks(self, parent, blocks, context, budget=None):
+        """
+        Run the block processors on `blocks`, in priority order.
+
+        With stats in the render `context`, the time of each processor is
+        recorded, and the processors which can not claim a block, and are not
+        tested, are recorded in the 'blockprocessor.skip' category.
         """
+        dispatch = self._dispatchTable()
+        processors = dispatch[0]
+        stats = context.stats
+        located = context.blockLines
+        if located is not None and blocks.line is None:
+            # Only the elements parsed from blocks of known lines are located
+            located = None
         while blocks:
-            for processor in self.blockprocessors.values():
-                if processor.test(parent, blocks[0]):
-                    if processor.run(parent, blocks) is not False:
+            if budget is not None:
+                budget.check()
+            block = blocks[0]
+            if located is not None:
+                line = context.blockLine = blocks.lines
+                following = blocks.sourceLine(1) if len(blocks) > 1 else None
+                count = len(parent)
+            candidates = self._candidates(dispatch, block)
+            i = 0
+            skipped = 0
+            while i < len(candidates):
+                priority, name, processor = candidates[i]
+                i += 1
+                if stats is None:
+                    result = processor.test(parent, block) and processor.run(parent, blocks) is not False
+                else:
+                    for skipped_name, _ in processors[skipped:priority]:
+                        stats.record('blockprocessor.skip', skipped_name)
+                    skipped = priority + 1
+                    start = util.timer()
+                    result = processor.test(parent, block)
+                    stats.record('blockprocessor.test', name, util.timer() - start, bool(result))
+                    if result:
+                        start = util.timer()
                         # run returns True or None
-                        break
+                        result = processor.run(parent, blocks) is not False
+                        stats.record('blockprocessor.run', name, util.timer() - start)
+                if result:
+                    if located is not None and block.strip():
+                        self._locateRun(located, context.lines, parent, count, block, line, following,
+                                        blocks.line - 1, getattr(processor, 'continues', True))
+                    break
+                if blocks and blocks[0] is not block:
+                    # The block was changed, find the next candidates for the new one
+                    block = blocks[0]
+                    if located is not None:
+                        line = context.blockLine = blocks.lines
+                    candidates = self._candidates(dispatch, block, priority)
+                    i = 0
@@ -48,8 +48,27 @@ class BlockProcessor:
     whether the current block should be processed by this processor. If the
     test passes, the parser will call the processors ``run`` method.
 
+    Processors can declare the characters a block they claim starts with
+    (``starts``), or the characters one of its lines starts with
+    (``line_starts``): the parser only tests a processor on the blocks
+    starting with one of its ``starts`` and with a line starting with one of
+    its ``line_starts``. Neither applies to empty blocks, which are tested
+    on every processor. Subclasses changing what a processor claims must
+    update them.
+
+    Processors which only remove text from the blocks, and never continue
+    the last element of the parent with it, set ``continues`` to False so
+    that the parser does not extend the source lines of that element.
+
     """
 
+    # Characters one of which starts every claimed block, None if unknown
+    starts = None
+    # Characters one of which starts a line of every claimed block
+    line_starts = None
+    # Whether a claimed block may continue the last element of the parent
+    continues = True
+
     def __init__(self, parser):
         self.parser = parser
         self.tab_length = parser.zmarkdown.tab_length
@@ -61,6 +80,23 @@ class BlockProcessor:
         else:
             return None
 
+    def locateLines(self, element, first, last=None):
+        """ Locate `element` on the lines `first` to `last` (`first` by default) of the block being parsed. """
+        line = self.parser.lineAt(first)
+        if line is not None:
+            self.parser.locate(element, line, line if last is None else self.parser.lineAt(last))
+
+    def locateAt(self, element, block, position):
+        """ Locate `element` on the line of `block`, the block being parsed, holding `position`. """
+        if self.parser.line is not None:
+            self.locateLines(element, block.count('\n', 0, position))
+
+    def locateText(self, element, item):
+        """ Locate `element`, made from the text of `item`, on the lines of `item`. """
+        located = self.parser.zmarkdown.context.blockLines
+        if located is not None and item in located:
+            self.parser.locate(element, *located[item])
+
     def detab(self, text):
         """ Remove a tab from the front of each line of the given text. """
         newtext = []
@@ -132,16 +168,16 @@ class ReferenceProcessor(BlockProcessor):
 
     TITLE = r'[ ]*(\"(.*)\"|\'(.*)\'|\((.*)\))[ ]*'
     RE = re.compile(r'^[ ]{0,3}\[([^\]]*)\]:\s*([^ ]*)[ ]*(%s)?$' % TITLE, re.DOTALL)
+    line_starts = ' ['
+    continues = False
     TITLE_RE = re.compile(r'^%s$' % TITLE)
 
     def __init__(self, *args):
         BlockProcessor.__init__(self, *args)
 
     def test(self, parent, block):
-        lines = block.split("\n")
-        for line in lines:
-            m = self.RE.match(line)
-            if m:
+        for line in self.parser.definitions.lines(block):
+            if self.RE.match(line):
                 return True
         return False
 
@@ -149,8 +185,10 @@ class ReferenceProcessor(BlockProcessor):
         block = blocks.pop(0)
         lines = block.split("\n") + [""]
         new_text = []
-        while lines:
-            line = lines.pop(0)
+        i = 0
+        while i < len(lines):
+            line = lines[i]
+            i += 1
             m = self.RE.match(line)
             if m:
                 idd = m.group(1).strip().lower()
@@ -158,9 +196,9 @@ class ReferenceProcessor(BlockProcessor):
                 t = m.group(5) or m.group(6) or m.group(7)
                 if not t:
                     # Check next line for title
-                    tm = self.TITLE_RE.match(lines[0])
+                    tm = self.TITLE_RE.match(lines[i])
                     if tm:
-                        lines.pop(0)
+                        i += 1
                         t = tm.group(2) or tm.group(3) or tm.group(4)
                 self.parser.zmarkdown.references[idd] = (link, t)
             else:
@@ -181,10 +219,11 @@ class ListIndentProcessor(BlockProcessor):
 
     ITEM_TYPES = ['li']
     LIST_TYPES = ['ul', 'ol']
+    starts = ' '
 
     def __init__(self, *args):
         BlockProcessor.__init__(self, *args)
-        self.INDENT_RE = re.compile(r'^(([ ]{%s})+)' % self.tab_length)
+        self.INDENT_RE = util.compile_regex(r'^(([ ]{%s})+)' % self.tab_length)
 
     def test(self, parent, block):
         return (block.startswith(' ' * self.tab_length) and
@@ -224,6 +263,7 @@ class ListIndentProcessor(BlockProcessor):
                 p.text = sibling[-1].text
                 sibling[-1].text = ''
                 sibling[-1].insert(0, p)
+                self.locateText(p, sibling[-1])
             self.parser.parseChunk(sibling[-1], block)
         else:
             self.create_item(sibling, block)
@@ -266,6 +306,8 @@ class ListIndentProcessor(BlockProcessor):
 class CodeBlockProcessor(BlockProcessor):
     """ Process code blocks. """
 
+    starts = ' '
+
     def test(self, parent, block):
         return block.startswith(' ' * self.tab_length)
 
@@ -295,15 +337,20 @@ class CodeBlockProcessor(BlockProcessor):
 
 class BlockQuoteProcessor(BlockProcessor):
     RE = re.compile(r'(^|\n)[ ]{0,3}>[ ]?(.*)')
+    line_starts = ' >'
 
     def test(self, parent, block):
         return bool(self.RE.search(block))
 
     def run(self, parent, blocks):
         block = blocks.pop(0)
+        first = self.parser.linesAt(0)
         m = self.RE.search(block)
         if m:
             before = block[:m.start()]  # Lines before blockquote
+            if first is not None:
+                # The text of the quote starts with the end of the line before
+                first = self.parser.linesAt(block.count('\n', 0, m.start()))
             # Pass lines before blockquote in recursively for parsing forst.
             self.parser.parseBlocks(parent, [before])
             # Remove ``> `` from begining of each line.
@@ -320,7 +367,7 @@ class BlockQuoteProcessor(BlockProcessor):
         # Recursively parse block with blockquote as parent.
         # change parser state so blockquotes embedded in lists use p tags
         self.parser.state.set('blockquote')
-        self.parser.parseChunk(quote, block)
+        self.parser.parseChunk(quote, block, first)
         self.parser.state.reset()
 
     def clean(self, line):
@@ -340,6 +387,7 @@ class OListProcessor(BlockProcessor):
     TAG = 'ol'
     # Detect an item (``1. item``). ``group(1)`` contains contents of item.
     RE = re.compile(r'^[ ]{0,3}\d+\.[ ]+(.*)')
+    # No ``starts``: ``\d`` also matches the digits of other scripts
     # Detect items on secondary lines. they can be of either list type.
     CHILD_RE = re.compile(r'^[ ]{0,3}((\d+\.)|[*+-])[ ]+(.*)')
     # Detect indented (nested) items of either type
@@ -358,6 +406,13 @@ class OListProcessor(BlockProcessor):
     def run(self, parent, blocks):
         # Check fr multiple items in one block.
         items = self.get_items(blocks.pop(0))
+        lines = [None] * len(items)
+        if self.parser.line is not None:
+            # Each item is made of the next lines of the block
+            offset = 0
+            for i, item in enumerate(items):
+                lines[i] = self.parser.linesAt(offset)
+                offset += item.count('\n') + 1
         sibling = self.lastChild(parent)
 
         if sibling is not None and sibling.tag in self.SIBLING_TAGS:
@@ -373,6 +428,7 @@ class OListProcessor(BlockProcessor):
                 p.text = lst[-1].text
                 lst[-1].text = ''
                 lst[-1].insert(0, p)
+                self.locateText(p, lst[-1])
             # if the last item has a tail, then the tail needs to be put in a p
             # likely only when a header is not followed by a blank line
             lch = self.lastChild(lst[-1])
@@ -385,7 +441,7 @@ class OListProcessor(BlockProcessor):
             li = util.etree.SubElement(lst, 'li')
             self.parser.state.set('looselist')
             firstitem = items.pop(0)
-            self.parser.parseBlocks(li, [firstitem])
+            self.parser.parseBlocks(li, [firstitem], lines.pop(0))
             self.parser.state.reset()
         elif parent.tag in ['ol', 'ul']:
             # this catches the edge case of a multi-item indented list whose
@@ -401,14 +457,14 @@ class OListProcessor(BlockProcessor):
         self.parser.state.set('list')
         # Loop through items in block, recursively parsing each with the
         # appropriate parent.
-        for item in items:
+        for item, line in zip(items, lines):
             if item.startswith(' ' * self.tab_length):
                 # Item is indented. Parse with last item as parent
-                self.parser.parseBlocks(lst[-1], [item])
+                self.parser.parseBlocks(lst[-1], [item], line)
             else:
                 # New item. Create li and parse with it as parent
                 li = util.etree.SubElement(lst, 'li')
-                self.parser.parseBlocks(li, [item])
+                self.parser.parseBlocks(li, [item], line)
         self.parser.state.reset()
 
     def get_items(self, block):
@@ -421,7 +477,7 @@ class OListProcessor(BlockProcessor):
                 # Check first item for the start index
                 if not items and self.TAG == 'ol':
                     # Detect the integer value of first list item
-                    INTEGER_RE = re.compile('(\d+)')
+                    INTEGER_RE = util.compile_regex('(\d+)')
                     self.STARTSWITH = INTEGER_RE.match(m.group(1)).group()
                 # Append to the list
                 items.append(m.group(3))
@@ -443,6 +499,7 @@ class UListProcessor(OListProcessor):
 
     TAG = 'ul'
     RE = re.compile(r'^[ ]{0,3}[*+-][ ]+(.*)')
+    starts = ' *+-'
     SIBLING_TAGS = ['ul', ]
 
 
@@ -451,6 +508,7 @@ class HashHeaderProcessor(BlockProcessor):
 
     # Detect a header at start of any line in block
     RE = re.compile(r'(^|\n)(?P<level>#{1,6})(?P<header>.*?)#*(\n|$)')
+    line_starts = '#'
 
     def test(self, parent, block):
         return bool(self.RE.search(block))
@@ -469,6 +527,7 @@ class HashHeaderProcessor(BlockProcessor):
             # Create header using named groups from RE
             h = util.etree.SubElement(parent, 'h%d' % len(m.group('level')))
             h.text = m.group('header').strip()
+            self.locateAt(h, block, m.start('level'))
             if after:
                 # Insert remaining lines as first block for future parsing.
                 blocks.insert(0, after)
@@ -482,6 +541,7 @@ class SetextHeaderProcessor(BlockProcessor):
 
     # Detect Setext-style header. Must be first 2 lines of block.
     RE = re.compile(r'^.*?\n[=-]+[ ]*(\n|$)', re.MULTILINE)
+    line_starts = '=-'
 
     def test(self, parent, block):
         return bool(self.RE.match(block))
@@ -506,29 +566,35 @@ class HRProcessor(BlockProcessor):
     RE = r'^[ ]{0,3}((-+[ ]{0,2}){3,}|(_+[ ]{0,2}){3,}|(\*+[ ]{0,2}){3,})[ ]*'
     # Detect hr on any line of a block.
     SEARCH_RE = re.compile(RE, re.MULTILINE)
+    line_starts = ' -_*'
 
-    def test(self, parent, block):
+    def search(self, block):
+        """ Return the match of the hr in block or None. """
         m = self.SEARCH_RE.search(block)
         # No atomic grouping in python so we simulate it here for performance.
         # The regex only matches what would be in the atomic group - the HR.
         # Then check if we are at end of block or if next char is a newline.
         if m and (m.end() == len(block) or block[m.end()] == '\n'):
-            # Save match object on class instance so we can use it later.
-            self.match = m
-            return True
-        return False
+            return m
+        return None
+
+    def test(self, parent, block):
+        return self.search(block) is not None
 
     def run(self, parent, blocks):
         block = blocks.pop(0)
+        # The match is not kept from test(): processors are shared by threads.
+        match = self.search(block)
         # Check for lines in block before hr.
-        prelines = block[:self.match.start()].rstrip('\n')
+        prelines = block[:match.start()].rstrip('\n')
         if prelines:
             # Recursively parse lines before hr so they get parsed first.
             self.parser.parseBlocks(parent, [prelines])
         # create hr
-        util.etree.SubElement(parent, 'hr')
+        hr = util.etree.SubElement(parent, 'hr')
+        self.locateAt(hr, block, match.start())
         # check for lines in block after hr.
-        postlines = block[self.match.end():].lstrip('\n')
+        postlines = block[match.end():].lstrip('\n')
         if postlines:
             # Add lines after hr to master blocks for later parsing.
             blocks.insert(0, postlines)
@@ -537,6 +603,9 @@ class HRProcessor(BlockProcessor):
 class EmptyBlockProcessor(BlockProcessor):
     """ Process blocks that are empty or start with an empty line. """
 
+    # Empty blocks are tested on every processor
+    starts = '\n'
+
     def test(self, parent, block):
         return not block or block.startswith('\n')
 
@@ -0,0 +1,210 @@
+"""
+RENDER CACHE
+=============================================================================
+
+Converting the same text with the same configuration always gives the same
+result. A render cache stores the html and the metadata of each converted
+document, keyed on the source text and on a fingerprint of the ZMarkdown
+configuration (options and configs of every loaded extension), so that
+identical posts, quotes and previews are only parsed once.
+
+A cache backend is given to ZMarkdown with the `cache` option:
+
+    >>> md = ZMarkdown(extensions=[...], cache=MemoryCache(max_size=2 ** 24))
+
+Backends only need to implement `get(key)` (returning None when the key is
+unknown) and `set(key, value)`. Two backends are provided: an in-process LRU
+bounded by the size of the stored html, and a local sqlite database.
+
+Callables found in the configuration (`ping_url` for instance) are
+fingerprinted by their code, default arguments and closure, not by their
+name, as all lambdas share one. The globals they read are not part of the
+fingerprint: they must only depend on their arguments and closure. An
+instance whose configuration holds a callable which can not be fingerprinted
+this way (a bound method, a callable object, a closure over an arbitrary
+object...) does not use its cache at all.
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from . import util
+from .__version__ import version
+import copy
+import hashlib
+import logging
+import marshal
+import pickle
+import threading
+import types
+
+logger = logging.getLogger('ZMARKDOWN')
+
+# Values which may be held by the closure or the defaults of a fingerprinted callable
+FROZEN_TYPES = (type(None), bool, int, float, complex, util.string_type, util.text_type, bytes)
+if not util.PY3:  # pragma: no cover
+    FROZEN_TYPES += (long,)  # noqa
+
+
+class UncacheableError(Exception):
+    """ A configuration value can not be fingerprinted reliably. """
+    pass
+
+
+def normalize_config(value, strict=False, seen=()):
+    """
+    Return a stable representation of a configuration value.
+
+    With `strict`, raise an UncacheableError for values whose representation
+    may not identify them, instead of relying on their repr.
+
+    """
+    if isinstance(value, dict):
+        return sorted((normalize_config(k, strict, seen), normalize_config(v, strict, seen))
+                      for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [normalize_config(v, strict, seen) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted(normalize_config(v, strict, seen) for v in value)
+    if callable(value):
+        return normalize_callable(value, seen)
+    if strict and not isinstance(value, FROZEN_TYPES):
+        raise UncacheableError('%r can not be fingerprinted' % value)
+    return value
+
+
+def normalize_callable(value, seen=()):
+    """ Return a stable representation of a callable, identifying its behaviour. """
+    name = '%s.%s' % (getattr(value, '__module__', ''),
+                      getattr(value, '__qualname__', getattr(value, '__name__', '')))
+    if isinstance(value, types.FunctionType):
+        if id(value) in seen:
+            # A recursive closure references itself
+            return name
+        seen += (id(value),)
+        # Lambdas and closures share their name: use their code and the values they hold
+        return [name, hashlib.sha1(marshal.dumps(value.__code__)).hexdigest(),
+                normalize_config(value.__defaults__ or (), True, seen),
+                normalize_config(getattr(value, '__kwdefaults__', None) or {}, True, seen),
+                [normalize_config(cell.cell_contents, True, seen) for cell in value.__closure__ or ()]]
+    if isinstance(value, type) or (isinstance(value, types.BuiltinFunctionType) and
+                                   (value.__self__ is None or isinstance(value.__self__, types.ModuleType))):
+        # Classes and builtin functions are identified by their name
+        return name
+    # Bound methods and callable objects depend on the state of their instance
+    raise UncacheableError('%r can not be fingerprinted' % value)
+
+
+def fingerprint(md):
+    """
+    Return a fingerprint of the configuration of a ZMarkdown instance.
+
+    Raise an UncacheableError if the configuration can not be fingerprinted.
+
+    """
+    # The cache and profiling options do not change the output
+    config = [version, normalize_config(dict((option, getattr(md, option)) for option in md.option_defaults
+                                             if option not in ('cache', 'profile')))]
+    for ext in md.loadedExtensions:
+        config.append(('%s.%s' % (ext.__class__.__module__, ext.__class__.__name__),
+                       normalize_config(ext.getConfigs())))
+    return hashlib.sha1(repr(config).encode('utf-8')).hexdigest()
+
+
+def cache_key(md, source):
+    """
+    Return the cache key of `source` converted by `md`, or None if the
+    configuration of `md` can not be fingerprinted.
+
+    """
+    # The configuration does not change once the extensions are loaded
+    if getattr(md, '_fingerprint', None) is None:
+        try:
+            md._fingerprint = fingerprint(md)
+        except UncacheableError as e:
+            logger.warning('Render cache disabled: %s', e)
+            md._fingerprint = False
+    if md._fingerprint is False:
+        return None
+    digest = hashlib.sha1(md._fingerprint.encode('utf-8'))
+    digest.update(source.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class CacheBackend(object):
+    """ Base class of the render cache backends. """
+
+    def get(self, key):
+        """ Return the ``(html, metadata)`` stored for `key`, or None. """
+        pass  # pragma: no cover
+
+    def set(self, key, value):
+        """ Store the ``(html, metadata)`` of a converted document. """
+        pass  # pragma: no cover
+
+
+class MemoryCache(CacheBackend):
+    """ In-process LRU cache, bounded by the total length of the stored html. """
+
+    def __init__(self, max_size=2 ** 24):
+        self.lru = util.LRUCache(max_size, sizeof=lambda value: len(value[0]))
+
+    def get(self, key):
+        value = self.lru.get(key)
+        if value is not None:
+            # Metadata holds mutable values: never share them between documents
+            value = (value[0], copy.deepcopy(value[1]))
+        return value
+
+    def set(self, key, value):
+        self.lru.set(key, (value[0], copy.deepcopy(value[1])))
+
+    def stats(self):
+        return self.lru.stats()
+
+
+class SqliteCache(CacheBackend):
+    """ Persistent cache stored in a local sqlite database. """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connect().execute('CREATE TABLE IF NOT EXISTS render_cache '
+                                '(key TEXT PRIMARY KEY, html TEXT, metadata BLOB)')
+
+    def _connect(self):
+        import sqlite3
+
+        # sqlite connections can not be shared between threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.path)
+        return connection
+
+    def get(self, key):
+        row = self._connect().execute('SELECT html, metadata FROM render_cache WHERE key = ?',
+                                      (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0], pickle.loads(bytes(row[1]))
+
+    def set(self, key, value):
+        import sqlite3
+
+        html, metadata = value
+        connection = self._connect()
+        with connection:
+            connection.execute('INSERT OR REPLACE INTO render_cache VALUES (?, ?, ?)',
+                               (key, html, sqlite3.Binary(pickle.dumps(metadata, 2))))
+
+    def clear(self):
+        """ Remove all entries of the cache. """
+        connection = self._connect()
+        with connection:
+            connection.execute('DELETE FROM render_cache')
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self._local = threading.local()
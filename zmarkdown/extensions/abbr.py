@@ -26,6 +26,7 @@ import re
 
 # Global Vars
 ABBR_REF_RE = re.compile(r'[*]\[(?P<abbr>[^\]]*)\][ ]?:\s*(?P<title>.*)')
+WORD_RE = re.compile(r'\w', re.UNICODE)
 
 
 class AbbrExtension(Extension):
@@ -38,22 +39,24 @@ class AbbrExtension(Extension):
 
 class AbbrBlockprocessor(BlockProcessor):
     """ Abbreviation Preprocessor - parse text for abbr references. """
+
+    line_starts = '*'
+    continues = False
+
     def __init__(self, md):
         BlockProcessor.__init__(self, md.parser)
         self.zmarkdown = md
 
     def test(self, parent, block):
-        lines = block.split("\n")
-        for line in lines:
-            m = ABBR_REF_RE.match(line)
-            if m:
+        for line in self.parser.definitions.lines(block):
+            if ABBR_REF_RE.match(line):
                 return True
         return False
 
     def run(self, parent, blocks):
         '''
         Find and remove all Abbreviation references from the text.
-        Each reference is set as a new AbbrPattern in the markdown instance.
+        Each reference is added to the AbbrPattern of the current document.
 
         '''
         block = blocks.pop(0)
@@ -64,39 +67,77 @@ class AbbrBlockprocessor(BlockProcessor):
             if m:
                 abbr = m.group('abbr').strip()
                 title = m.group('title').strip()
-                self.zmarkdown.inlinePatterns['abbr-%s' % abbr] = \
-                    AbbrPattern(self._generate_pattern(abbr), title)
+                if abbr:
+                    self.abbrPattern().add(abbr, title)
             else:
                 new_text.append(line)
         blocks.insert(0, "\n".join(new_text[:-1]))
 
-    def _generate_pattern(self, text):
-        '''
-        Given a string, returns an regex pattern to match that string.
-
-        'HTML' -> r'(?P<abbr>[H][T][M][L])'
-
-        Note: we force each char as a literal match (in brackets) as we don't
-        know what they will be beforehand.
-
-        '''
-        chars = list(text)
-        for i in range(len(chars)):
-            chars[i] = r'[%s]' % chars[i]
-        return r'(?P<abbr>\b%s\b)' % (r''.join(chars))
+    def abbrPattern(self):
+        """ Return the pattern matching the abbreviations of the current document. """
+        context = self.zmarkdown.context
+        if context.inlinePatterns is None:
+            # Never alter the patterns shared by all documents
+            context.inlinePatterns = self.zmarkdown.inlinePatterns.copy()
+        if 'abbr' not in context.inlinePatterns:
+            context.inlinePatterns['abbr'] = AbbrPattern()
+        return context.inlinePatterns['abbr']
 
 
 class AbbrPattern(Pattern):
-    """ Abbreviation inline pattern. """
-
-    def __init__(self, pattern, title):
-        super(AbbrPattern, self).__init__(pattern)
-        self.title = title
+    """
+    Abbreviation inline pattern, matching all the abbreviations of a
+    document with a single regular expression.
+
+    """
+
+    def __init__(self):
+        # Replacing an abbreviation can not change the next match while they
+        # all start and end with a word character (and a word boundary)
+        Pattern.__init__(self, r'(?P<abbr>(?!))', triggers='', resumable=True)
+        self.titles = {}
+        # The expression is compiled once all the abbreviations are known
+        self.pattern = self.compiled_re = self.search_re = None
+
+    def add(self, abbr, title):
+        """ Define an abbreviation, replacing any previous definition of it. """
+        self.titles[abbr] = title
+        if abbr[0] not in self.triggers:
+            self.triggers += abbr[0]
+        if not (WORD_RE.match(abbr[0]) and WORD_RE.match(abbr[-1])):
+            self.resumable = False
+        # The expression is compiled once all the abbreviations are known
+        self.pattern = self.compiled_re = self.search_re = None
+
+    def compile(self):
+        """
+        Compile the alternation of all the abbreviations, the longest first
+        so that the longest abbreviation found at a position is matched.
+
+        'HTML', 'CSS' -> r'(?P<abbr>\b(?:HTML|CSS)\b)'
+
+        """
+        abbreviations = sorted(self.titles, key=lambda abbr: (-len(abbr), abbr))
+        self.pattern = r'(?P<abbr>\b(?:%s)\b)' % '|'.join(re.escape(abbr) for abbr in abbreviations)
+        # The expressions of a document are not shared: keep them out of the
+        # regex cache of the patterns
+        self.compiled_re = re.compile("^(.*?)%s(.*?)$" % self.pattern, re.DOTALL | re.UNICODE)
+        self.search_re = re.compile("()%s()" % self.pattern, re.DOTALL | re.UNICODE)
+
+    def getCompiledRegExp(self):
+        if self.compiled_re is None:
+            self.compile()
+        return self.compiled_re
+
+    def getSearchRegExp(self):
+        if self.search_re is None:
+            self.compile()
+        return self.search_re
 
     def handleMatch(self, m):
         abbr = etree.Element('abbr')
         abbr.text = AtomicString(m.group('abbr'))
-        abbr.set('title', self.title)
+        abbr.set('title', self.titles[m.group('abbr')])
         return abbr
 
 
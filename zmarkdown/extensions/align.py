@@ -9,13 +9,15 @@ from zmarkdown import util
 class AlignProcessor(BlockProcessor):
     """ Process Align. """
 
+    line_starts = '-'
+
     def __init__(self, parser):
         BlockProcessor.__init__(self, parser)
 
         exprs = (("->", "right"), ("<-", "center"))
 
-        self.REStart = re.compile(r'(^|\n)' + re.escape('->'))
-        self._ending_re = [re.compile(re.escape(end_expr) + r'(\n|$)') for end_expr, _ in exprs]
+        self.REStart = util.compile_regex(r'(^|\n)' + re.escape('->'))
+        self._ending_re = [util.compile_regex(re.escape(end_expr) + r'(\n|$)') for end_expr, _ in exprs]
         self._kind_align = [kind_align for _, kind_align in exprs]
 
     def test(self, parent, block):
@@ -54,7 +56,10 @@ class AlignProcessor(BlockProcessor):
         first_block = blocks[0]
         start_block, content_align, end_block = self._extract_position(blocks, m)
         if start_block is None:
-            return None, None, None, None
+            return None, None, None, None, None
+
+        # Source lines of the blocks of the content
+        lines = blocks.sourceLines(end_block[0] + 1)
 
         # Split blocks into before/content aligned/ending
         # There should never have before and ending because regex require that the expression is starting/ending the
@@ -78,7 +83,11 @@ class AlignProcessor(BlockProcessor):
             content.append(blck[startIndex: endIndex])
 
         content = "\n\n".join(content)
-        return before, content, after, content_align
+        if lines is not None:
+            # The content goes from the line of the starting expression to the line of the ending one
+            start = first_block.count('\n', 0, start_block[2])
+            lines = tuple(lines[start:start + content.count('\n') + 1])
+        return before, content, after, content_align, lines
 
     def run(self, parent, blocks):
 
@@ -89,7 +98,7 @@ class AlignProcessor(BlockProcessor):
             # Do not raise an exception because exception should never be generated.
             return False
 
-        before, content, after, content_align = self._extract_content(blocks, m)
+        before, content, after, content_align, lines = self._extract_content(blocks, m)
         if before is None:
             return False
 
@@ -109,8 +118,10 @@ class AlignProcessor(BlockProcessor):
         else:
             h = util.etree.SubElement(parent, 'div')
             h.set("align", content_align)
+        if lines:
+            self.parser.locate(h, lines[0], lines[-1])
 
-        self.parser.parseChunk(h, content)
+        self.parser.parseChunk(h, content, lines)
 
         if after:  # pragma: no cover
             # This should never occur because regex require that the expression is ending the block.
@@ -19,15 +19,30 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 from . import Extension
 from ..treeprocessors import Treeprocessor
+import importlib
+import threading
 
-try:
-    from pygments import highlight
-    from pygments.lexers import get_lexer_by_name, guess_lexer
-    from pygments.formatters import get_formatter_by_name
+# Pygments is imported on the first highlighted code block: None until then,
+# False when it is not installed
+pygments = None
+pygments_lock = threading.Lock()
 
-    pygments = True
-except ImportError:
-    pygments = False
+
+def load_pygments():
+    """ Import Pygments on first use and return it, or False if not installed. """
+    global pygments
+    if pygments is None:
+        with pygments_lock:
+            if pygments is None:
+                try:
+                    module = importlib.import_module('pygments')
+                    importlib.import_module('pygments.formatters')
+                    importlib.import_module('pygments.lexers')
+                except ImportError:
+                    module = False
+                # Only published once its submodules are imported, for other threads
+                pygments = module
+    return pygments
 
 
 def parse_hl_lines(expr):
@@ -120,25 +135,26 @@ class CodeHilite(object):
         if self.lang is None:
             self._parseHeader()
 
-        if pygments and self.use_pygments:
+        if self.use_pygments and load_pygments():
+            lexers = pygments.lexers
             try:
-                lexer = get_lexer_by_name(self.lang)
+                lexer = lexers.get_lexer_by_name(self.lang)
             except ValueError:
                 try:
                     if self.guess_lang:
-                        lexer = guess_lexer(self.src)
+                        lexer = lexers.guess_lexer(self.src)
                     else:
-                        lexer = get_lexer_by_name('text')
+                        lexer = lexers.get_lexer_by_name('text')
                 except ValueError:
-                    lexer = get_lexer_by_name('text')
-            formatter = get_formatter_by_name('html',
-                                              linenos=self.linenums,
-                                              cssclass=self.css_class,
-                                              style=self.style,
-                                              noclasses=self.noclasses,
-                                              hl_lines=self.hl_lines,
-                                              linenostart=self.linenostart)
-            return highlight(self.src, lexer, formatter)
+                    lexer = lexers.get_lexer_by_name('text')
+            formatter = pygments.formatters.get_formatter_by_name('html',
+                                                                  linenos=self.linenums,
+                                                                  cssclass=self.css_class,
+                                                                  style=self.style,
+                                                                  noclasses=self.noclasses,
+                                                                  hl_lines=self.hl_lines,
+                                                                  linenostart=self.linenostart)
+            return pygments.highlight(self.src, lexer, formatter)
         else:
             # just escape and build markup usable by JS highlighting libs
             txt = self.src.replace('&', '&amp;')
@@ -175,13 +191,14 @@ class CodeHilite(object):
         """
 
         import re
+        from ..util import compile_regex
 
         # split text into lines
         lines = self.src.split("\n")
         # pull first line to examine
         fl = lines.pop(0)
 
-        c = re.compile(r'''
+        c = compile_regex(r'''
             (?:(?:^::+)|(?P<shebang>^[#]!)) # Shebang or 2 or more colons
             (?P<path>(?:/\w+)*[/ ])?        # Zero or 1 path
             (?P<lang>[\w+-]*)               # The language
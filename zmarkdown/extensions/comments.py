@@ -1,6 +1,7 @@
 import re
 from zmarkdown.blockprocessors import BlockProcessor
 from zmarkdown.extensions import Extension
+from zmarkdown.util import compile_regex
 
 
 class CommentsExtension(Extension):
@@ -18,14 +19,17 @@ class CommentsExtension(Extension):
 
 
 class CommentsBlockProcessor(BlockProcessor):
+    continues = False
+
     def __init__(self, md, start_tag, end_tag):
         BlockProcessor.__init__(self, md.parser)
 
         StaEsc = re.escape(start_tag)
         EndEsc = re.escape(end_tag)
 
-        self.START_RE = re.compile(StaEsc, re.MULTILINE | re.DOTALL)
-        self.RE = re.compile(StaEsc + r'.*?' + EndEsc, re.MULTILINE | re.DOTALL)
+        self.START_RE = compile_regex(StaEsc, re.MULTILINE | re.DOTALL)
+        self.END_RE = compile_regex(EndEsc)
+        self.RE = compile_regex(StaEsc + r'.*?' + EndEsc, re.MULTILINE | re.DOTALL)
 
     def test(self, parent, block):
         return bool(self.START_RE.search(block))
@@ -38,8 +42,7 @@ class CommentsBlockProcessor(BlockProcessor):
         if m is None:
             return False
         text = "%s%s" % (text[:m.start()], text[m.end():])
-        del blocks[:]
-        blocks.extend(text.split("\n\n"))
+        blocks[:] = text.split("\n\n")
 
 
 def makeExtension(*args, **kwargs):
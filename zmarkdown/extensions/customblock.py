@@ -1,8 +1,7 @@
 from __future__ import unicode_literals
 from zmarkdown import Extension
 from zmarkdown.blockprocessors import BlockProcessor
-from zmarkdown.util import etree
-import re
+from zmarkdown.util import etree, compile_regex
 
 
 class CustomBlockExtension(Extension):
@@ -25,10 +24,12 @@ class CustomBlockExtension(Extension):
 
 
 class CustomBlockProcessor(BlockProcessor):
+    line_starts = '['
+
     def __init__(self, parser, repart, classType):
         BlockProcessor.__init__(self, parser)
         self.classType = classType
-        self.RE = re.compile(r'(?:^|\n)\[\[' + repart + r'\]\](\n|$)')
+        self.RE = compile_regex(r'(?:^|\n)\[\[' + repart + r'\]\](\n|$)')
 
     def test(self, parent, block):
         return self.RE.search(block)
@@ -56,16 +57,19 @@ class CustomBlockProcessor(BlockProcessor):
     def run(self, parent, blocks):
         block = blocks.pop(0)
         m = self.RE.search(block)
+        # The content starts on the line after the first one
+        start = block.count('\n', 0, m.end())
 
-        before, block, rest = self.extractBlock(m, block)
+        before, content, rest = self.extractBlock(m, block)
 
         if before:
             self.parser.parseBlocks(parent, [before])
 
         div = etree.SubElement(parent, 'div')
         div.set('class', '%s' % (self.classType,))
+        self.locateAt(div, block, m.end() - 1)
 
-        self.parser.parseChunk(div, block)
+        self.parser.parseChunk(div, content, self.parser.linesAt(start))
 
         if rest:
             blocks.insert(0, rest)
@@ -13,7 +13,7 @@ class DelExtension(Extension):
 
     def extendZMarkdown(self, md, md_globals):
         """Modifies inline patterns."""
-        md.inlinePatterns.add('del', SimpleTagPattern(DEL_RE, 'del'), '<not_strong')
+        md.inlinePatterns.add('del', SimpleTagPattern(DEL_RE, 'del', triggers='~', required=('~~',)), '<not_strong')
 
 
 def makeExtension(*args, **kwargs):
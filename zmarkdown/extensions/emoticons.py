@@ -7,7 +7,8 @@
 import re
 import zmarkdown
 from zmarkdown.inlinepatterns import Pattern
-from zmarkdown.util import etree
+from zmarkdown.util import etree, LRUCache
+from collections import OrderedDict
 
 
 class EmoticonExtension(zmarkdown.Extension):
@@ -24,27 +25,44 @@ class EmoticonExtension(zmarkdown.Extension):
         self.md = md
         emoticons = self.getConfig('emoticons')
         if emoticons:
-            EMOTICON_RE = u'(^|(?<=\s))(?P<emoticon>{0})((?=\s)|$)'.format(
-                '|'.join([re.escape(emoticon) for emoticon in emoticons.keys()]))
-            md.inlinePatterns.add('emoticons', EmoticonPattern(EMOTICON_RE, emoticons), "<linebreak")
+            md.inlinePatterns.add('emoticons', get_emoticon_pattern(emoticons), "<linebreak")
+
+
+# Patterns of the emoticon mappings already used, shared by all the instances
+_patterns = LRUCache(maxsize=16)
+
+
+def get_emoticon_pattern(emoticons):
+    """ Return the pattern of an emoticon mapping, compiled once per distinct mapping. """
+    key = tuple(sorted(emoticons.items()))
+    pattern = _patterns.get(key)
+    if pattern is None:
+        pattern = EmoticonPattern(emoticons)
+        _patterns.set(key, pattern)
+    return pattern
 
 
 class EmoticonPattern(Pattern):
-    def __init__(self, pattern, emoticons):
-        Pattern.__init__(self, pattern)
-        self.emoticons = emoticons
+    def __init__(self, emoticons):
+        # The longest emoticons are tried first
+        EMOTICON_RE = u'(^|(?<=\s))(?P<emoticon>{0})((?=\s)|$)'.format(
+            '|'.join([re.escape(emoticon) for emoticon in sorted(emoticons, key=lambda e: (-len(e), e))]))
+        Pattern.__init__(self, EMOTICON_RE)
+        # Attributes of the image of each emoticon
+        self.attributes = dict((emoticon, OrderedDict([('src', '%s' % (image,)), ('alt', emoticon)]))
+                               for emoticon, image in emoticons.items())
+        if all(emoticons):
+            # Every match starts with the first character of an emoticon
+            self.triggers = ''.join(set(emoticon[0] for emoticon in emoticons))
+            # Matches are delimited by spaces the emoticons do not start or end with
+            self.resumable = not any(emoticon[0].isspace() or emoticon[-1].isspace() for emoticon in emoticons)
 
     def handleMatch(self, m):
         try:
-            emoticon = m.group('emoticon')
-            if emoticon not in self.emoticons:
-                return None
-        except IndexError:  # pragma: no cover
+            attributes = self.attributes[m.group('emoticon')]
+        except (IndexError, KeyError):  # pragma: no cover
             return None
-        el = etree.Element('img')
-        el.set('src', '%s' % (self.emoticons[emoticon],))
-        el.set('alt', emoticon)
-        return el
+        return etree.Element('img', attributes)
 
 
 def makeExtension(*args, **kwargs):
@@ -15,6 +15,7 @@ class FencedCodeExtension(Extension):
 
 
 class FencedBlockProcessor(BlockProcessor):
+    line_starts = '~`'
     STARTING_RE = r'(?P<fence>^(?:~{3,}|`{3,}))'
     LANG_RE = r'(\{?\.?(?P<lang>[a-zA-Z0-9_+-]*))?'
     ARG_ELEMENT = r'(([a-z_]+[ ]*=[ ]*)+(((?P<quot>(")|(\'))([0-9\- ]+)(?P=quot))|([0-9]+))[ ]*)'
@@ -24,7 +25,7 @@ class FencedBlockProcessor(BlockProcessor):
 
     def __init__(self, md):
         BlockProcessor.__init__(self, md.parser)
-        self.re = re.compile(
+        self.re = util.compile_regex(
                 r'(^|\n)' + self.STARTING_RE + r'[ ]*' +  # Opening ``` or ~~~
                 self.LANG_RE + r'(?P<interspace>[ ]*)' +  # Optional {, and lang
                 self.ARG_LIST_RE +  # Optional arg list
@@ -49,7 +50,7 @@ class FencedBlockProcessor(BlockProcessor):
         # Parse arguments
         linenostart = (1,)
         hl_lines = ()
-        for m_arg in re.compile(self.ARG_ELEMENT).finditer(arglist):
+        for m_arg in util.compile_regex(self.ARG_ELEMENT).finditer(arglist):
             kind, args = m_arg.group(0).split("=")
             args = args.strip()
             if args[0] in """"'""":
@@ -77,7 +78,7 @@ class FencedBlockProcessor(BlockProcessor):
 
     def _extract_content_position(self, blocks, fence, m):
         first_block = blocks[0]
-        re_end = re.compile(r'(^|\n)' + re.escape(fence) + r'[ ]*(\n|$)')
+        re_end = util.compile_regex(r'(^|\n)' + re.escape(fence) + r'[ ]*(\n|$)')
 
         start_block = (0, m.start(), m.end())
         end_block = (-1, -1, -1)
@@ -49,7 +49,7 @@ class FootnoteExtension(Extension):
         # In multiple invocations, emit links that don't get tangled.
         self.unique_prefix = self.getConfig('unique_prefix')
 
-        self.reset()
+        self.md = None
 
     def extendZMarkdown(self, md, md_globals):
         """ Add pieces to Markdown. """
@@ -57,7 +57,8 @@ class FootnoteExtension(Extension):
         self.parser = md.parser
         self.md = md
         # Insert a blockprocessor before ReferencePreprocessor
-        md.parser.blockprocessors.add("footnote", FootnoteBlockprocessor(md.parser, self), "<reference")
+        self.blockprocessor = FootnoteBlockprocessor(md.parser, self)
+        md.parser.blockprocessors.add("footnote", self.blockprocessor, "<reference")
         # Insert an inline pattern before ImageReferencePattern
         FOOTNOTE_RE = r'\[\^([^\]]*)\]'  # blah blah [^1] blah
         md.inlinePatterns.add("footnote", FootnotePattern(FOOTNOTE_RE, self), "<reference")
@@ -70,7 +71,18 @@ class FootnoteExtension(Extension):
 
     def reset(self):
         """ Clear footnotes on reset, and prepare for distinct document. """
-        self.footnotes = OrderedDict()
+        if self.md is not None:
+            self.md.context.set_state(self, OrderedDict())
+
+    @property
+    def footnotes(self):
+        """ Footnotes of the document being converted. """
+        return self.md.context.get_state(self, OrderedDict)
+
+    @property
+    def footnoteLines(self):
+        """ Source lines of the footnotes of the document being converted, if they are recorded. """
+        return self.md.context.get_state(self.blockprocessor)
 
     def findFootnotesPlaceholder(self, root):
         """ Return ElementTree Element that contains Footnote placeholder. """
@@ -89,9 +101,11 @@ class FootnoteExtension(Extension):
         res = finder(root)
         return res
 
-    def setFootnote(self, idd, text):
-        """ Store a footnote for later retrieval. """
+    def setFootnote(self, idd, text, lines=None):
+        """ Store a footnote, whose text has the source `lines`, for later retrieval. """
         self.footnotes[idd] = text
+        if lines is not None:
+            self.footnoteLines[idd] = lines
 
     def get_separator(self):
         return '-'
@@ -122,10 +136,11 @@ class FootnoteExtension(Extension):
         etree.SubElement(div, "hr")
         ol = etree.SubElement(div, "ol")
 
+        lines = self.footnoteLines
         for idd in self.footnotes.keys():
             li = etree.SubElement(ol, "li")
             li.set("id", self.makeFootnoteId(idd))
-            self.parser.parseChunk(li, self.footnotes[idd])
+            self.parser.parseChunk(li, self.footnotes[idd], lines.get(idd))
             backlink = etree.Element("a")
             backlink.set("href", "#" + self.makeFootnoteRefId(idd))
             backlink.set("class", "footnote-backref")
@@ -146,15 +161,16 @@ class FootnoteExtension(Extension):
 class FootnoteBlockprocessor(BlockProcessor):
     """ Find all footnote references and store for later use. """
 
+    line_starts = ' ['
+    continues = False
+
     def __init__(self, parser, footnotes):
         BlockProcessor.__init__(self, parser)
         self.footnotes = footnotes
 
     def test(self, parent, block):
-        lines = block.split("\n")
-        for line in lines:
-            m = DEF_RE.match(line)
-            if m:
+        for line in self.parser.definitions.lines(block):
+            if DEF_RE.match(line):
                 return True
         return False
 
@@ -178,8 +194,8 @@ class FootnoteBlockprocessor(BlockProcessor):
             if m:
                 fn, _i = self.detectTabbed(lines[i + 1:])
                 fn.insert(0, m.group(2))
+                self.footnotes.setFootnote(m.group(1), "\n".join(fn), self.sourceLines(blocks, i, len(fn)))
                 i += _i
-                self.footnotes.setFootnote(m.group(1), "\n".join(fn))
                 break
             else:
                 newlines.append(lines[i])
@@ -188,8 +204,13 @@ class FootnoteBlockprocessor(BlockProcessor):
             else:
                 break
         newlines.extend(lines[i:])
-        del blocks[:]
-        blocks.extend(("\n".join(newlines[:-1])).split("\n\n"))
+        blocks[:] = ("\n".join(newlines[:-1])).split("\n\n")
+
+    def sourceLines(self, blocks, index, count):
+        """ Return the source lines of `count` lines of the joined `blocks` from `index`, None if not recorded. """
+        if self.parser.line is None:
+            return None
+        return tuple(blocks.sourceLines()[index:index + count])
 
     def detectTabbed(self, lines):
         """ Find indented text and remove indent before further proccesing.
@@ -252,6 +273,9 @@ class FootnoteBlockprocessor(BlockProcessor):
 class FootnotePattern(Pattern):
     """ InlinePattern for footnote markers in a document's body text. """
 
+    triggers = '^'
+    required = ('[^',)
+
     def __init__(self, pattern, footnotes):
         super(FootnotePattern, self).__init__(pattern)
         self.footnotes = footnotes
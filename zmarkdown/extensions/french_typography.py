@@ -3,32 +3,90 @@
 # automatisé, Lointainement inspiré de l’extension SmartyPants.
 
 from __future__ import unicode_literals
+import re
 import zmarkdown
-from ..inlinepatterns import HtmlPattern
-
-
-class ReplacePattern(HtmlPattern):
-    def __init__(self, pattern, replacement, zmarkdown):
-        """ Replace the pattern by a simple text. """
-        HtmlPattern.__init__(self, pattern)
-        self.replacement = replacement
-        self.zmarkdown = zmarkdown
-
-    def handleMatch(self, m):
-        return self.zmarkdown.htmlStash.store(self.replacement, safe=True)
-
-
-class ReplaceWithSpacePattern(HtmlPattern):
-    def __init__(self, pattern, replacement, zmarkdown):
-        """ Replace the pattern by a simple text. """
-        HtmlPattern.__init__(self, pattern)
-        self.replacement = replacement
-        self.zmarkdown = zmarkdown
-
-    def handleMatch(self, m):
-        space = m.group(2)
-        replacement = self.replacement + space
-        return self.zmarkdown.htmlStash.store(replacement, safe=True)
+from ..treeprocessors import Treeprocessor
+from ..util import AMP_SUBSTITUTE, AtomicString, compile_regex
+
+
+class FrenchTypographyTreeprocessor(Treeprocessor):
+    """
+    Replace the typography of all the text of the tree in a single pass.
+
+    `rules` is the list of the ``(name, expression, replacement)`` of the
+    replacements, the first ones having the priority over the next ones
+    they overlap. A group in an expression is kept after the replacement.
+    The replacements are html entities, written with `AMP_SUBSTITUTE` so
+    that they are not escaped by the serializer.
+    """
+
+    def __init__(self, md, rules):
+        Treeprocessor.__init__(self, md)
+        self.replacements = {}
+        self.kept = set()
+        expressions = []
+        index = 1
+        for name, expression, replacement in rules:
+            self.replacements[index] = (len(expressions), replacement.replace('&', AMP_SUBSTITUTE))
+            groups = compile_regex(expression).groups
+            if groups:
+                self.kept.add(index)
+            expressions.append('(%s)' % expression)
+            index += 1 + groups
+        self.expression = compile_regex('|'.join(expressions), re.UNICODE)
+
+    def replace(self, text):
+        """ Return `text` with its typography replaced. """
+        matches = []
+        for m in self.expression.finditer(text):
+            index = m.lastindex
+            priority, replacement = self.replacements[index]
+            if index in self.kept:
+                replacement += m.group(index + 1)
+            matches.append([priority, m.start(), m.end(), replacement])
+        if not matches:
+            return text
+        length = len(text)
+        if text.endswith('\n'):
+            length = self.truncate(text, matches)
+        segments = []
+        end = 0
+        for _, start, stop, replacement in matches:
+            segments.append(text[end:start])
+            segments.append(replacement)
+            end = stop
+        segments.append(text[end:length])
+        return ''.join(segments)
+
+    def truncate(self, text, matches):
+        """
+        Return the length of `text` once the replacement of `matches` removed
+        its trailing newlines, updating the matches which lost their newline.
+
+        Each replacement used to be a match of an inline pattern, and an
+        inline pattern matched before the end of a text ending with a newline
+        removes this newline. The inline patterns were applied one after the
+        other, in the order of the rules.
+        """
+        length = len(text)
+        ends = set()
+        for match in sorted(matches, key=lambda match: match[0]):
+            if match[2] > length:
+                # The newline kept after the replacement was removed before
+                match[2] = length
+                match[3] = match[3][:-1]
+            elif match[2] < length and text[length - 1] == '\n' and length not in ends:
+                length -= 1
+            ends.add(match[2])
+        return length
+
+    def run(self, root):
+        for element in root.iter():
+            for child in element:
+                if child.text and not isinstance(child.text, AtomicString):
+                    child.text = self.replace(child.text)
+                if child.tail and not isinstance(child.tail, AtomicString):
+                    child.tail = self.replace(child.tail)
 
 
 class FrenchTypographyExtension(zmarkdown.extensions.Extension):
@@ -44,143 +102,51 @@ class FrenchTypographyExtension(zmarkdown.extensions.Extension):
         }
         super(FrenchTypographyExtension, self).__init__(*args, **kwargs)
 
-    def replaceApostrophes(self, md):
-        apostrophesPattern = ReplacePattern("'", "&rsquo;", md)
-        self.replacements.add('apostrophes', apostrophesPattern, '_begin')
-
-    def replaceEmDashes(self, md):
-        emDashesPattern = ReplacePattern(r'(?<!-)---(?!-)', "&mdash;", md)
-        self.replacements.add('em_dashes', emDashesPattern, '_begin')
-
-    def replaceEnDashes(self, md):
-        enDashesPattern = ReplacePattern(
-            r'(?<!-)--(?!-)', "&ndash;", md
-        )
-        self.replacements.add(
-            'en_dashes', enDashesPattern, '_begin'
-        )
-
-    def replaceSpaces(self, md):
-        semicolonWithSpacePattern = ReplaceWithSpacePattern(
-            r' ;([\s]|$)', "&#x202F;;", md
-        )
-        colonWithSpacePattern = ReplaceWithSpacePattern(
-            r' :([\s]|$)', "&#x202F;:", md
-        )
-        interrogationWithSpacePattern = ReplacePattern(" \?", "&#x202F;?", md)
-        exclamationWithSpacePattern = ReplacePattern(" !", "&#x202F;!", md)
-        perCentWithSpacePattern = ReplacePattern(" %", "&nbsp;%", md)
-        perMilWithSpacePattern = ReplacePattern(' ‰', "&nbsp;&permil;", md)
-        openingAngleQuoteWithSpacePattern = ReplacePattern('« ', "&laquo;&nbsp;", md)
-        closingAngleQuoteWithSpacePattern = ReplacePattern(' »', "&nbsp;&raquo;", md)
-
-        self.replacements.add(
-            'semicolon_with_space', semicolonWithSpacePattern, '_end'
-        )
-        self.replacements.add(
-            'colon_with_space',
-            colonWithSpacePattern,
-            '<semicolon_with_space'
-        )
-        self.replacements.add(
-            'interrogation_mark_with_space',
-            interrogationWithSpacePattern,
-            '<colon_with_space'
-        )
-        self.replacements.add(
-            'exclamation_mark_with_space',
-            exclamationWithSpacePattern,
-            '<interrogation_mark_with_space'
-        )
-        self.replacements.add(
-            'per_cent_with_space',
-            perCentWithSpacePattern,
-            '<exclamation_mark_with_space'
-        )
-        self.replacements.add(
-            'per_mil_with_space',
-            perMilWithSpacePattern,
-            '<per_cent_with_space'
-        )
-        self.replacements.add(
-            'opening_angle_quote_with_space',
-            openingAngleQuoteWithSpacePattern,
-            '<per_mil_with_space'
-        )
-        self.replacements.add(
-            'closing_angle_quote_with_space',
-            closingAngleQuoteWithSpacePattern,
-            '<opening_angle_quote_with_space'
-        )
-
-    def replaceAngleQuotes(self, md):
-        openingAngleQuotesPattern = ReplacePattern(r'<<', "&laquo;", md)
-        closingAngleQuotesPattern = ReplacePattern(r'>>', "&raquo;", md)
-        self.replacements.add(
-            'opening_angle_quotes', openingAngleQuotesPattern, '_begin'
-        )
-        self.replacements.add(
-            'closing_angle_quotes',
-            closingAngleQuotesPattern,
-            '>opening_angle_quotes'
-        )
-
-    def replaceAngleQuotesWithSpaces(self, md):
-        openingAngleQuotesPattern = ReplacePattern(
-            r'<< ', "&laquo;&nbsp;", md
-        )
-        closingAngleQuotesPattern = ReplacePattern(
-            r' >>', "&nbsp;&raquo;", md
-        )
-        self.replacements.add(
-            'opening_angle_quotes_space', openingAngleQuotesPattern, '_begin'
-        )
-        self.replacements.add(
-            'closing_angle_quotes_space',
-            closingAngleQuotesPattern,
-            '>opening_angle_quotes'
-        )
-
-    def replacePerMil(self, md):
-        perMilPattern = ReplacePattern("%o", "&permil;", md)
-        self.replacements.add('per_mil', perMilPattern, '_begin')
-
-    def replacePerMilWithSpace(self, md):
-        perMilPattern = ReplacePattern(" %o", "&nbsp;&permil;", md)
-        self.replacements.add('per_mil_with_space2', perMilPattern, '_begin')
-
-    def replaceEllipses(self, md):
-        ellipsesPattern = ReplacePattern(
-            r'(?<!\.)\.{3}(?!\.)', "&hellip;", md
-        )
-        self.replacements.add('ellipses', ellipsesPattern, '_begin')
-
     def extendZMarkdown(self, md, md_globals):
         configs = self.getConfigs()
-        self.replacements = zmarkdown.odict.OrderedDict()
-        if configs['apostrophes']:
-            self.replaceApostrophes(md)
+        apostrophes, em_dashes, en_dashes, spaces, angle_quotes, per_mil, ellipses = [configs[key] for key in (
+            'apostrophes', 'em_dashes', 'en_dashes', 'unbreakable_spaces', 'angle_quotes', 'per_mil', 'ellipses')]
+        # A space followed by one of these marks is replaced with the mark
+        # by a rule having the priority over the angle quotes with space, colons
+        # and semicolons, which can not use it
+        before_quote = (['%o'] if per_mil else []) + (['>>'] if angle_quotes else []) + ['»']
+        before_colon = (['>>'] if angle_quotes else []) + ['»', '‰', '%', '!', r'\?']
+        colon_space = r'(?! (?:%s))' % '|'.join(before_colon)
+        colon = r':%s([\s]|$)' % colon_space
+        semicolon = r';(?! :%s(?:[\s]|$))%s([\s]|$)' % (colon_space, colon_space)
+        # Replacements, the first ones having the priority over the next ones
+        # they overlap
+        rules = [
+            ('ellipses', ellipses, r'(?<!\.)\.{3}(?!\.)', "&hellip;"),
+            ('per_mil_with_space2', per_mil and spaces, ' %o', "&nbsp;&permil;"),
+            ('per_mil', per_mil, '%o', "&permil;"),
+            ('opening_angle_quotes_space', angle_quotes and spaces, '<< (?!%o)' if per_mil else '<< ',
+             "&laquo;&nbsp;"),
+            ('opening_angle_quotes', angle_quotes,
+             ('<<(?!< (?!%o))' if per_mil else '<<(?!< )') if spaces else '<<', "&laquo;"),
+            ('closing_angle_quotes_space', angle_quotes and spaces, ' >>', "&nbsp;&raquo;"),
+            ('closing_angle_quotes', angle_quotes, '>>', "&raquo;"),
+            ('en_dashes', en_dashes, r'(?<!-)--(?!-)', "&ndash;"),
+            ('em_dashes', em_dashes, r'(?<!-)---(?!-)', "&mdash;"),
+            ('apostrophes', apostrophes, "'", "&rsquo;"),
+            ('closing_angle_quote_with_space', spaces, ' »', "&nbsp;&raquo;"),
+            ('opening_angle_quote_with_space', spaces, '« (?!%s)' % '|'.join(before_quote), "&laquo;&nbsp;"),
+            ('per_mil_with_space', spaces, ' ‰', "&nbsp;&permil;"),
+            ('per_cent_with_space', spaces, ' %', "&nbsp;%"),
+            ('exclamation_mark_with_space', spaces, ' !', "&#x202F;!"),
+            ('interrogation_mark_with_space', spaces, r' \?', "&#x202F;?"),
+            ('colon_with_space', spaces, ' ' + colon, "&#x202F;:"),
+            ('semicolon_with_space', spaces, ' ' + semicolon, "&#x202F;;"),
+        ]
+        if apostrophes:
             md.ESCAPED_CHARS.append("'")
-        if configs['em_dashes']:
-            self.replaceEmDashes(md)
-        if configs['en_dashes']:
-            self.replaceEnDashes(md)
-        if configs['unbreakable_spaces']:
-            self.replaceSpaces(md)
+        if spaces:
             md.ESCAPED_CHARS.extend([" ", "«", "»"])
-        if configs['angle_quotes']:
-            self.replaceAngleQuotes(md)
+        if angle_quotes:
             md.ESCAPED_CHARS.append("<")
-        if configs['angle_quotes'] and configs['unbreakable_spaces']:
-            self.replaceAngleQuotesWithSpaces(md)
-        if configs['per_mil']:
-            self.replacePerMil(md)
+        if per_mil:
             md.ESCAPED_CHARS.append("%")
-        if configs['per_mil'] and configs['unbreakable_spaces']:
-            self.replacePerMilWithSpace(md)
-        if configs['ellipses']:
-            self.replaceEllipses(md)
+        if ellipses:
             md.ESCAPED_CHARS.append("...")
-        processing = zmarkdown.treeprocessors.InlineProcessor(md)
-        processing.inlinePatterns = self.replacements
-        md.treeprocessors.add('french_typography', processing, '_end')
+        rules = [(name, expression, replacement) for name, enabled, expression, replacement in rules if enabled]
+        md.treeprocessors.add('french_typography', FrenchTypographyTreeprocessor(md, rules), '_end')
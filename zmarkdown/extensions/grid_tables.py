@@ -26,6 +26,8 @@ class GridTableExtension(zmarkdown.Extension):
 
 
 class GridTableProcessor(BlockProcessor):
+    starts = '+'
+
     def test(self, parent, block):
         return bool(extract_table_line_of(block))
 
@@ -44,7 +46,8 @@ class GridTableProcessor(BlockProcessor):
         # We will generate a table
 
         table_content = extract_table_content(lines, lines_info, has_header)
-        generate_table(self.parser, table_content, parent)
+        table = generate_table(self.parser, table_content, parent)
+        self.locateLines(table[0], 0, len(lines) - 1)
 
         # If remaining lines, process it
         if rest:
@@ -347,6 +350,8 @@ class TableCell(object):
         self.colspan = 1
         self.rowspan = 1
         self.lines = []
+        # Index of the first line of the cell in the table
+        self.line = None
         self._rc = None
 
     def merge_with(self, other):
@@ -357,12 +362,12 @@ class TableCell(object):
     @property
     def raw_content(self):
         if self._rc is None:
-            self._rc = RawCell("\n".join(l.strip() for l in self.lines), self.colspan, self.rowspan)
+            self._rc = RawCell("\n".join(l.strip() for l in self.lines), self.colspan, self.rowspan, self.line)
         return self._rc
 
 
 # Describe a table cell
-RawCell = namedtuple('Cell', 'content colspan rowspan')
+RawCell = namedtuple('Cell', 'content colspan rowspan line')
 
 
 def extract_table_content(lines, lines_info, has_header):
@@ -370,7 +375,7 @@ def extract_table_content(lines, lines_info, has_header):
     # Create a table constructor
     table = TableContent(lines_info)
 
-    for is_first_line, line in zip(is_first_item(), lines):
+    for index, (is_first_line, line) in enumerate(zip(is_first_item(), lines)):
         # Check line type
         match_header = has_header and is_header_line(line)
         is_end_line = match_header or has_plain_line_part(line)
@@ -393,6 +398,11 @@ def extract_table_content(lines, lines_info, has_header):
             # New raw lines are always created with global line information, need to be update
             table.last_part.update_with_main_line(line, is_end_line)
 
+            # The new cells start on the next line
+            for cell in table.last_part.last_row:
+                if cell.line is None:
+                    cell.line = index + 1
+
         else:
             # It is a plain line, update current row and add line content.
             table.last_part.update_with_main_line(line, is_end_line)
@@ -407,6 +417,7 @@ def extract_table_content(lines, lines_info, has_header):
 
 def generate_table(parser, table_content, parent):
     """Generate table html element from extracted table content"""
+    located = parser.zmarkdown.context.blockLines
     pr = etree.SubElement(parent, 'div')
     pr.set('class', "table-wrapper")
     table = etree.SubElement(pr, 'table')
@@ -420,10 +431,14 @@ def generate_table(parser, table_content, parent):
             root = etree.SubElement(table, 'tbody')
         for row in part:
             tr = etree.SubElement(root, 'tr')
-            for content, colspan, rowspan in row:
+            for content, colspan, rowspan, line in row:
                 td = etree.SubElement(tr, 'th' if has_header and i == 0 else 'td')
                 td.set('rowspan', str(rowspan))
                 td.set('colspan', str(colspan))
-                parser.parseBlocks(td, content.split('\n\n'))
+                parser.parseBlocks(td, content.split('\n\n'), parser.linesAt(line))
+                if located is not None and td in located:
+                    # Rows and parts span the lines of their cells
+                    parser.locate(tr, *located[td])
+                    parser.locate(root, *located[td])
 
     return pr
@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 import zmarkdown
-import re
 
 
 class DownHeaderExtension(zmarkdown.Extension):
@@ -10,7 +9,7 @@ class DownHeaderExtension(zmarkdown.Extension):
 
     def extendZMarkdown(self, md, md_globals):
         # VERY DANGEROUS !
-        md.parser.blockprocessors["hashheader"].RE = re.compile(
+        md.parser.blockprocessors["hashheader"].RE = zmarkdown.util.compile_regex(
             r'(^|\n)(?P<level>#{1,%d})(?P<header>.*?)#*(\n|$)' % (6 - self.getConfig("offset")))
         md.treeprocessors.add('downheader', DownHeaderProcessor(self.getConfig("offset")), '_end')
 
@@ -21,7 +20,7 @@ class DownHeaderProcessor(zmarkdown.treeprocessors.Treeprocessor):
         self.offset = offset
 
     def run(self, node):
-        expr = re.compile('h(\d)')
+        expr = zmarkdown.util.compile_regex('h(\d)')
         for child in node.getiterator():
             match = expr.match(child.tag)
             if match:
@@ -13,7 +13,7 @@ class KbdExtension(Extension):
 
     def extendZMarkdown(self, md, md_globals):
         """Modifies inline patterns."""
-        md.inlinePatterns.add('kbd', SimpleTagPattern(KBD_RE, 'kbd'), '<not_strong')
+        md.inlinePatterns.add('kbd', SimpleTagPattern(KBD_RE, 'kbd', triggers='|', required=('||',)), '<not_strong')
 
 
 def makeExtension(*args, **kwargs):
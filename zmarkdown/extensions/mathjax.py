@@ -5,6 +5,8 @@ import re
 
 
 class MathJaxPattern(inlinepatterns.Pattern):
+    triggers = '$'
+
     def __init__(self):
         inlinepatterns.Pattern.__init__(self, r'(?<!\\)\$([^\n]+?)(?<!\\)\$')
 
@@ -15,9 +17,11 @@ class MathJaxPattern(inlinepatterns.Pattern):
 
 
 class MathJaxBlock(BlockProcessor):
+    line_starts = '$'
+
     def __init__(self, parser):
         BlockProcessor.__init__(self, parser)
-        self.re = re.compile(r'(?:^|\n)\$\$.+\$\$(\n|$)', re.DOTALL | re.MULTILINE | re.UNICODE)
+        self.re = util.compile_regex(r'(?:^|\n)\$\$.+\$\$(\n|$)', re.DOTALL | re.MULTILINE | re.UNICODE)
 
     def test(self, parent, block):
         return self.re.search(block)
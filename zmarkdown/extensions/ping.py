@@ -12,6 +12,8 @@ PING_RE = (r'(?<![^\s])'  # Check that there isn't any space before the ping
 
 
 class PingPattern(Pattern):
+    triggers = '@'
+
     def __init__(self, md, ping_url):
         self.ping_url = ping_url
         Pattern.__init__(self, PING_RE, md)
@@ -1,19 +1,21 @@
 from zmarkdown import Extension
 from zmarkdown.blockprocessors import BlockProcessor
 import re
-from zmarkdown.util import etree
+from zmarkdown.util import etree, compile_regex
 
 LEGEND_RE = r"(%s\s*)?:\s*(?P<txtlegend>.*)"
 
 
 class AutoFigureProcessor(BlockProcessor):
+    starts = '!'
+
     def __init__(self, md):
         BlockProcessor.__init__(self, md.parser)
         self.md = md
         legend_re = LEGEND_RE % "Figure"
-        self.re = re.compile(r"^%s(\n%s)?$" % (md.inlinePatterns["image_link"].pattern, legend_re),
-                             re.MULTILINE | re.DOTALL | re.UNICODE)
-        self.legend_re = re.compile(r"^%s$" % legend_re, re.MULTILINE | re.DOTALL | re.UNICODE)
+        self.re = compile_regex(r"^%s(\n%s)?$" % (md.inlinePatterns["image_link"].pattern, legend_re),
+                                re.MULTILINE | re.DOTALL | re.UNICODE)
+        self.legend_re = compile_regex(r"^%s$" % legend_re, re.MULTILINE | re.DOTALL | re.UNICODE)
 
     def test(self, parent, block):
         return self.re.match(block)
@@ -53,23 +55,29 @@ class AutoFigureProcessor(BlockProcessor):
 class InnerProcessor(BlockProcessor):
     def __init__(self, md, legend_name, block_src):
         BlockProcessor.__init__(self, md.parser)
-        self.re_legend = re.compile(r"^%s$" % (LEGEND_RE % legend_name), re.MULTILINE | re.DOTALL)
+        self.re_legend = compile_regex(r"^%s$" % (LEGEND_RE % legend_name), re.MULTILINE | re.DOTALL)
         self.block_src = block_src
+        self.starts = getattr(block_src, 'starts', None)
+        self.line_starts = getattr(block_src, 'line_starts', None)
 
     def test(self, parent, block):
         return self.block_src.test(parent, block)
 
     def run(self, parent, blocks):
         first_block = blocks[0]
+        count = len(parent)
         m = self.re_legend.search(first_block)
         if m:
             blocks[0] = first_block[:m.start()].rstrip()
+            legend = self.parser.line
+            if legend is not None:
+                legend = self.parser.lineAt(first_block.count('\n', 0, m.start()))
         response = self.block_src.run(parent, blocks)
         if response is False:
             return False
         if not m and len(blocks) > 0:
-            first_block = blocks[0].strip()
-            m = self.re_legend.match(first_block)
+            legend = blocks.line
+            m = self.re_legend.match(blocks[0].strip())
             if m:
                 blocks.pop(0)
         if m:
@@ -80,6 +88,23 @@ class InnerProcessor(BlockProcessor):
             fig_caption = etree.Element("figcaption")
             fig_caption.text = m.group("txtlegend")
             fig.append(fig_caption)
+            if legend is not None:
+                self.locateMoved(parent, count, sibling, first_block, legend - 1)
+
+    def locateMoved(self, parent, count, element, block, last):
+        """
+        Locate `element`, moved in a figure, from the start of `block` or the
+        end of the other elements added after the first `count` children of
+        `parent`, to the source line `last`.
+        """
+        located = self.parser.zmarkdown.context.blockLines
+        if located is None:
+            return
+        if len(parent) - 1 > count and parent[-2] in located:
+            first = located[parent[-2]][1] + 1
+        else:
+            first = self.parser.lineAt(block.count('\n', 0, len(block) - len(block.lstrip())))
+        self.parser.locate(element, first, last)
 
 
 class SmartLegendExtension(Extension):
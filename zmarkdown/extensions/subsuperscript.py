@@ -10,8 +10,8 @@ SUPERSCRIPT_RE = r'(\^)(.+?)(\^)'
 class SubSuperscriptPattern(inlinepatterns.Pattern):
     """ Return a sub or superscript Element"""
 
-    def __init__(self, RE, md, tag):
-        inlinepatterns.Pattern.__init__(self, RE, md)
+    def __init__(self, RE, md, tag, triggers=None):
+        inlinepatterns.Pattern.__init__(self, RE, md, triggers=triggers)
         self.tag = tag
 
     def handleMatch(self, m):
@@ -26,8 +26,8 @@ class SubSuperscriptExtension(Extension):
 
     def extendZMarkdown(self, md, md_globals):
         """ Replace subscript with SubscriptPattern """
-        md.inlinePatterns['subscript'] = SubSuperscriptPattern(SUBSCRIPT_RE, md, "sub")
-        md.inlinePatterns['superscript'] = SubSuperscriptPattern(SUPERSCRIPT_RE, md, "sup")
+        md.inlinePatterns['subscript'] = SubSuperscriptPattern(SUBSCRIPT_RE, md, "sub", '~')
+        md.inlinePatterns['superscript'] = SubSuperscriptPattern(SUPERSCRIPT_RE, md, "sup", '^')
         md.ESCAPED_CHARS.extend(['~', '^'])
 
 
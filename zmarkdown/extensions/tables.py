@@ -56,15 +56,20 @@ class TableProcessor(BlockProcessor):
         pr = etree.SubElement(parent, 'div')
         pr.set('class', "table-wrapper")
         table = etree.SubElement(pr, 'table')
+        self.locateLines(table, 0, len(block) - 1)
         thead = etree.SubElement(table, 'thead')
-        self._build_row(header, thead, align, border)
+        self.locateLines(thead, 0)
+        self._build_row(header, thead, align, border, 0)
         tbody = etree.SubElement(table, 'tbody')
-        for row in rows:
-            self._build_row(row.strip(), tbody, align, border)
+        self.locateLines(tbody, 2, len(block) - 1)
+        for i, row in enumerate(rows, 2):
+            self._build_row(row.strip(), tbody, align, border, i)
 
-    def _build_row(self, row, parent, align, border):
-        """ Given a row of text, build table cells. """
+    def _build_row(self, row, parent, align, border, line=None):
+        """ Given a row of text, the `line` of the block, build table cells. """
         tr = etree.SubElement(parent, 'tr')
+        if line is not None:
+            self.locateLines(tr, line)
         tag = 'td'
         if parent.tag == 'thead':
             tag = 'th'
@@ -79,6 +84,8 @@ class TableProcessor(BlockProcessor):
                 c.text = ""
             if a:
                 c.set('align', a)
+            if line is not None:
+                self.locateLines(c, line)
 
     def _split_row(self, row, border):
         """ split a row of text into list of cells. """
@@ -4,11 +4,31 @@ import re
 import unicodedata
 from . import Extension
 from ..treeprocessors import Treeprocessor
+import six
 from collections import namedtuple
-from ..util import etree
+from ..util import etree, AMP_SUBSTITUTE
+try:  # pragma: no cover
+    from html.entities import name2codepoint
+except ImportError:  # pragma: no cover
+    from htmlentitydefs import name2codepoint
 
 TitleElement = namedtuple("TitleElement", "title anchor level")
 
+# Entities written in the text by the tree processors (French typography)
+ENTITY_RE = re.compile(re.escape(AMP_SUBSTITUTE) + r'(?:#[xX]([0-9a-fA-F]+)|#([0-9]+)|([a-zA-Z]+));')
+
+
+def unescape_entities(text):
+    """ Replace the entities written with AMP_SUBSTITUTE by their characters. """
+    def unescape(m):
+        hexadecimal, decimal, name = m.groups()
+        if name is not None:
+            if name not in name2codepoint:
+                return m.group(0)
+            return six.unichr(name2codepoint[name])
+        return six.unichr(int(hexadecimal, 16) if hexadecimal is not None else int(decimal))
+    return ENTITY_RE.sub(unescape, text)
+
 
 def slugify(value, separator):
     """ Slugify a string, to make it URL friendly. """
@@ -22,8 +42,6 @@ class TitleAnchorTreeprocessor(Treeprocessor):
     def __init__(self, config, md):
         self.config = config
 
-        self.anchors = set()
-
         self.marker_key = self.config.get("marker_key", "")
 
         starting_title = self.config.get("starting_title", 1)
@@ -39,9 +57,14 @@ class TitleAnchorTreeprocessor(Treeprocessor):
         self.reset()
 
     def reset(self):
-        self.anchors = set()
+        self.zmarkdown.context.set_state(self, set())
         self.zmarkdown.metadata["toc"] = []
 
+    @property
+    def anchors(self):
+        """ Anchors already used in the document being converted. """
+        return self.zmarkdown.context.get_state(self, set)
+
     def get_anchor_key(self, title):
         slug = slugify(title, "-")
         if self.marker_key:
@@ -84,9 +107,9 @@ class TitleAnchorTreeprocessor(Treeprocessor):
             tag = element.tag
             if tag.startswith("h") and tag in self.allowed_tags:
                 level = int(tag[1:])
-                title = element.text
-                if title is None:
+                if element.text is None:
                     continue
+                title = unescape_entities(element.text)
                 anchor = self.get_anchor_key(title)
                 title_element = TitleElement(title, anchor, level)
                 toc.append((element, title_element))
@@ -94,7 +117,7 @@ class TitleAnchorTreeprocessor(Treeprocessor):
         for element, title_element in toc:
             self.add_anchor(element, title_element)
             self.add_link(element, title_element)
-        self.zmarkdown.metadata["toc"] = [e for _, e in toc]
+        self.zmarkdown.metadata["toc"].extend(e for _, e in toc)
 
 
 class TitleAnchorExtension(Extension):
@@ -7,7 +7,6 @@ try:  # pragma: no cover
     from urllib.parse import urlparse
 except ImportError:  # pragma: no cover
     from urlparse import urlparse
-import re
 
 # Global Vars. Do not catch ending dot
 URLIZE_RE = r'(^|(?<=\s))({0})(?=\.?(\s|$))'.format("|".join((
@@ -24,6 +23,9 @@ URLIZE_RE = r'(^|(?<=\s))({0})(?=\.?(\s|$))'.format("|".join((
 class UrlizePattern(InlinePattern):
     """ Return a link Element given an autolink (`http://example/com`). """
 
+    # Mails and domains have a dot, urls between < > a colon
+    triggers = '.:'
+
     def __init__(self, *args, **kwargs):
         kwargs["not_in"] = ('link',)
         InlinePattern.__init__(self, *args, **kwargs)
@@ -35,25 +37,46 @@ class UrlizePattern(InlinePattern):
         if url.startswith('<'):
             url = url[1:-1]
 
-        text = url
-        is_url = re.match(MAIL_RE, url)
+        el = util.etree.Element("a")
+        el.set('href', normalize_url(url))
+        el.text = util.AtomicString(url)
+        return el
+
 
-        if not is_url:
-            url = sanitize_url(url)
+# Normalized urls, shared by all the instances
+url_cache = util.LRUCache(maxsize=1024)
 
-        parts = urlparse(url)
 
-        # If no protocol (and not explicit relative link), add one
-        if parts[0] == "":
-            if is_url:
-                url = 'mailto:' + url
-            elif not url.startswith("#") and not url.startswith("/"):
-                url = 'http://' + url
+def normalize_url(url):
+    """
+    Return the link of a matched url: sanitized, and with a protocol if it
+    has none and is not an explicit relative link.
 
-        el = util.etree.Element("a")
-        el.set('href', url)
-        el.text = util.AtomicString(text)
-        return el
+    The links are kept in `url_cache`, so that the urls repeated in a
+    document or across documents are only parsed once.
+    """
+    href = url_cache.get(url)
+    if href is None:
+        href = _normalize_url(url)
+        url_cache.set(url, href)
+    return href
+
+
+def _normalize_url(url):
+    is_url = util.compile_regex(MAIL_RE).match(url)
+
+    if not is_url:
+        url = sanitize_url(url)
+
+    parts = urlparse(url)
+
+    # If no protocol (and not explicit relative link), add one
+    if parts[0] == "":
+        if is_url:
+            url = 'mailto:' + url
+        elif not url.startswith("#") and not url.startswith("/"):
+            url = 'http://' + url
+    return url
 
 
 class UrlizeExtension(Extension):
@@ -3,7 +3,6 @@
 import zmarkdown
 from zmarkdown.util import etree
 from zmarkdown.blockprocessors import BlockProcessor
-import re
 
 
 class VideoExtension(zmarkdown.Extension):
@@ -65,12 +64,14 @@ class VideoExtension(zmarkdown.Extension):
 
 
 class VideoBProcessor(BlockProcessor):
+    line_starts = '!'
+
     def __init__(self, md, patt, width, height):
         BlockProcessor.__init__(self, md.parser)
         self.md = md
         self.width = width
         self.height = height
-        self.RE = re.compile(patt)
+        self.RE = zmarkdown.util.compile_regex(patt)
 
     def test(self, parent, block):
         return bool(self.RE.search(block))
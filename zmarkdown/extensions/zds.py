@@ -2,28 +2,6 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 from . import Extension
 
-from .abbr import AbbrExtension
-from .align import AlignExtension
-from .codehilite import CodeHiliteExtension
-from .comments import CommentsExtension
-from .customblock import CustomBlockExtension
-from .delext import DelExtension
-from .emoticons import EmoticonExtension
-from .fenced_code import FencedCodeExtension
-from .footnotes import FootnoteExtension
-from .french_typography import FrenchTypographyExtension
-from .grid_tables import GridTableExtension
-from .header_dec import DownHeaderExtension
-from .kbd import KbdExtension
-from .mathjax import MathJaxExtension
-from .ping import PingExtension
-from .smart_legend import SmartLegendExtension
-from .subsuperscript import SubSuperscriptExtension
-from .tables import TableExtension
-from .title_anchor import TitleAnchorExtension
-from .urlize import UrlizeExtension
-from .video import VideoExtension
-
 
 class ZdsExtension(Extension):
     """ Add various extensions to Markdown class."""
@@ -40,7 +18,15 @@ class ZdsExtension(Extension):
 
         super(ZdsExtension, self).__init__(*args, **kwargs)
 
+    # The extensions are imported when they are created, so that the modules
+    # unused in inline mode (and Pygments) are not loaded by the workers
+
     def _create_common_extension(self):
+        from .delext import DelExtension
+        from .french_typography import FrenchTypographyExtension
+        from .subsuperscript import SubSuperscriptExtension
+        from .urlize import UrlizeExtension
+
         # create extensions :
         sub_ext = SubSuperscriptExtension()  # Sub and Superscript support
         del_ext = DelExtension()  # Del support
@@ -52,6 +38,24 @@ class ZdsExtension(Extension):
                 typo_ext]
 
     def _create_non_inline_extension(self):
+        from .abbr import AbbrExtension
+        from .align import AlignExtension
+        from .codehilite import CodeHiliteExtension
+        from .comments import CommentsExtension
+        from .customblock import CustomBlockExtension
+        from .emoticons import EmoticonExtension
+        from .fenced_code import FencedCodeExtension
+        from .footnotes import FootnoteExtension
+        from .grid_tables import GridTableExtension
+        from .header_dec import DownHeaderExtension
+        from .kbd import KbdExtension
+        from .mathjax import MathJaxExtension
+        from .ping import PingExtension
+        from .smart_legend import SmartLegendExtension
+        from .tables import TableExtension
+        from .title_anchor import TitleAnchorExtension
+        from .video import VideoExtension
+
         mathjax_ext = MathJaxExtension()  # MathJax support
         kbd_ext = KbdExtension()  # Keyboard support
         emo_ext = EmoticonExtension(emoticons=self.emoticons)  # smileys support
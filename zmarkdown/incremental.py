@@ -0,0 +1,270 @@
+"""
+INCREMENTAL RENDERING
+=============================================================================
+
+Live previews convert the same document again and again while only a few
+lines change between two conversions. The incremental renderer splits the
+source into top-level segments, renders each of them on its own and keeps
+the html of the segments in a cache, so that only the edited segments are
+parsed again:
+
+    >>> renderer = IncrementalRenderer(ZMarkdown(extensions=[...]))
+    >>> html = renderer.convert(source)
+    >>> html = renderer.convert(edited_source)  # only edited blocks are rendered
+
+Segments are only cut between blocks which can not interact: never inside
+fenced code, math, align or comment blocks, never after a block with
+indented lines and never before a block which could continue the previous
+one (indented text, list items, quotes, tables, legends...). Reference and
+abbreviation definitions are global to the document: they are appended to
+every segment, and the fragments are cached with them. Documents with
+footnotes, or whose segments produce conflicting or position-dependent ids
+(e.g. two titles with the same anchor) are converted as a whole.
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from . import util
+from .extensions.comments import CommentsBlockProcessor
+import copy
+import hashlib
+import re
+
+# Constructs which can span several blocks: start, end
+SPANS = [
+    (re.compile(r'^(`{3,}|~{3,})'), None),  # fenced code, closed by the same fence
+    (re.compile(r'^\$\$'), re.compile(r'\$\$\s*$')),  # math
+    (re.compile(r'^->'), re.compile(r'(<-|->)\s*$')),  # align
+]
+# Blocks which may continue the block before them
+CONTINUATION_RE = re.compile(r'^(\s|[-*+>|:+=<$]|\d+[.)]|\[\^|\w+\s*:)', re.UNICODE)
+# Definitions which apply to the whole document
+DEFINITION_RE = re.compile(r'^([ ]{0,3}\[[^\]^][^\]]*\]|[*]\[[^\]]*\][ ]?):')
+# Definitions nested in lists, quotes or indented blocks
+NESTED_DEFINITION_RE = re.compile(r'^[\s>*+\-\d.)]*[*]?\[[^\]]*\][ ]?:')
+# Valid opening line of a fenced code block
+FENCE_RE = re.compile(r'^(`{3,}|~{3,})[ ]*(\{?\.?[a-zA-Z0-9_+-]*)?[ ]*'
+                      r'(([a-z_]+[ ]*=[ ]*)+((["\'][0-9\- ]+["\'])|[0-9]+)[ ]*)*\}?[ ]*$')
+FOOTNOTE_RE = re.compile(r'\[\^[^\]]*\]')
+ID_RE = re.compile(r'\sid="([^"]*)"')
+# Source lines of an element (see the ``source_lines`` option)
+DATA_LINE_RE = re.compile(r'(<[a-zA-Z][^<>]*\sdata-line=")(\d+)-(\d+)"')
+# Anchors made from stashed text contain the index of the stash entry
+STASH_KEY = util.HTML_PLACEHOLDER[1:].split(':')[0]
+
+
+class SegmentationError(ValueError):
+    """ Raised when markdown lines can not be split safely into segments. """
+
+
+def iter_segments(lines, definitions, spans=SPANS):
+    """
+    Split markdown lines into top-level segments.
+
+    Yield the segments, which joined by newlines give back the lines, and
+    append the reference and abbreviation definitions found outside of code
+    to the `definitions` list. Raise SegmentationError when the lines can
+    not be split safely.
+    """
+    current = []
+    span_end = None
+    span_skip = None
+    blanks = 0
+    # Whether the current block has indented lines, None before the first block
+    indented = None
+    # Whether the line is after a definition, and may be the title of a reference
+    title = False
+    for index, line in enumerate(lines):
+        if span_end is not None:
+            current.append(line)
+            if index != span_skip and span_end.search(line):
+                span_end = None
+            continue
+        if not line.strip():
+            blanks += 1
+            title = False
+            current.append(line)
+            continue
+        if title and line[:1] in (' ', '\t'):
+            definitions.append(line)
+        title = False
+        if blanks and indented is not None and not indented and not CONTINUATION_RE.match(line) \
+                and not DEFINITION_RE.match(line):
+            # Blocks are split on double newlines: keep an odd newline with the next block
+            carry = []
+            if blanks % 2 == 0:
+                carry.append(current.pop())
+            segment = '\n'.join(current)
+            if segment.strip('\n'):
+                yield segment
+            current = carry
+        indented = bool(indented and not blanks) or line[:1] in (' ', '\t')
+        blanks = 0
+        current.append(line)
+        if DEFINITION_RE.match(line):
+            definitions.append(line)
+            title = True
+            continue
+        if NESTED_DEFINITION_RE.match(line):
+            raise SegmentationError('Definition out of the top level: %r' % line)
+        for start, end in spans:
+            match = start.search(line)
+            if match:
+                if end is None:
+                    if not FENCE_RE.match(line):
+                        # Fences would not be paired as the fenced code extension does
+                        raise SegmentationError('Ambiguous fence: %r' % line)
+                    span_end = util.compile_regex(r'^%s[ ]*$' % re.escape(match.group(1)))
+                    # The fenced code extension never closes a fence on the next line
+                    span_skip = index + 1
+                elif not end.search(line, match.end()):
+                    # Not closed on its first line, like "$$x$$" or "->x<-"
+                    span_end = end
+                    span_skip = None
+                break
+    if span_end is not None:
+        # Unclosed blocks are not parsed as such: the guess was wrong
+        raise SegmentationError('Unclosed block')
+    segment = '\n'.join(current)
+    if segment.strip('\n'):
+        yield segment
+
+
+def split_segments(source, spans=SPANS):
+    """
+    Split a markdown source into top-level segments.
+
+    Return a tuple ``(segments, definitions)``: the segments and the text of
+    the definitions (see `iter_segments`). A source which can not be split
+    safely is returned as a single segment.
+    """
+    definitions = []
+    try:
+        segments = list(iter_segments(source.split('\n'), definitions, spans))
+    except SegmentationError:
+        return [source], ''
+    return segments, '\n'.join(definitions)
+
+
+def read_lines(infile, encoding='utf-8', tab_length=4):
+    """ Read lines from a file, normalizing whitespace as the preprocessors do. """
+    for index, line in enumerate(infile):
+        if isinstance(line, bytes):
+            line = line.decode(encoding)
+        line = line.rstrip('\n').rstrip('\r').expandtabs(tab_length)
+        if index and not line.strip(' '):
+            line = ''
+        yield line
+
+
+def shift_lines(html, offset):
+    """
+    Shift the source lines output in the html of a segment by `offset`, the
+    number of lines before the segment in the document.
+    """
+    if not offset or 'data-line="' not in html:
+        return html
+
+    def shift(m):
+        return '%s%d-%d"' % (m.group(1), int(m.group(2)) + offset, int(m.group(3)) + offset)
+    return DATA_LINE_RE.sub(shift, html)
+
+
+def get_spans(md):
+    """ Return the constructs which can span several blocks with `md`. """
+    spans = list(SPANS)
+    for processor in md.parser.blockprocessors.values():
+        if isinstance(processor, CommentsBlockProcessor):
+            spans.append((processor.START_RE, processor.END_RE))
+    return spans
+
+
+def merge_metadata(metadata, other):
+    """ Merge the metadata of a segment into the metadata of the document. """
+    for key, value in other.items():
+        if key not in metadata:
+            metadata[key] = value
+        elif isinstance(value, list):
+            metadata[key] = metadata[key] + value
+        elif isinstance(value, (set, frozenset)):
+            metadata[key] = metadata[key] | value
+        elif isinstance(value, dict):
+            metadata[key] = dict(metadata[key], **value)
+        else:
+            metadata[key] = value
+    return metadata
+
+
+class IncrementalRenderer(object):
+    """
+    Convert successive versions of a document, re-rendering changed blocks only.
+
+    `md` is the ZMarkdown instance used to render the segments, `maxsize`
+    is the number of segments kept in cache. After each conversion, the
+    metadata of the document are available as ``md.metadata`` and
+    `rendered` and `reused` give the number of rendered and cached segments.
+    """
+
+    def __init__(self, md, maxsize=1024):
+        self.md = md
+        self.spans = get_spans(md)
+        self.fragments = util.LRUCache(maxsize)
+        self.rendered = 0
+        self.reused = 0
+
+    def full_render(self, source):
+        """ Convert the whole document at once. """
+        self.rendered, self.reused = 1, 0
+        return self.md.convert(source)
+
+    def render_segment(self, segment, definitions):
+        """ Return the html and metadata of a segment, from the cache if possible. """
+        text = segment + '\n\n' + definitions if definitions else segment
+        key = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        fragment = self.fragments.get(key)
+        if fragment is None:
+            fragment = (self.md.convert(text), self.md.metadata)
+            if 'budget_exceeded' not in fragment[1]:
+                self.fragments.set(key, fragment)
+            self.rendered += 1
+        else:
+            self.reused += 1
+        return fragment
+
+    def convert(self, source):
+        """ Convert markdown to HTML, reusing the html of unchanged segments. """
+        # Normalize whitespace as the preprocessors do, so segments split alike
+        source = util.text_type(source).replace('\r\n', '\n').replace('\r', '\n')
+        source = re.sub(r'(?<=\n) +\n', '\n', source.expandtabs(self.md.tab_length))
+        if self.md.inline or FOOTNOTE_RE.search(source):
+            return self.full_render(source)
+
+        segments, definitions = split_segments(source, self.spans)
+        if len(segments) < 2:
+            return self.full_render(source)
+        if definitions and self.render_segment(definitions, '')[0]:
+            # Some lines only look like definitions
+            return self.full_render(source)
+
+        self.rendered = self.reused = 0
+        output = []
+        metadata = {}
+        # Fragments are cached with the source lines of their segment
+        offset = 0
+        for segment in segments:
+            html, segment_metadata = self.render_segment(segment, definitions)
+            if html:
+                output.append(shift_lines(html, offset) if self.md.source_lines else html)
+            merge_metadata(metadata, segment_metadata)
+            offset += segment.count('\n') + 1
+        output = '\n'.join(output)
+
+        # Ids are made unique over the whole document (title anchors...)
+        ids = ID_RE.findall(output)
+        if len(ids) != len(set(ids)) or any(STASH_KEY in anchor for anchor in ids):
+            return self.full_render(source)
+
+        self.md.reset()
+        # Cached fragments must not be altered through the document metadata
+        self.md.metadata = copy.deepcopy(metadata)
+        return output
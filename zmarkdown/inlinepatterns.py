@@ -20,6 +20,18 @@ capture the whole block.  For this reason, they all start with
 '^(.*)' and end with '(.*)!'.  In case with built-in expression
 Pattern takes care of adding the "^(.*)" and "(.*)!".
 
+Patterns can declare `triggers`, the characters a match can not be
+found without (at least one of them is part of every match), and
+`required`, the substrings every match contains: the inline processor only
+tries the patterns triggered by the characters of a text, if the text
+contains all their required substrings.
+
+Patterns can also be declared `resumable` when replacing one of their
+matches never creates a match before it, nor changes the matches after it:
+the inline processor then replaces all their matches in a single pass over
+the text, instead of searching the text again from its start after each
+match.
+
 Finally, the order in which regular expressions are applied is very
 important - e.g. if we first replace http://.../ links with <a> tags
 and _then_ try to replace inline html, we would end up with a mess.
@@ -66,22 +78,25 @@ def build_inlinepatterns(md_instance):
     """ Build the default set of inline patterns for Markdown. """
     inlinePatterns = odict.OrderedDict()
     inlinePatterns["backtick"] = BacktickPattern(BACKTICK_RE)
-    inlinePatterns["escape"] = EscapePattern(ESCAPE_RE, md_instance)
-    inlinePatterns["reference"] = ReferencePattern(REFERENCE_RE, md_instance)
-    inlinePatterns["link"] = LinkPattern(LINK_RE, md_instance)
-    inlinePatterns["image_link"] = ImagePattern(IMAGE_LINK_RE, md_instance)
-    inlinePatterns["image_reference"] = ImageReferencePattern(IMAGE_REFERENCE_RE, md_instance)
-    inlinePatterns["short_reference"] = ReferencePattern(SHORT_REF_RE, md_instance)
-    inlinePatterns["autolink"] = AutolinkPattern(AUTOLINK_RE, md_instance)
-    inlinePatterns["automail"] = AutomailPattern(AUTOMAIL_RE, md_instance)
-    inlinePatterns["linebreak"] = SubstituteTagPattern(LINE_BREAK_RE, 'br')
-    inlinePatterns["entity"] = HtmlPattern(ENTITY_RE, md_instance)
-    inlinePatterns["not_strong"] = SimpleTextPattern(NOT_STRONG_RE)
-    inlinePatterns["em_strong"] = DoubleTagPattern(EM_STRONG_RE, 'strong,em')
-    inlinePatterns["strong_em"] = DoubleTagPattern(STRONG_EM_RE, 'em,strong')
-    inlinePatterns["strong"] = SimpleTagPattern(STRONG_RE, 'strong')
-    inlinePatterns["emphasis"] = SimpleTagPattern(EMPHASIS_RE, 'em')
-    inlinePatterns["emphasis2"] = SimpleTagPattern(SMART_EMPHASIS_RE, 'em')
+    inlinePatterns["escape"] = EscapePattern(ESCAPE_RE, md_instance, triggers='\\', resumable=True)
+    inlinePatterns["reference"] = ReferencePattern(REFERENCE_RE, md_instance, triggers='[')
+    inlinePatterns["link"] = LinkPattern(LINK_RE, md_instance, triggers='[', required=('](',))
+    inlinePatterns["image_link"] = ImagePattern(IMAGE_LINK_RE, md_instance, triggers='!', required=('![',))
+    inlinePatterns["image_reference"] = ImageReferencePattern(IMAGE_REFERENCE_RE, md_instance, triggers='!',
+                                                              required=('![',))
+    inlinePatterns["short_reference"] = ReferencePattern(SHORT_REF_RE, md_instance, triggers='[')
+    inlinePatterns["autolink"] = AutolinkPattern(AUTOLINK_RE, md_instance, triggers='<', required=('://', '>'))
+    inlinePatterns["automail"] = AutomailPattern(AUTOMAIL_RE, md_instance, triggers='@', required=('<', '>'))
+    inlinePatterns["linebreak"] = SubstituteTagPattern(LINE_BREAK_RE, 'br', triggers='\n', required=('  \n',),
+                                                       resumable=True)
+    inlinePatterns["entity"] = HtmlPattern(ENTITY_RE, md_instance, triggers='&', required=(';',),
+                                           resumable=True)
+    inlinePatterns["not_strong"] = SimpleTextPattern(NOT_STRONG_RE, triggers='*_')
+    inlinePatterns["em_strong"] = DoubleTagPattern(EM_STRONG_RE, 'strong,em', triggers='*_')
+    inlinePatterns["strong_em"] = DoubleTagPattern(STRONG_EM_RE, 'em,strong', triggers='*_')
+    inlinePatterns["strong"] = SimpleTagPattern(STRONG_RE, 'strong', triggers='*_')
+    inlinePatterns["emphasis"] = SimpleTagPattern(EMPHASIS_RE, 'em', triggers='*')
+    inlinePatterns["emphasis2"] = SimpleTagPattern(SMART_EMPHASIS_RE, 'em', triggers='_')
     return inlinePatterns
 
 
@@ -176,22 +191,43 @@ def handleAttributes(text, parent):
 class Pattern(object):
     """Base class that inline patterns subclass. """
 
-    def __init__(self, pattern, zmarkdown_instance=None, not_in=()):
+    # Characters at least one of which is part of every match, None if unknown
+    triggers = None
+    # Substrings all of which are part of every match
+    required = ()
+    # Whether all the matches can be replaced in a single pass
+    resumable = False
+
+    def __init__(self, pattern, zmarkdown_instance=None, not_in=(), triggers=None, required=None,
+                 resumable=None):
         """
         Create an instant of an inline pattern.
 
         Keyword arguments:
 
         * pattern: A regular expression that matches a pattern
+        * triggers: The characters at least one of which is part of every
+          match, the pattern is not tried on text without them
+        * required: The substrings all of which are part of every match, the
+          pattern is not tried on text without one of them
+        * resumable: Whether replacing a match leaves the other matches of the
+          text unchanged, so that they can all be replaced in a single pass
 
         """
         self.pattern = pattern
-        self.compiled_re = re.compile("^(.*?)%s(.*?)$" % pattern,
-                                      re.DOTALL | re.UNICODE)
+        self.compiled_re = util.compile_regex("^(.*?)%s(.*?)$" % pattern,
+                                              re.DOTALL | re.UNICODE)
+        self.search_re = None
 
         # Api for Markdown to pass safe_mode into instance
         self.safe_mode = False
         self.not_in = not_in
+        if triggers is not None:
+            self.triggers = triggers
+        if required is not None:
+            self.required = required
+        if resumable is not None:
+            self.resumable = resumable
         if zmarkdown_instance:
             self.zmarkdown = zmarkdown_instance
 
@@ -199,6 +235,18 @@ class Pattern(object):
         """ Return a compiled regular expression. """
         return self.compiled_re
 
+    def getSearchRegExp(self):
+        """
+        Return a compiled regular expression searching the pattern anywhere
+        in a text. Its groups are numbered as the groups of the expression
+        returned by `getCompiledRegExp`, but the first and the last ones
+        are always empty.
+
+        """
+        if getattr(self, 'search_re', None) is None:
+            self.search_re = util.compile_regex("()%s()" % self.pattern, re.DOTALL | re.UNICODE)
+        return self.search_re
+
     def handleMatch(self, m):
         """Return a ElementTree element from the given match.
 
@@ -273,8 +321,8 @@ class SimpleTagPattern(Pattern):
 
     """
 
-    def __init__(self, pattern, tag):
-        Pattern.__init__(self, pattern)
+    def __init__(self, pattern, tag, **kwargs):
+        Pattern.__init__(self, pattern, **kwargs)
         self.tag = tag
 
     def handleMatch(self, m):
@@ -293,6 +341,8 @@ class SubstituteTagPattern(SimpleTagPattern):
 class BacktickPattern(Pattern):
     """ Return a `<code>` element containing the matching text. """
 
+    triggers = '`'
+
     def __init__(self, pattern):
         Pattern.__init__(self, pattern)
         self.tag = "code"
@@ -351,10 +401,29 @@ MAIL_RE = (r"[a-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[a-z0-9!#$%&'*+/=?^_`{|}~-]+)*"
            r"@(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+[a-z0-9](?:[a-z0-9-]*[a-z0-9])?")
 
 
+# Sanitized urls, shared by all the instances
+url_cache = util.LRUCache(maxsize=1024)
+
+
 def sanitize_url(url):
     """
     Sanitize a url against xss attacks in "safe_mode".
 
+    The sanitized urls are kept in `url_cache`, so that the links repeated
+    in a document or across documents are only parsed once.
+
+    """
+    sanitized = url_cache.get(url)
+    if sanitized is None:
+        sanitized = _sanitize_url(url)
+        url_cache.set(url, sanitized)
+    return sanitized
+
+
+def _sanitize_url(url):
+    """
+    Return `url` if it is safe, an empty string otherwise.
+
     Rather than specifically blacklisting `javascript:alert("XSS")` and all
     its aliases (see <http://ha.ckers.org/xss.html>), we whitelist known
     safe url formats. Most urls contain a network location, however some
@@ -45,24 +45,59 @@ class Postprocessor(util.Processor):
         pass  # pragma: no cover
 
 
+# A placeholder of the html stash, alone in a paragraph or not
+HTML_PLACEHOLDERS_RE = re.compile('<p>%s</p>|%s' % (util.HTML_PLACEHOLDER % r'([0-9]+)',
+                                                    util.HTML_PLACEHOLDER % r'([0-9]+)'))
+
+
 class RawHtmlPostprocessor(Postprocessor):
     """ Restore raw html to the document. """
 
     def run(self, text):
-        """ Iterate over html stash and restore "safe" html. """
-        for i in range(self.zmarkdown.htmlStash.html_counter):
-            html, safe = self.zmarkdown.htmlStash.rawHtmlBlocks[i]
-            if not safe:
-                html = self.escape(html)
-            if (self.isblocklevel(html) and safe):
-                text = text.replace(
-                    "<p>%s</p>" %
-                    (self.zmarkdown.htmlStash.get_placeholder(i)),
-                    html + "\n")
-            text = text.replace(
-                self.zmarkdown.htmlStash.get_placeholder(i), html
-            )
-        return text
+        """
+        Restore the stashed html in a single pass over the document.
+
+        A block-level placeholder alone in a paragraph replaces the whole
+        paragraph. As when the stash was restored entry by entry, the
+        placeholders found in a stashed html segment are only restored when
+        they were stored after that segment.
+        """
+        stash = self.zmarkdown.htmlStash
+        if not stash.html_counter:
+            return text
+        segments = {}
+
+        def segment(index):
+            """ Return the html of stash entry `index` and whether it is a block. """
+            if index not in segments:
+                html, safe = stash.rawHtmlBlocks[index]
+                if not safe:
+                    html = self.escape(html)
+                block = self.isblocklevel(html) and safe
+                segments[index] = (restore(html, index + 1), block)
+            return segments[index]
+
+        def substitute(m, first):
+            if m.group(1) is not None:
+                index = int(m.group(1))
+                if first <= index < stash.html_counter:
+                    html, block = segment(index)
+                    if block:
+                        return html + "\n"
+                    return "<p>%s</p>" % html
+                return m.group(0)
+            index = int(m.group(2))
+            if first <= index < stash.html_counter:
+                return segment(index)[0]
+            return m.group(0)
+
+        def restore(html, minimum):
+            """ Restore the placeholders of the entries from `minimum` in `html`. """
+            if minimum >= stash.html_counter or util.STX not in html:
+                return html
+            return HTML_PLACEHOLDERS_RE.sub(lambda m: substitute(m, minimum), html)
+
+        return restore(text, 0)
 
     def escape(self, html):
         """ Basic html escaping """
@@ -7,6 +7,7 @@ from . import odict
 def build_treeprocessors(md_instance):
     """ Build the default treeprocessors for Markdown. """
     treeprocessors = odict.OrderedDict()
+    treeprocessors["source_lines"] = SourceLinesTreeprocessor(md_instance)
     treeprocessors["inline"] = InlineProcessor(md_instance)
     treeprocessors["prettify"] = PrettifyTreeprocessor(md_instance)
     return treeprocessors
@@ -51,9 +52,31 @@ class InlineProcessor(Treeprocessor):
         self.__placeholder_length = 4 + len(self.__placeholder_prefix) \
                                       + len(self.__placeholder_suffix)
         self.__placeholder_re = util.INLINE_PLACEHOLDER_RE
+        # Characters a placeholder brings to the text it is inserted into
+        self.__placeholder_chars = frozenset(self.__placeholder_prefix + self.__placeholder_suffix + '0123456789')
         self.zmarkdown = md
         self.inlinePatterns = md.inlinePatterns
 
+    @property
+    def inlinePatterns(self):
+        """ Inline patterns applied to the document being converted. """
+        patterns = self._inlinePatterns
+        if patterns is self.zmarkdown.inlinePatterns:
+            # The document may extend the shared patterns (abbreviations)
+            context_patterns = self.zmarkdown.context.inlinePatterns
+            if context_patterns is not None:
+                return context_patterns
+        return patterns
+
+    @inlinePatterns.setter
+    def inlinePatterns(self, patterns):
+        self._inlinePatterns = patterns
+
+    @property
+    def stashed_nodes(self):
+        """ Nodes stashed while processing the document being converted. """
+        return self.zmarkdown.context.get_state(self)
+
     def __makePlaceholder(self, _):
         """ Generate a placeholder """
         idd = "%04d" % len(self.stashed_nodes)
@@ -89,6 +112,13 @@ class InlineProcessor(Treeprocessor):
         Process string with inline patterns and replace it
         with placeholders
 
+        The characters of the string are collected once, and only the
+        patterns triggered by one of them are tried (see `Pattern.triggers`),
+        if the string contains all their required substrings (see
+        `Pattern.required`). Skipped patterns are recorded in the
+        'inlinepattern.skip' category of the stats. This only filters the
+        patterns: each tried pattern still scans the whole string.
+
         Keyword arguments:
 
         * data: A line of Markdown text
@@ -99,48 +129,69 @@ class InlineProcessor(Treeprocessor):
         """
         if not isinstance(data, util.AtomicString):
             startIndex = 0
+            context = self.zmarkdown.context
+            stats = context.stats
+            budget = context.budget
+            chars = set(data)
             while patternIndex < len(self.inlinePatterns):
                 pattern = self.inlinePatterns.value_for_index(patternIndex)
-                if any(key in parents for key in pattern.not_in):
+                triggers = getattr(pattern, 'triggers', None)
+                if (triggers is not None and chars.isdisjoint(triggers)) or \
+                        not all(required in data for required in getattr(pattern, 'required', ())):
+                    # The pattern can not match
+                    matched = False
+                    if stats is not None:
+                        stats.record('inlinepattern.skip', self.inlinePatterns.keyOrder[patternIndex])
+                elif any(key in parents for key in pattern.not_in):
                     matched = False
                 else:
-                    data, matched, startIndex = self.__applyPattern(
-                        pattern, data, patternIndex, startIndex, parents=())
+                    if stats is not None or budget is not None:
+                        start = util.timer()
+                    resumable = getattr(pattern, 'resumable', False)
+                    if resumable:
+                        data, matched = self.__applyPatternOnce(pattern, data, patternIndex, parents=())
+                    else:
+                        data, matched, startIndex = self.__applyPattern(
+                            pattern, data, patternIndex, startIndex, parents=())
+                    if stats is not None or budget is not None:
+                        elapsed = util.timer() - start
+                        name = self.inlinePatterns.keyOrder[patternIndex]
+                        if stats is not None:
+                            stats.record('inlinepattern', name, elapsed, matched)
+                        if budget is not None:
+                            budget.check_pattern(name, elapsed)
+                    if matched and resumable:
+                        # All the matches are already replaced
+                        chars.update(self.__placeholder_chars)
+                        matched = False
                 if not matched:
                     patternIndex += 1
+                else:
+                    chars.update(self.__placeholder_chars)
         return data
 
-    def __processElementText(self, node, subnode, isText=True):
+    def __processElementText(self, node, isText=True):
         """
         Process placeholders in Element.text or Element.tail
         of Elements popped from self.stashed_nodes.
 
         Keywords arguments:
 
-        * node: parent node
-        * subnode: processing node
+        * node: processing node
         * isText: bool variable, True - it's text, False - it's tail
 
-        Returns: None
+        Returns: list with the ElementTree elements of the text, to insert
+        after the node for a tail, or as its first children for a text.
 
         """
         if isText:
-            text = subnode.text
-            subnode.text = None
+            text = node.text
+            node.text = None
         else:
-            text = subnode.tail
-            subnode.tail = None
+            text = node.tail
+            node.tail = None
 
-        childResult = self.__processPlaceholders(text, subnode, isText)
-
-        if not isText and node is not subnode:
-            pos = list(node).index(subnode) + 1
-        else:
-            pos = 0
-
-        childResult.reverse()
-        for newChild in childResult:
-            node.insert(pos, newChild)
+        return self.__processPlaceholders(text, node, isText)
 
     def __processPlaceholders(self, data, parent, isText=True):
         """
@@ -186,15 +237,28 @@ class InlineProcessor(Treeprocessor):
                         linkText(text)
 
                     if not isString(node):  # it's Element
+                        # Build the new list of children in a single pass
+                        children = []
                         for child in [node] + list(node):
+                            tailResult = textResult = []
                             if child.tail:
                                 if child.tail.strip():
-                                    self.__processElementText(
-                                        node, child, False
+                                    tailResult = self.__processElementText(
+                                        child, False
                                     )
                             if child.text:
                                 if child.text.strip():
-                                    self.__processElementText(child, child)
+                                    textResult = self.__processElementText(child)
+                            if child is node:
+                                # Both come first in the node
+                                children += textResult + tailResult
+                            else:
+                                if textResult:
+                                    child[:0] = textResult
+                                children.append(child)
+                                children += tailResult
+                        if len(children) != len(node):
+                            node[:] = children
                     else:  # it's just a string
                         linkText(node)
                         strartIndex = phEndIndex
@@ -243,6 +307,61 @@ class InlineProcessor(Treeprocessor):
         if node is None:
             return data, True, len(leftData)+match.span(len(match.groups()))[0]
 
+        placeholder = self.__stashMatch(node, pattern, patternIndex, parents)
+
+        return "%s%s%s%s" % (leftData,
+                             match.group(1),
+                             placeholder, match.groups()[-1]), True, 0
+
+    def __applyPatternOnce(self, pattern, data, patternIndex, parents=()):
+        """
+        Replace all the matches of a resumable pattern in a single pass.
+
+        The pattern is searched from the end of each match in the original
+        text, and the result is joined once from the text between the
+        matches and their placeholders. It is the text `__applyPattern`
+        returns once the pattern is not found anymore: the search after a
+        match the pattern did not handle only sees the rest of the text, and
+        every match replaced before the end of a text ending with a newline
+        removes this newline.
+
+        Keyword arguments:
+
+        * data: the text to be processed
+        * pattern: the pattern to be applied
+        * patternIndex: index of current pattern
+
+        Returns: String with placeholders instead of ElementTree elements,
+        and whether the pattern matched.
+
+        """
+        search = pattern.getSearchRegExp().search
+        segments = []
+        matched = False
+        end = offset = 0
+        length = len(data)
+        match = search(data)
+        while match:
+            matched = True
+            node = pattern.handleMatch(match)
+            start, stop = match.start() + offset, match.end() + offset
+            if node is None:
+                offset = stop
+                match = search(data[offset:length])
+            else:
+                segments.append(data[end:start])
+                segments.append(self.__stashMatch(node, pattern, patternIndex, parents))
+                if stop < length and data[length - 1] == '\n':
+                    length -= 1
+                end, offset = stop, 0
+                match = search(data, end, length)
+        if not segments:
+            return data, matched
+        segments.append(data[end:length])
+        return ''.join(segments), matched
+
+    def __stashMatch(self, node, pattern, patternIndex, parents):
+        """ Process the children of a matched node and return its placeholder. """
         if not isString(node):
             if not isinstance(node.text, util.AtomicString):
                 # We need to process current node too
@@ -258,11 +377,7 @@ class InlineProcessor(Treeprocessor):
                                 child.tail, patternIndex, parents
                             )
 
-        placeholder = self.__stashNode(node, pattern.type())
-
-        return "%s%s%s%s" % (leftData,
-                             match.group(1),
-                             placeholder, match.groups()[-1]), True, 0
+        return self.__stashNode(node, pattern.type())
 
     def run(self, tree):
         """Apply inline patterns to a parsed Markdown tree.
@@ -281,14 +396,21 @@ class InlineProcessor(Treeprocessor):
         Returns: ElementTree object with applied inline patterns.
 
         """
-        self.stashed_nodes = {}
+        self.zmarkdown.context.set_state(self, {})
 
         stack = [tree]
 
         while stack:
             currElement = stack.pop()
             insertQueue = []
-            for child in currElement:
+            # The elements of a tail are inserted after their node, and are
+            # processed next: build the new list of children in a single pass
+            children = []
+            pending = list(currElement)
+            pending.reverse()
+            while pending:
+                child = pending.pop()
+                children.append(child)
                 if child.text and not isinstance(
                     child.text, util.AtomicString
                 ):
@@ -306,21 +428,35 @@ class InlineProcessor(Treeprocessor):
                     tailResult = self.__processPlaceholders(tail, dumby, False)
                     if dumby.tail:
                         child.tail = dumby.tail
-                    pos = list(currElement).index(child) + 1
                     tailResult.reverse()
-                    for newChild in tailResult:
-                        currElement.insert(pos, newChild)
+                    pending += tailResult
                 if len(child):
                     stack.append(child)
+            if len(children) != len(currElement):
+                currElement[:] = children
 
             for element, lst in insertQueue:
-                i = 0
-                for newChild in lst:
-                    element.insert(i, newChild)
-                    i += 1
+                if lst:
+                    element[:0] = lst
         return tree
 
 
+class SourceLinesTreeprocessor(Treeprocessor):
+    """
+    Set the source lines recorded for the block elements (see
+    `BlockParser.locate`) as a ``data-line="first-last"`` attribute.
+    """
+
+    def run(self, root):
+        located = self.zmarkdown.context.blockLines
+        if not located:
+            return
+        for element, lines in located.items():
+            # The root element is stripped from the output
+            if element is not root:
+                element.set('data-line', '%d-%d' % lines)
+
+
 class PrettifyTreeprocessor(Treeprocessor):
     """ Add linebreaks to the html document. """
 
@@ -2,6 +2,9 @@
 from __future__ import unicode_literals
 import re
 import sys
+import threading
+import timeit
+from collections import OrderedDict
 
 # Python 3 Stuff
 # =============================================================================
@@ -123,6 +126,270 @@ class Processor(object):
             self.zmarkdown = zmarkdown_instance
 
 
+class RenderContext(object):
+    """
+    Hold the state of the conversion of a single document.
+
+    Everything which depends on the document being converted (stashed html,
+    references, metadata, parser state...) lives in a render context instead
+    of the ZMarkdown instance or its processors, so that one configured
+    instance can convert several documents at the same time from different
+    threads. Processors which need their own per-document storage use
+    `get_state` and `set_state`, keyed by the processor itself.
+    """
+
+    def __init__(self):
+        self.htmlStash = HtmlStash()
+        self.references = {}
+        self.metadata = {}
+        self.lines = []
+        # Inline patterns extended by the document itself (abbreviations).
+        # None means the patterns of the ZMarkdown instance are used as-is.
+        self.inlinePatterns = None
+        # RenderStats of the conversion, if profiling is enabled
+        self.stats = None
+        # Budget of the conversion, if resource limits are set
+        self.budget = None
+        # Source line (or table of source lines) of the block being parsed,
+        # and first and last source lines of the block-level elements by
+        # element, if they are recorded
+        self.blockLine = None
+        self.blockLines = None
+        self._states = {}
+
+    def get_state(self, owner, factory=dict):
+        """ Return the state stored for `owner`, creating it with `factory` if needed. """
+        try:
+            return self._states[id(owner)]
+        except KeyError:
+            state = self._states[id(owner)] = factory()
+            return state
+
+    def set_state(self, owner, state):
+        """ Replace the state stored for `owner`. """
+        self._states[id(owner)] = state
+        return state
+
+
+timer = timeit.default_timer
+
+
+class ProfileEntry(object):
+    """ Calls, hits and wall time recorded for a part of the pipeline. """
+
+    __slots__ = ('calls', 'hits', 'time')
+
+    def __init__(self):
+        self.calls = 0
+        self.hits = 0
+        self.time = 0.0
+
+    def as_dict(self):
+        return {'calls': self.calls, 'hits': self.hits, 'time': self.time}
+
+    def __repr__(self):
+        return 'ProfileEntry(calls=%d, hits=%d, time=%f)' % (self.calls, self.hits, self.time)
+
+
+class RenderStats(object):
+    """
+    Wall time and call counts of each part of a conversion.
+
+    Entries are grouped by category ('stage', 'preprocessor',
+    'blockprocessor.test', 'blockprocessor.skip', 'blockprocessor.run',
+    'inlinepattern', 'inlinepattern.skip', 'treeprocessor', 'postprocessor',
+    'cache') and named after the key of the processor in its ordered dict.
+    `hits` counts the successful block processor tests and inline pattern
+    matches, 'blockprocessor.skip' the blocks a block processor was not
+    tested on because of their leading characters, 'inlinepattern.skip' the
+    texts an inline pattern was not tried on because they lack its trigger
+    characters or required substrings. Times are inclusive: the run
+    of a block processor includes the blocks it parses recursively, an
+    inline pattern includes the patterns applied to the elements it creates.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+
+    def entry(self, category, name):
+        """ Return the entry of `name` in `category`, creating it if needed. """
+        key = (category, name)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = ProfileEntry()
+        return entry
+
+    def record(self, category, name, elapsed=0.0, hit=False):
+        """ Record a call of `name` lasting `elapsed` seconds. """
+        entry = self.entry(category, name)
+        entry.calls += 1
+        entry.time += elapsed
+        if hit:
+            entry.hits += 1
+
+    def category(self, category):
+        """ Return an ordered dict of the entries of `category`. """
+        return OrderedDict((name, entry) for (cat, name), entry in self.entries.items() if cat == category)
+
+    def as_dict(self):
+        """ Return the entries as nested dicts: category, name, then values. """
+        result = OrderedDict()
+        for (category, name), entry in self.entries.items():
+            result.setdefault(category, OrderedDict())[name] = entry.as_dict()
+        return result
+
+    def report(self, limit=None):
+        """ Return a text table of the entries, the slowest first. """
+        entries = sorted(self.entries.items(), key=lambda item: -item[1].time)[:limit]
+        lines = ['%-20s %-24s %8s %8s %12s' % ('category', 'name', 'calls', 'hits', 'time (ms)')]
+        for (category, name), entry in entries:
+            lines.append('%-20s %-24s %8d %8d %12.3f' % (category, name, entry.calls, entry.hits, entry.time * 1000))
+        return '\n'.join(lines)
+
+
+class BudgetExceeded(Exception):
+    """ Raised when the conversion of a document exceeds its resource budget. """
+
+
+class Budget(object):
+    """
+    Resource limits of the conversion of a document.
+
+    The time limits are checked between two blocks, two inline pattern
+    matches and two stages: a single regular expression match can not be
+    interrupted, but a slow one stops the conversion as soon as it returns.
+
+    Keyword arguments:
+
+    * timeout: Maximum time of the whole conversion, in seconds.
+    * max_depth: Maximum nesting depth of the block parser.
+    * pattern_timeout: Maximum time of a single inline pattern match.
+    """
+
+    def __init__(self, timeout=None, max_depth=None, pattern_timeout=None):
+        self.deadline = None if timeout is None else timer() + timeout
+        self.max_depth = max_depth
+        self.pattern_timeout = pattern_timeout
+        self.depth = 0
+
+    def check(self):
+        """ Raise BudgetExceeded if the conversion is over time. """
+        if self.deadline is not None and timer() > self.deadline:
+            raise BudgetExceeded('Conversion timeout exceeded')
+
+    def enter(self):
+        """ Enter a nested block, raising BudgetExceeded if it is too deep. """
+        self.depth += 1
+        if self.max_depth is not None and self.depth > self.max_depth:
+            raise BudgetExceeded('Maximum nesting depth of %d exceeded' % self.max_depth)
+        self.check()
+
+    def leave(self):
+        """ Leave a nested block. """
+        self.depth -= 1
+
+    def check_pattern(self, name, elapsed):
+        """ Check the `elapsed` time of a match of the inline pattern `name`. """
+        if self.pattern_timeout is not None and elapsed > self.pattern_timeout:
+            raise BudgetExceeded('Timeout of the inline pattern "%s" exceeded' % name)
+        self.check()
+
+
+class LRUCache(object):
+    """
+    A bounded mapping which discards the least recently used entries.
+
+    Entries are evicted once their total size exceeds `maxsize`. The size of
+    each entry is given by the `sizeof` function, or 1 if it is not set, so
+    that `maxsize` is the maximum number of entries. Hits and misses are
+    counted to check how useful the cache is. The cache is thread-safe.
+    """
+
+    def __init__(self, maxsize=128, sizeof=None):
+        self.maxsize = maxsize
+        self.sizeof = sizeof
+        self.clear()
+        self._lock = threading.Lock()
+
+    def clear(self):
+        """ Remove all entries and reset statistics. """
+        self._data = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """ Return the value stored for `key` and mark it as recently used. """
+        with self._lock:
+            try:
+                entry = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        """ Store `value` for `key`, evicting old entries if needed. """
+        size = self.sizeof(value) if self.sizeof is not None else 1
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            if size > self.maxsize:
+                return
+            self._data[key] = (value, size)
+            self.size += size
+            while self.size > self.maxsize:
+                _, (_, old_size) = self._data.popitem(last=False)
+                self.size -= old_size
+
+    def stats(self):
+        """ Return a dict of usage statistics. """
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+                'entries': len(self._data),
+                'size': self.size}
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+# Compiled regular expressions shared by all the instances
+regex_cache = LRUCache(maxsize=512)
+
+
+def compile_regex(source, flags=0):
+    """
+    Return the compiled regular expression of `source` with `flags`.
+
+    Expressions are compiled once per process and kept in `regex_cache`,
+    whose statistics count the expressions compiled (misses) and reused
+    (hits).
+    """
+    key = (source, flags)
+    regex = regex_cache.get(key)
+    if regex is None:
+        regex = re.compile(source, flags)
+        regex_cache.set(key, regex)
+    return regex
+
+
 class HtmlStash(object):
     """
     This class is used for stashing HTML objects that we extract